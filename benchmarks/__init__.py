@@ -0,0 +1 @@
+BENCHMARK_PASSWORD = 'bench-password-123'
@@ -0,0 +1,46 @@
+"""
+Compare two benchmarks.load reports endpoint by endpoint:
+
+    python -m benchmarks.compare base.json head.json --max-regression 0.15
+
+Exits with status 1 when any endpoint's p95 grew by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--max-regression', type=float, default=None, help='allowed relative p95 growth, e.g. 0.15')
+    args = parser.parse_args()
+
+    with open(args.base) as base_file, open(args.head) as head_file:
+        base, head = json.load(base_file), json.load(head_file)
+
+    print(f"base {base.get('commit')}  ->  head {head.get('commit')}")
+    regressions = []
+    for endpoint, stats in head['endpoints'].items():
+        before = base['endpoints'].get(endpoint)
+        if before is None:
+            print(f'  {endpoint:<55} new')
+            continue
+        change = (stats['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0
+        print(
+            f"  {endpoint:<55} p50 {before['p50_ms']:7.1f} -> {stats['p50_ms']:7.1f}ms  "
+            f"p95 {before['p95_ms']:7.1f} -> {stats['p95_ms']:7.1f}ms ({change:+.0%})  "
+            f"p99 {before['p99_ms']:7.1f} -> {stats['p99_ms']:7.1f}ms"
+        )
+        if args.max_regression is not None and change > args.max_regression:
+            regressions.append(endpoint)
+
+    print(f"throughput {base['throughput_rps']:.1f} -> {head['throughput_rps']:.1f} req/s")
+    if regressions:
+        print('p95 regressions: ' + ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Fill the configured database with synthetic catalog, user, cart and order
+rows, all through bulk_create:
+
+    python -m benchmarks.datagen --applications 50 --services 20 --users 2000 --orders 20000
+
+Every generated user can log in as ``bench_user_<n>`` with BENCHMARK_PASSWORD.
+"""
+import argparse
+import os
+import random
+import time
+from decimal import Decimal
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from benchmarks import BENCHMARK_PASSWORD
+from core.models import CustomUser
+from store.models import Application, Service, ServiceField, Discount, Customer, Cart, CartItem, Order, OrderItem
+from store.pricing import refresh_service_prices
+
+
+BATCH_SIZE = 1000
+
+FIELD_TEMPLATES = [
+    ('username', 'username', 'Account username'),
+    ('email', 'email', 'Account email'),
+    ('password', 'password', 'Account password'),
+]
+
+
+def extra_data_for(fields):
+    return {field.field_name: f'bench-{field.field_name}' for field in fields}
+
+
+@transaction.atomic
+def generate(applications=20, services=10, fields=2, users=200, carts=200, items_per_cart=3, orders=1000, items_per_order=2, seed=0):
+    rng = random.Random(seed)
+    counts = {}
+
+    discounts = Discount.objects.bulk_create(
+        Discount(name=f'Bench discount {percent}%', discount_percent=Decimal(percent)) for percent in (5, 10, 20, 50)
+    )
+
+    apps = Application.objects.bulk_create(
+        (Application(title=f'Bench application {i}', description=f'Synthetic application {i} ' * 5) for i in range(applications)),
+        batch_size=BATCH_SIZE,
+    )
+    counts['applications'] = len(apps)
+
+    service_rows = Service.objects.bulk_create(
+        (
+            Service(
+                name=f'Bench service {app.pk}-{i}',
+                application=app,
+                slug=f'bench-service-{app.pk}-{i}',
+                description=f'Synthetic service {i} ' * 5,
+                price=Decimal(rng.randrange(50_000, 5_000_000, 1000)),
+                discounts=rng.choice(discounts) if rng.random() < 0.3 else None,
+            )
+            for app in apps for i in range(services)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    counts['services'] = len(service_rows)
+    counts['service_prices'] = refresh_service_prices([service.pk for service in service_rows])
+
+    field_rows = ServiceField.objects.bulk_create(
+        (
+            ServiceField(service=service, field_name=name, field_type=field_type, label=label)
+            for service in service_rows for name, field_type, label in FIELD_TEMPLATES[:fields]
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    counts['service_fields'] = len(field_rows)
+    fields_by_service = {}
+    for field in field_rows:
+        fields_by_service.setdefault(field.service_id, []).append(field)
+
+    first_user = (CustomUser.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+    password = make_password(BENCHMARK_PASSWORD)
+    user_rows = CustomUser.objects.bulk_create(
+        (
+            CustomUser(username=f'bench_user_{first_user + i}', email=f'bench_user_{first_user + i}@example.com', password=password)
+            for i in range(users)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    # bulk_create skips post_save, so the customer profiles are created here.
+    customer_rows = Customer.objects.bulk_create(
+        (
+            Customer(user=user, phone_number=f'+98912{first_user + i:07d}', is_phone_verified=True)
+            for i, user in enumerate(user_rows)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    counts['users'] = len(user_rows)
+
+    cart_rows = Cart.objects.bulk_create((Cart() for _ in range(carts)), batch_size=BATCH_SIZE)
+    cart_items = CartItem.objects.bulk_create(
+        (
+            CartItem(cart=cart, service=service, quantity=rng.randint(1, 3), extra_data=extra_data_for(fields_by_service.get(service.pk, [])))
+            for cart in cart_rows for service in rng.sample(service_rows, min(items_per_cart, len(service_rows)))
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    counts['carts'] = len(cart_rows)
+    counts['cart_items'] = len(cart_items)
+
+    statuses = [Order.ORDER_STATUS_PAID, Order.ORDER_STATUS_UNPAID, Order.ORDER_STATUS_CANCELED]
+    order_rows = Order.objects.bulk_create(
+        (Order(customer=rng.choice(customer_rows), status=rng.choice(statuses)) for _ in range(orders)),
+        batch_size=BATCH_SIZE,
+    )
+    order_items = OrderItem.objects.bulk_create(
+        (
+            OrderItem(order=order, service=service, price=service.price, quantity=rng.randint(1, 3), extra_data=extra_data_for(fields_by_service.get(service.pk, [])))
+            for order in order_rows for service in rng.sample(service_rows, min(items_per_order, len(service_rows)))
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    counts['orders'] = len(order_rows)
+    counts['order_items'] = len(order_items)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--applications', type=int, default=20)
+    parser.add_argument('--services', type=int, default=10, help='services per application')
+    parser.add_argument('--fields', type=int, default=2, help='required fields per service')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--carts', type=int, default=200)
+    parser.add_argument('--items-per-cart', type=int, default=3)
+    parser.add_argument('--orders', type=int, default=1000)
+    parser.add_argument('--items-per-order', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    counts = generate(
+        applications=args.applications, services=args.services, fields=args.fields, users=args.users,
+        carts=args.carts, items_per_cart=args.items_per_cart, orders=args.orders,
+        items_per_order=args.items_per_order, seed=args.seed,
+    )
+    elapsed = time.perf_counter() - started
+    print(', '.join(f'{count} {name}' for name, count in counts.items()) + f' in {elapsed:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Drive a running server through the browse -> add to cart -> checkout -> pay
+-> callback flow with concurrent virtual users and write per-endpoint
+latency percentiles and throughput to a JSON file:
+
+    python -m benchmarks.stubs --port 9100 &
+    gunicorn -c gunicorn.conf.py   # with the gateway URLs pointing at the stubs
+    python -m benchmarks.datagen
+    python -m benchmarks.load --base-url http://127.0.0.1:8000 --users 20 --iterations 10 --output bench.json
+
+Compare two runs with ``python -m benchmarks.compare old.json new.json``.
+"""
+import argparse
+import json
+import random
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+from benchmarks import BENCHMARK_PASSWORD
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, endpoint, elapsed, ok):
+        with self.lock:
+            self.latencies[endpoint].append(elapsed)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def summary(self, duration):
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            endpoints[endpoint] = {
+                'requests': len(values),
+                'errors': self.errors[endpoint],
+                'throughput_rps': len(values) / duration,
+                'p50_ms': percentile(values, 0.50) * 1000,
+                'p95_ms': percentile(values, 0.95) * 1000,
+                'p99_ms': percentile(values, 0.99) * 1000,
+                'max_ms': values[-1] * 1000,
+            }
+        total = sum(len(values) for values in self.latencies.values())
+        return {
+            'duration_s': duration,
+            'requests': total,
+            'errors': sum(self.errors.values()),
+            'throughput_rps': total / duration,
+            'endpoints': endpoints,
+        }
+
+
+class VirtualUser:
+    def __init__(self, base_url, username, recorder):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.recorder = recorder
+        self.session = requests.Session()
+
+    def call(self, method, endpoint, path, expected=(200,), **kwargs):
+        started = time.perf_counter()
+        response = self.session.request(method, self.base_url + path, **kwargs)
+        elapsed = time.perf_counter() - started
+        ok = response.status_code in expected
+        self.recorder.add(f'{method} {endpoint}', elapsed, ok)
+        if not ok:
+            raise RuntimeError(f'{method} {path} returned {response.status_code}: {response.text[:200]}')
+        return response.json() if response.content else None
+
+    def login(self):
+        tokens = self.call('POST', '/auth/jwt/create/', '/auth/jwt/create/', json={'username': self.username, 'password': BENCHMARK_PASSWORD})
+        self.session.headers['Authorization'] = f"JWT {tokens['access']}"
+
+    def run_flow(self, rng):
+        applications = self.call('GET', '/applications/', '/applications/')['results']
+        application_id = rng.choice(applications)['id']
+        services = self.call('GET', '/applications/{id}/services/', f'/applications/{application_id}/services/')['results']
+        if not services:
+            return
+        service = rng.choice(services)
+        self.call('GET', '/applications/{id}/services/{id}/', f"/applications/{application_id}/services/{service['id']}/")
+        self.call('GET', '/applications/{id}/services/{id}/comments/', f"/applications/{application_id}/services/{service['id']}/comments/")
+
+        cart = self.call('POST', '/carts/', '/carts/', expected=(201,))
+        extra_data = {field['field_name']: f'bench-{field["field_name"]}' for field in service['required_fields']}
+        self.call('POST', '/carts/{id}/items/', f"/carts/{cart['id']}/items/", expected=(201,), json={'service': service['id'], 'quantity': 1, 'extra_data': extra_data})
+        self.call('GET', '/carts/{id}/', f"/carts/{cart['id']}/")
+
+        order = self.call('POST', '/orders/', '/orders/', expected=(201,), json={'cart_id': cart['id']})
+        payment = self.call('POST', '/orders/{id}/pay/', f"/orders/{order['id']}/pay/")
+        authority = payment['payment_url'].rsplit('/', 1)[-1]
+        self.call('GET', '/orders/{id}/callback/', f"/orders/{order['id']}/callback/", params={'Authority': authority, 'Status': 'OK'})
+        self.call('GET', '/orders/', '/orders/')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--users', type=int, default=10, help='concurrent virtual users')
+    parser.add_argument('--iterations', type=int, default=5, help='flows per virtual user')
+    parser.add_argument('--first-user', type=int, default=1, help='n of the first bench_user_<n> to log in as')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench.json')
+    args = parser.parse_args()
+
+    recorder = Recorder()
+    failures = []
+
+    def worker(index):
+        rng = random.Random(args.seed + index)
+        user = VirtualUser(args.base_url, f'bench_user_{args.first_user + index}', recorder)
+        try:
+            user.login()
+            for _ in range(args.iterations):
+                user.run_flow(rng)
+        except Exception as e:
+            failures.append(str(e))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as executor:
+        list(executor.map(worker, range(args.users)))
+    duration = time.perf_counter() - started
+
+    report = {
+        'commit': git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'parameters': vars(args),
+        'failures': failures[:20],
+        **recorder.summary(duration),
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+
+    print(f"{report['requests']} requests in {duration:.1f}s ({report['throughput_rps']:.1f} req/s), {report['errors']} errors")
+    for endpoint, stats in report['endpoints'].items():
+        print(f"  {endpoint:<55} p50={stats['p50_ms']:7.1f}ms p95={stats['p95_ms']:7.1f}ms p99={stats['p99_ms']:7.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
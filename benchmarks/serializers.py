@@ -0,0 +1,215 @@
+"""
+Microbenchmarks for the serializers and pricing code that run on every
+request. Object graphs of 10/100/1000 rows are built in memory, so the
+numbers exclude the database and every case must run without queries:
+
+    python -m benchmarks.serializers --output serializers.json
+    python -m benchmarks.serializers --baseline serializers.json --max-regression 0.15
+
+With --baseline, exits with status 1 when a case loses more than
+--max-regression of its ops/sec, allocates that much more peak memory, or
+starts issuing queries.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+from itertools import cycle
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
+
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+from django.utils import timezone
+
+from core.models import CustomUser
+from store.models import Application, Service, ServiceField, ServicePrice, Discount, Customer, Cart, CartItem, Order, OrderItem
+from store.serializers import ApplicationSerializer, ServiceSerializer, CartSerializer, OrderSerializer
+
+
+SIZES = (10, 100, 1000)
+
+
+def prefetched(instance, name, objects):
+    """Attach ``objects`` as if prefetch_related(name) had loaded them."""
+    queryset = getattr(instance, name).model.objects.all()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[name] = queryset
+
+
+def build_services(count):
+    discounts = [Discount(pk=pk, name=f'Discount {pk}', discount_percent=Decimal(pk * 5)) for pk in range(1, 5)]
+    application = Application(pk=1, title='Application', description='Synthetic application')
+    services = []
+    for pk, discount in zip(range(1, count + 1), cycle(discounts + [None])):
+        service = Service(
+            pk=pk, name=f'Service {pk}', slug=f'service-{pk}', application=application,
+            description='Synthetic service ' * 5, price=Decimal(100_000 + pk * 1000), discounts=discount,
+            image=f'services/images/service_{pk}.jpg' if pk % 2 else None,
+        )
+        price = service.price * (100 - discount.discount_percent) / 100 if discount else service.price
+        ServicePrice(service=service, discount=discount, price=price.quantize(Decimal('0.01')), refreshed_at=timezone.now())
+        prefetched(service, 'required_fields', [
+            ServiceField(pk=pk * 2 + offset, service=service, field_name=name, field_type=name, label=name.title())
+            for offset, name in enumerate(('username', 'password'))
+        ])
+        services.append(service)
+    return services
+
+
+def build_applications(count):
+    return [
+        Application(
+            pk=pk, title=f'Application {pk}', description='Synthetic application ' * 5,
+            image=f'applications/images/application_{pk}.jpg' if pk % 2 else None,
+        )
+        for pk in range(1, count + 1)
+    ]
+
+
+def build_cart(count):
+    cart = Cart(pk='8b0e6c1e-5f43-4d7e-9c55-0f7d0f1f6d01', datetime_created=timezone.now())
+    prefetched(cart, 'items', [
+        CartItem(pk=pk, cart=cart, service=service, quantity=pk % 3 + 1, extra_data={'username': f'user{pk}', 'password': 'secret'})
+        for pk, service in enumerate(build_services(count), start=1)
+    ])
+    return cart
+
+
+def build_order(count):
+    user = CustomUser(pk=1, username='customer')
+    order = Order(pk=1, customer=Customer(pk=1, user=user), datetime_created=timezone.now(), status=Order.ORDER_STATUS_PAID)
+    prefetched(order, 'items', [
+        OrderItem(pk=pk, order=order, service=service, price=service.get_discounted_price(), quantity=pk % 3 + 1, extra_data={'username': f'user{pk}'})
+        for pk, service in enumerate(build_services(count), start=1)
+    ])
+    return order
+
+
+def cases(request):
+    context = {'request': request}
+    return {
+        'ApplicationSerializer(many=True)': (
+            build_applications, lambda applications: ApplicationSerializer(applications, many=True, context=context).data
+        ),
+        'ServiceSerializer(many=True)': (
+            build_services, lambda services: ServiceSerializer(services, many=True, context=context).data
+        ),
+        'CartSerializer': (
+            build_cart, lambda cart: CartSerializer(cart, context=context).data
+        ),
+        'OrderSerializer': (
+            build_order, lambda order: OrderSerializer(order, context=context).data
+        ),
+        'Service.get_discounted_price': (
+            build_services, lambda services: [service.get_discounted_price() for service in services]
+        ),
+    }
+
+
+def ops_per_second(run, min_time, repeats):
+    best = 0
+    for _ in range(repeats):
+        loops = 0
+        started = time.perf_counter()
+        while True:
+            run()
+            loops += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_time:
+                break
+        best = max(best, loops / elapsed)
+    return best
+
+
+def peak_allocation(run, repeats):
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(repeats):
+            gc.collect()
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - baseline)
+    finally:
+        tracemalloc.stop()
+    return min(peaks)
+
+
+def measure(sizes, min_time, repeats):
+    request = RequestFactory().get('/')
+    results = {}
+    for name, (build, serialize) in cases(request).items():
+        for size in sizes:
+            graph = build(size)
+            run = lambda: serialize(graph)
+            with CaptureQueriesContext(connection) as queries:
+                run()
+            results[f'{name}[{size}]'] = {
+                'queries': len(queries),
+                'ops_per_second': ops_per_second(run, min_time, repeats),
+                'peak_bytes': peak_allocation(run, repeats),
+            }
+    return results
+
+
+def regressions(results, baseline, max_regression):
+    found = []
+    for case, stats in results.items():
+        before = baseline.get(case)
+        if before is None:
+            continue
+        if stats['queries'] > before['queries']:
+            found.append(f"{case}: {before['queries']} -> {stats['queries']} queries")
+        if stats['ops_per_second'] < before['ops_per_second'] * (1 - max_regression):
+            found.append(f"{case}: {before['ops_per_second']:.0f} -> {stats['ops_per_second']:.0f} ops/s")
+        if stats['peak_bytes'] > before['peak_bytes'] * (1 + max_regression):
+            found.append(f"{case}: {before['peak_bytes']} -> {stats['peak_bytes']} peak bytes")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per timing repeat')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file from an earlier --output run')
+    parser.add_argument('--max-regression', type=float, default=0.15, help='allowed relative slowdown or memory growth')
+    args = parser.parse_args()
+
+    # Lets build_absolute_uri() accept the RequestFactory host.
+    setup_test_environment()
+    results = measure(args.sizes, args.min_time, args.repeats)
+
+    for case, stats in results.items():
+        print(f"{case:<42} {stats['ops_per_second']:>10.1f} ops/s  {stats['peak_bytes'] / 1024:>9.1f} KiB peak  {stats['queries']} queries")
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    failures = [f'{case}: {stats["queries"]} queries' for case, stats in results.items() if stats['queries']]
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            failures += regressions(results, json.load(baseline), args.max_regression)
+    if failures:
+        print('Regressions:\n  ' + '\n  '.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
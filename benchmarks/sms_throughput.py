@@ -0,0 +1,69 @@
+"""
+Compare SMS dispatch strategies against a local stand-in Kavenegar server:
+
+    python -m benchmarks.sms_throughput --messages 2000 --batch-size 100
+"""
+import argparse
+import json
+import os
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
+
+import requests
+from django.conf import settings
+
+from benchmarks.stubs import StubServer
+from store.sms import SessionKavenegarAPI
+
+
+def fresh_client_per_message(base_url, messages):
+    for phone, message in messages:
+        with requests.Session() as session:
+            session.post(f'{base_url}/key/sms/send.json', data={'sender': settings.KAVENEGAR_SENDER, 'receptor': phone, 'message': message})
+
+
+def reused_client(base_url, messages):
+    client = SessionKavenegarAPI('key', base_url)
+    for phone, message in messages:
+        client.sms_send({'sender': settings.KAVENEGAR_SENDER, 'receptor': phone, 'message': message})
+
+
+def batched_client(base_url, messages, batch_size):
+    client = SessionKavenegarAPI('key', base_url)
+    for start in range(0, len(messages), batch_size):
+        batch = messages[start:start + batch_size]
+        client.sms_sendarray({
+            'sender': json.dumps([settings.KAVENEGAR_SENDER] * len(batch)),
+            'receptor': json.dumps([phone for phone, _ in batch]),
+            'message': json.dumps([message for _, message in batch]),
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=settings.SMS_BATCH_SIZE)
+    args = parser.parse_args()
+
+    messages = [(f'0912{i:07d}', f'Benchmark message {i}') for i in range(args.messages)]
+    strategies = [
+        ('new connection per message', lambda url: fresh_client_per_message(url, messages)),
+        ('reused client', lambda url: reused_client(url, messages)),
+        (f'array send (batch={args.batch_size})', lambda url: batched_client(url, messages, args.batch_size)),
+    ]
+
+    for name, run in strategies:
+        with StubServer() as server:
+            started = time.perf_counter()
+            run(server.url)
+            elapsed = time.perf_counter() - started
+            assert server.messages_received == len(messages)
+        print(f'{name:<32} {len(messages) / elapsed:>10.0f} msg/s  ({elapsed:.2f}s)')
+
+
+if __name__ == '__main__':
+    main()
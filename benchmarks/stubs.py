@@ -0,0 +1,105 @@
+"""
+Stand-ins for the Kavenegar and ZarinPal APIs. Run both on one port with
+
+    python -m benchmarks.stubs --port 9100
+
+and point the server at it:
+
+    KAVENEGAR_API_URL=http://127.0.0.1:9100/v1
+    ZARINPAL_REQUEST_URL=http://127.0.0.1:9100/pg/v4/payment/request.json
+    ZARINPAL_VERIFY_URL=http://127.0.0.1:9100/pg/v4/payment/verify.json
+"""
+import argparse
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from urllib.parse import parse_qs
+
+
+class GatewayStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = 64 * 1024
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length).decode('utf-8')
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.read_body()
+        if '/sms/' in self.path:
+            self.kavenegar(self.path, {key: values[0] for key, values in parse_qs(body).items()})
+        elif self.path.endswith('/payment/request.json'):
+            authority = f'A{next(self.server.authorities):035d}'
+            self.send_json({'data': {'code': 100, 'message': 'Success', 'authority': authority}, 'errors': []})
+        elif self.path.endswith('/payment/verify.json'):
+            self.send_json({'data': {'code': 100, 'message': 'Verified', 'ref_id': next(self.server.ref_ids)}, 'errors': []})
+        else:
+            self.send_json({'errors': {'message': 'Unknown stub endpoint'}}, status=404)
+
+    def kavenegar(self, path, form):
+        if path.endswith('/sms/sendarray.json'):
+            receptors = json.loads(form.get('receptor', '[]'))
+        else:
+            receptors = [form.get('receptor')]
+        self.server.messages_received += len(receptors)
+        entries = [{'messageid': i, 'receptor': receptor, 'status': 1} for i, receptor in enumerate(receptors)]
+        self.send_json({'return': {'status': 200, 'message': 'ok'}, 'entries': entries})
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler_class=GatewayStubHandler, port=0):
+        super().__init__(('127.0.0.1', port), handler_class)
+        self.messages_received = 0
+        self.authorities = count(1)
+        self.ref_ids = count(1)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def get_request(self):
+        conn, address = super().get_request()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn, address
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=9100)
+    args = parser.parse_args()
+
+    server = StubServer(port=args.port)
+    print(f'Gateway stubs listening on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
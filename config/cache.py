@@ -0,0 +1,325 @@
+import json
+import logging
+import math
+import os
+import pickle
+import random
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from uuid import uuid4
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.redis import RedisCache
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# Values stored through get_or_set() carry how long they took to compute and
+# when they expire, so readers can refresh them probabilistically before they
+# actually expire (XFetch) instead of all missing at the same moment.
+CachedValue = namedtuple('CachedValue', ['value', 'delta', 'expires_at'])
+
+MISSING = object()
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LocalTier:
+    """
+    Bounded in-process LRU shared by every thread of a worker. Other processes
+    announce the keys they change on a pub/sub channel and a daemon thread
+    evicts them here; entries also never outlive ``timeout`` seconds, which
+    bounds staleness if the subscription drops. Values are kept pickled, so
+    like any Django cache every get() hands out a fresh copy that callers
+    may mutate.
+    """
+
+    def __init__(self, channel, max_entries, timeout):
+        self.channel = channel
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.pid = None
+        self.origin = None
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return MISSING
+            self.entries.move_to_end(key)
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout):
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            if timeout <= 0:
+                self.entries.pop(key, None)
+                return
+            self.entries[key] = (value, time.monotonic() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def ensure_subscribed(self, get_client):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            # A forked worker inherits the parent's entries but not its thread.
+            self.entries.clear()
+            self.pid = os.getpid()
+            self.origin = uuid4().hex
+            thread = threading.Thread(target=self.listen, args=(get_client,), name='cache-invalidation', daemon=True)
+            thread.start()
+
+    def listen(self, get_client):
+        while True:
+            try:
+                pubsub = get_client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Anything published while we were not subscribed is lost.
+                self.clear()
+                for message in pubsub.listen():
+                    self.handle(message['data'])
+            except Exception:
+                logger.warning("Cache invalidation subscriber disconnected, retrying", exc_info=True)
+                self.clear()
+                time.sleep(1)
+
+    def handle(self, data):
+        payload = json.loads(data)
+        if payload['origin'] == self.origin:
+            return
+        if payload['keys'] is None:
+            self.clear()
+        else:
+            self.discard(payload['keys'])
+
+    def publish(self, client, keys):
+        client.publish(self.channel, json.dumps({'origin': self.origin, 'keys': keys}))
+
+
+_local_tiers = {}
+_local_tiers_lock = threading.Lock()
+
+
+def get_local_tier(channel, max_entries, timeout):
+    with _local_tiers_lock:
+        if channel not in _local_tiers:
+            _local_tiers[channel] = LocalTier(channel, max_entries, timeout)
+        return _local_tiers[channel]
+
+
+class TwoTierRedisCache(RedisCache):
+    """
+    RedisCache with an in-process LRU (L1) in front of Redis (L2).
+
+    Extra ``OPTIONS``: ``LOCAL_MAX_ENTRIES``, ``LOCAL_TIMEOUT`` (seconds an L1
+    entry may live), ``INVALIDATION_CHANNEL``, ``LOCK_TIMEOUT`` (seconds a
+    get_or_set() miss may hold its single-flight lock) and
+    ``EARLY_EXPIRY_BETA`` (values above 1 refresh earlier).
+    """
+
+    def __init__(self, server, params):
+        params = dict(params)
+        options = dict(params.get('OPTIONS', {}))
+        local_max_entries = options.pop('LOCAL_MAX_ENTRIES', 1000)
+        local_timeout = options.pop('LOCAL_TIMEOUT', 5)
+        channel = options.pop('INVALIDATION_CHANNEL', 'cache:invalidate')
+        self.lock_timeout = options.pop('LOCK_TIMEOUT', 10)
+        self.early_expiry_beta = options.pop('EARLY_EXPIRY_BETA', 1.0)
+        params['OPTIONS'] = options
+        super().__init__(server, params)
+        self.local = get_local_tier(channel, local_max_entries, local_timeout)
+        self.local_locks = [threading.Lock() for _ in range(64)]
+
+    def get_client(self, write=False):
+        return self._cache.get_client(write=write)
+
+    def invalidate(self, keys):
+        self.local.ensure_subscribed(lambda: self.get_client(write=True))
+        if keys is None:
+            self.local.clear()
+        else:
+            self.local.discard(keys)
+        self.local.publish(self.get_client(write=True), keys)
+
+    def fetch(self, key):
+        self.local.ensure_subscribed(lambda: self.get_client(write=True))
+        value = self.local.get(key)
+        if value is MISSING:
+            value = self._cache.get(key, MISSING)
+            if value is not MISSING:
+                self.local.set(key, value, self.local_timeout_for(value))
+        metrics.increment('cache_miss' if value is MISSING else 'cache_hit')
+        return value
+
+    def local_timeout_for(self, value):
+        if isinstance(value, CachedValue) and value.expires_at is not None:
+            return value.expires_at - time.time()
+        return None
+
+    def unwrap(self, value):
+        return value.value if isinstance(value, CachedValue) else value
+
+    def get(self, key, default=None, version=None):
+        value = self.fetch(self.make_and_validate_key(key, version=version))
+        return default if value is MISSING else self.unwrap(value)
+
+    def get_many(self, keys, version=None):
+        key_map = {self.make_and_validate_key(key, version=version): key for key in keys}
+        self.local.ensure_subscribed(lambda: self.get_client(write=True))
+        found = {}
+        remote_keys = []
+        for key in key_map:
+            value = self.local.get(key)
+            if value is MISSING:
+                remote_keys.append(key)
+            else:
+                found[key] = value
+        if remote_keys:
+            for key, value in self._cache.get_many(remote_keys).items():
+                self.local.set(key, value, self.local_timeout_for(value))
+                found[key] = value
+        for _ in found:
+            metrics.increment('cache_hit')
+        for _ in range(len(key_map) - len(found)):
+            metrics.increment('cache_miss')
+        return {key_map[key]: self.unwrap(value) for key, value in found.items()}
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = super().add(key, value, timeout=timeout, version=version)
+        if added:
+            self.invalidate([self.make_and_validate_key(key, version=version)])
+        return added
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        super().set(key, value, timeout=timeout, version=version)
+        self.invalidate([self.make_and_validate_key(key, version=version)])
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        touched = super().touch(key, timeout=timeout, version=version)
+        self.invalidate([self.make_and_validate_key(key, version=version)])
+        return touched
+
+    def delete(self, key, version=None):
+        deleted = super().delete(key, version=version)
+        self.invalidate([self.make_and_validate_key(key, version=version)])
+        return deleted
+
+    def incr(self, key, delta=1, version=None):
+        value = super().incr(key, delta=delta, version=version)
+        self.invalidate([self.make_and_validate_key(key, version=version)])
+        return value
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = super().set_many(data, timeout=timeout, version=version)
+        if data:
+            self.invalidate([self.make_and_validate_key(key, version=version) for key in data])
+        return failed
+
+    def delete_many(self, keys, version=None):
+        super().delete_many(keys, version=version)
+        if keys:
+            self.invalidate([self.make_and_validate_key(key, version=version) for key in keys])
+
+    def clear(self):
+        cleared = super().clear()
+        self.invalidate(None)
+        return cleared
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Like BaseCache.get_or_set(), but on a miss only one caller across all
+        processes computes ``default`` while the rest wait for its result, and
+        hot values are recomputed by a single caller shortly before expiry.
+        """
+        cache_key = self.make_and_validate_key(key, version=version)
+        cached = self.fetch(cache_key)
+        if cached is not MISSING:
+            if not self.should_refresh_early(cached):
+                return self.unwrap(cached)
+            token = self.acquire_lock(cache_key, blocking=False)
+            if token is None:
+                return self.unwrap(cached)
+            try:
+                return self.compute(key, default, timeout, version)
+            finally:
+                self.release_lock(cache_key, token)
+
+        with self.local_locks[hash(cache_key) % len(self.local_locks)]:
+            cached = self.fetch(cache_key)
+            if cached is not MISSING:
+                return self.unwrap(cached)
+            token = self.acquire_lock(cache_key)
+            try:
+                if token is None:
+                    cached = self.fetch(cache_key)
+                    if cached is not MISSING:
+                        return self.unwrap(cached)
+                return self.compute(key, default, timeout, version)
+            finally:
+                if token is not None:
+                    self.release_lock(cache_key, token)
+
+    def should_refresh_early(self, cached):
+        if not isinstance(cached, CachedValue) or cached.expires_at is None:
+            return False
+        gap = -cached.delta * self.early_expiry_beta * math.log(1 - random.random())
+        return time.time() + gap >= cached.expires_at
+
+    def compute(self, key, default, timeout, version):
+        started = time.time()
+        value = default() if callable(default) else default
+        delta = time.time() - started
+        backend_timeout = self.get_backend_timeout(timeout)
+        expires_at = None if backend_timeout is None else time.time() + backend_timeout
+        self.set(key, CachedValue(value, delta, expires_at), timeout=timeout, version=version)
+        return value
+
+    def acquire_lock(self, cache_key, blocking=True):
+        """
+        Take the single-flight lock for ``cache_key``. When blocking and the
+        lock is held elsewhere, wait until the holder has stored a value or
+        the lock lapses, then return None.
+        """
+        client = self.get_client(write=True)
+        lock_key = f'{cache_key}:lock'
+        token = uuid4().hex
+        if client.set(lock_key, token, nx=True, ex=self.lock_timeout):
+            return token
+        if blocking:
+            deadline = time.monotonic() + self.lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                if client.exists(cache_key) or not client.exists(lock_key):
+                    break
+        return None
+
+    def release_lock(self, cache_key, token):
+        self.get_client(write=True).eval(RELEASE_LOCK_SCRIPT, 1, f'{cache_key}:lock', token)
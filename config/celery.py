@@ -1,5 +1,8 @@
 import os
 from celery import Celery
+from kombu import Queue
+
+from . import task_metrics  # noqa: F401  (connects the task signal handlers)
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
@@ -7,4 +10,22 @@ app = Celery('config')
 
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
-app.autodiscover_tasks()
\ No newline at end of file
+# OTP codes get their own queue and worker so a marketing burst sitting in
+# ``notifications`` can never delay a login code.
+TASK_QUEUES = ('default', 'otp', 'notifications', 'payments', 'maintenance')
+
+app.conf.task_default_queue = 'default'
+app.conf.task_queues = [Queue(name, routing_key=name) for name in TASK_QUEUES]
+app.conf.task_routes = {
+    'store.tasks.send_sms_task': {'queue': 'otp'},
+    'store.tasks.flush_sms_outbox_task': {'queue': 'notifications'},
+    'store.tasks.refresh_service_prices_task': {'queue': 'maintenance'},
+    'store.tasks.refresh_due_service_prices_task': {'queue': 'maintenance'},
+    'store.tasks.process_image_upload_task': {'queue': 'maintenance'},
+    'store.tasks.delete_stale_uploads_task': {'queue': 'maintenance'},
+    'store.tasks.relay_outbox_task': {'queue': 'notifications'},
+    'store.tasks.fulfill_order_items_task': {'queue': 'payments'},
+}
+app.conf.worker_prefetch_multiplier = 1
+
+app.autodiscover_tasks()
@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def accepted_encodings(header):
+    """Parse Accept-Encoding into {coding: q}; q=0 entries are kept, as they refuse a coding."""
+    encodings = {}
+    for part in header.split(','):
+        coding, *params = (item.strip() for item in part.split(';'))
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        encodings[coding.lower()] = quality
+    return encodings
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compresses responses of at least ``COMPRESSION_MIN_SIZE`` bytes with
+    brotli or gzip, whichever the client prefers (brotli on a tie, and only
+    when the brotli package is installed). Streaming responses are gzipped
+    as GZipMiddleware does.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming:
+            return super().process_response(request, response)
+        if len(response.content) < settings.COMPRESSION_MIN_SIZE or response.has_header('Content-Encoding'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if encoding == 'br':
+            compressed_content = brotli.compress(response.content, mode=brotli.MODE_TEXT, quality=settings.COMPRESSION_BROTLI_QUALITY)
+        else:
+            compressed_content = compress_string(response.content, max_random_bytes=self.max_random_bytes)
+        if len(compressed_content) >= len(response.content):
+            return response
+
+        response.content = compressed_content
+        response.headers['Content-Length'] = str(len(compressed_content))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def choose_encoding(self, header):
+        accepted = accepted_encodings(header)
+        supported = ['br', 'gzip'] if brotli is not None else ['gzip']
+        wildcard = accepted.get('*', 0)
+        best, best_quality = None, 0
+        for encoding in supported:
+            quality = accepted.get(encoding, wildcard)
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
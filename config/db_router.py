@@ -0,0 +1,81 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def primary_pin_cache_key(user_id):
+    return f'db_pin_primary_{user_id}'
+
+
+def pin_to_primary(user):
+    cache.set(primary_pin_cache_key(user.pk), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def primary_pin_exempt(view_func):
+    """Mark a view that pins users itself, so PrimaryStickinessMiddleware leaves it alone."""
+    view_func.primary_pin_exempt = True
+    return view_func
+
+
+def is_pinned_to_primary(user):
+    if not user or not user.is_authenticated:
+        return False
+    return bool(cache.get(primary_pin_cache_key(user.pk)))
+
+
+def start_replica_reads():
+    return _replica_reads.set(True)
+
+
+def stop_replica_reads(token):
+    _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to a random replica, but only between start_replica_reads()
+    and stop_replica_reads(); everything else, and every write, stays on
+    ``default``.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+class PrimaryStickinessMiddleware:
+    """
+    After a successful write, keep that user's reads on the primary for
+    ``REPLICA_STICKY_SECONDS`` so they never read their own write from a
+    lagging replica. DRF copies the authenticated user onto the Django
+    request, so JWT users are seen here too. Views marked with
+    primary_pin_exempt() are skipped.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if getattr(request, 'primary_pin_exempt', False):
+            return response
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                pin_to_primary(user)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.primary_pin_exempt = getattr(view_func, 'primary_pin_exempt', False)
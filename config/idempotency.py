@@ -0,0 +1,145 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .locks import acquire_lock, release_lock
+
+
+IDEMPOTENT_METHODS = ('POST', 'PATCH')
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.1
+
+# Headers a replay must not copy from the stored response.
+SKIPPED_HEADERS = {'content-length', 'set-cookie'}
+
+
+# Client errors that a retry of the same request would get again. Anything
+# that may change with time or credentials (401, 403, 409, 429) is not kept.
+STORED_CLIENT_ERRORS = {400, 404, 405, 410, 413, 415, 422}
+
+
+def caller_scope(request):
+    """
+    Who is calling: the user id from the JWT (so a retry after a token
+    refresh still matches), else the session user or key, else the client
+    address. None for a token that does not validate; the view rejects it.
+    """
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    if header is not None:
+        raw_token = authentication.get_raw_token(header)
+        if raw_token is not None:
+            try:
+                return f'user:{authentication.get_validated_token(raw_token)[jwt_settings.USER_ID_CLAIM]}'
+            except (InvalidToken, KeyError):
+                return None
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if session_key:
+        return f'session:{session_key}'
+    return f'ip:{request.META.get("REMOTE_ADDR", "")}'
+
+
+def idempotency_cache_key(scope, request, key):
+    """
+    Keys are scoped to the caller, the method and the path, so two clients
+    (or two endpoints) reusing the same key never collide.
+    """
+    scope = '\n'.join([scope, request.method, request.path, key])
+    return f'idempotency_{hashlib.sha256(scope.encode()).hexdigest()}'
+
+
+def is_replayable(response):
+    return 200 <= response.status_code < 300 or response.status_code in STORED_CLIENT_ERRORS
+
+
+def replay(stored):
+    response = HttpResponse(stored['content'], status=stored['status'])
+    for header, value in stored['headers']:
+        response.headers[header] = value
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+class IdempotencyMiddleware:
+    """
+    Honors an ``Idempotency-Key`` header on POST and PATCH. The first
+    response for a key is cached for ``IDEMPOTENCY_TTL`` seconds and replayed
+    for every retry with the same body; reusing a key for a different body
+    is rejected with 422. A duplicate that arrives while the first request
+    is still running waits up to ``IDEMPOTENCY_WAIT_TIMEOUT`` seconds for
+    its result, then gets a 409. Only successes and client errors a retry
+    would hit again are stored; everything else can be retried.
+
+    The first request holds a lock for up to ``IDEMPOTENCY_LOCK_TIMEOUT``
+    seconds, which must outlast the slowest request (outbound calls such as
+    ZarinPal's have shorter timeouts).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        key = request.headers.get('Idempotency-Key')
+        if request.method not in IDEMPOTENT_METHODS or key is None:
+            return self.get_response(request)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({'detail': f'Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters.'}, status=400)
+        scope = caller_scope(request)
+        if scope is None:
+            return self.get_response(request)
+
+        cache_key = idempotency_cache_key(scope, request, key)
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+
+        stored = cache.get(cache_key)
+        if stored is None:
+            token = acquire_lock(cache_key, settings.IDEMPOTENCY_LOCK_TIMEOUT)
+            if token is not None:
+                try:
+                    # The first request may have stored its response and let
+                    # go of the lock since the get above.
+                    stored = cache.get(cache_key)
+                    if stored is None:
+                        return self.handle(request, cache_key, fingerprint)
+                finally:
+                    release_lock(cache_key, token)
+            else:
+                stored = self.wait_for(cache_key)
+            if stored is None:
+                response = JsonResponse({'detail': 'A request with this Idempotency-Key is still in progress.'}, status=409)
+                response.headers['Retry-After'] = '1'
+                return response
+
+        if stored['fingerprint'] != fingerprint:
+            return JsonResponse({'detail': 'This Idempotency-Key was already used with a different request body.'}, status=422)
+        return replay(stored)
+
+    def handle(self, request, cache_key, fingerprint):
+        response = self.get_response(request)
+        if response.streaming or not is_replayable(response):
+            return response
+        cache.set(cache_key, {
+            'fingerprint': fingerprint,
+            'status': response.status_code,
+            'headers': [(header, value) for header, value in response.items() if header.lower() not in SKIPPED_HEADERS],
+            'content': response.content,
+        }, settings.IDEMPOTENCY_TTL)
+        return response
+
+    def wait_for(self, cache_key):
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            stored = cache.get(cache_key)
+            if stored is not None:
+                return stored
+        return None
@@ -0,0 +1,37 @@
+from uuid import uuid4
+
+from .cache import RELEASE_LOCK_SCRIPT
+from .redis_client import get_redis
+
+
+EXTEND_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def lock_key(name):
+    return f'lock:{name}'
+
+
+def acquire_lock(name, timeout):
+    """
+    Take the lock ``name`` for ``timeout`` seconds. Returns a token that
+    proves ownership, or None when someone else holds it.
+    """
+    token = uuid4().hex
+    if get_redis().set(lock_key(name), token, nx=True, ex=timeout):
+        return token
+    return None
+
+
+def extend_lock(name, token, timeout):
+    """Push the lock's expiry ``timeout`` seconds out; False if it is no longer ours."""
+    return bool(get_redis().eval(EXTEND_LOCK_SCRIPT, 1, lock_key(name), token, timeout))
+
+
+def release_lock(name, token):
+    """Release the lock only if it still holds ``token``, so a lapsed holder cannot free someone else's."""
+    return bool(get_redis().eval(RELEASE_LOCK_SCRIPT, 1, lock_key(name), token))
@@ -0,0 +1,221 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .redis_client import get_redis
+from .task_metrics import queue_depths, task_stats
+
+
+logger = logging.getLogger(__name__)
+
+
+METRICS_KEY = 'metrics:http'
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def add(self, name, duration):
+        self.durations[name] += duration
+        self.counts[name] += 1
+
+    def increment(self, name):
+        self.counts[name] += 1
+
+
+def increment(name):
+    timings = _current.get()
+    if timings is not None:
+        timings.increment(name)
+
+
+@contextmanager
+def timer(name):
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def sql_timer(execute, sql, params, many, context):
+    with timer('db'):
+        return execute(sql, params, many, context)
+
+
+def instrument_serializers():
+    from rest_framework.serializers import BaseSerializer
+
+    if getattr(BaseSerializer.data.fget, 'instrumented', False):
+        return
+    original = BaseSerializer.data.fget
+
+    # Nested serializers go through to_representation(), so only the
+    # outermost .data access of a response is measured.
+    def timed_data(self):
+        with timer('serialize'):
+            return original(self)
+
+    timed_data.instrumented = True
+    BaseSerializer.data = property(timed_data)
+
+
+class Histograms:
+    """
+    Per-endpoint counters kept in-process and flushed to a Redis hash every
+    ``METRICS_FLUSH_INTERVAL`` seconds, so /metrics shows every worker.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = defaultdict(float)
+        self.last_flush = time.monotonic()
+
+    def observe(self, endpoint, status_code, wall_time, timings):
+        bucket = bisect_left(DURATION_BUCKETS, wall_time)
+        with self.lock:
+            self.pending[f'requests|{endpoint}|{status_code}'] += 1
+            self.pending[f'duration_sum|{endpoint}'] += wall_time
+            if bucket < len(DURATION_BUCKETS):
+                self.pending[f'duration_bucket|{endpoint}|{DURATION_BUCKETS[bucket]}'] += 1
+            for name, duration in timings.durations.items():
+                self.pending[f'{name}_seconds|{endpoint}'] += duration
+                self.pending[f'{name}_count|{endpoint}'] += timings.counts[name]
+            for name in ('cache_hit', 'cache_miss'):
+                if name in timings.counts:
+                    self.pending[f'{name}|{endpoint}'] += timings.counts[name]
+            if time.monotonic() - self.last_flush < settings.METRICS_FLUSH_INTERVAL:
+                return
+            pending, self.pending = self.pending, defaultdict(float)
+            self.last_flush = time.monotonic()
+
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for field, value in pending.items():
+                pipe.hincrbyfloat(METRICS_KEY, field, value)
+            pipe.execute()
+        except Exception:
+            logger.warning("Could not flush request metrics", exc_info=True)
+
+
+histograms = Histograms()
+
+
+class ServerTimingMiddleware:
+    """
+    Measures every request: wall time, SQL count/time, cache hits and misses,
+    serializer time and external calls wrapped in metrics.timer(). Emits them
+    as a ``Server-Timing`` header and feeds the /metrics histograms.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_serializers()
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(sql_timer))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        wall_time = time.perf_counter() - started
+
+        endpoint = getattr(request, 'metrics_endpoint', None)
+        if endpoint is not None:
+            histograms.observe(endpoint, response.status_code, wall_time, timings)
+        response['Server-Timing'] = self.server_timing(wall_time, timings)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'cls', None)
+        if view_class is None:
+            request.metrics_endpoint = getattr(view_func, '__name__', 'unknown')
+            return None
+        actions = getattr(view_func, 'actions', None) or {}
+        action = actions.get(request.method.lower(), request.method.lower())
+        request.metrics_endpoint = f'{view_class.__name__}.{action}'
+        return None
+
+    def server_timing(self, wall_time, timings):
+        parts = [f'app;dur={wall_time * 1000:.1f}']
+        for name, duration in timings.durations.items():
+            parts.append(f'{name};dur={duration * 1000:.1f};desc="{timings.counts[name]}"')
+        hits, misses = timings.counts.get('cache_hit', 0), timings.counts.get('cache_miss', 0)
+        if hits or misses:
+            parts.append(f'cache;desc="hit={hits} miss={misses}"')
+        return ', '.join(parts)
+
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponseForbidden()
+    elif request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        return HttpResponseForbidden()
+
+    lines = []
+    values = sorted(
+        (field.decode(), float(value)) for field, value in get_redis().hgetall(METRICS_KEY).items()
+    )
+    buckets = defaultdict(dict)
+    for field, value in values:
+        kind, endpoint, *rest = field.split('|')
+        if kind == 'requests':
+            lines.append(f'http_requests_total{{endpoint="{endpoint}",status="{rest[0]}"}} {value:g}')
+        elif kind == 'duration_bucket':
+            buckets[endpoint][float(rest[0])] = value
+        elif kind == 'duration_sum':
+            lines.append(f'http_request_duration_seconds_sum{{endpoint="{endpoint}"}} {value}')
+        elif kind in ('cache_hit', 'cache_miss'):
+            lines.append(f'http_{kind}_total{{endpoint="{endpoint}"}} {value:g}')
+        elif kind.endswith('_seconds'):
+            lines.append(f'http_{kind}_total{{endpoint="{endpoint}"}} {value}')
+        elif kind.endswith('_count'):
+            lines.append(f'http_{kind}_total{{endpoint="{endpoint}"}} {value:g}')
+
+    for endpoint, counts in buckets.items():
+        cumulative = 0
+        for bound in DURATION_BUCKETS:
+            cumulative += counts.get(bound, 0)
+            lines.append(f'http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative:g}')
+        total = sum(value for field, value in values if field.startswith(f'requests|{endpoint}|'))
+        lines.append(f'http_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {total:g}')
+        lines.append(f'http_request_duration_seconds_count{{endpoint="{endpoint}"}} {total:g}')
+
+    for task_name, stats in sorted(task_stats().items()):
+        lines.append(f'celery_task_runs_total{{task="{task_name}"}} {stats.get("count", 0):g}')
+        lines.append(f'celery_task_runtime_seconds_total{{task="{task_name}"}} {stats.get("runtime_seconds_total", 0)}')
+        lines.append(f'celery_task_queue_wait_seconds_total{{task="{task_name}"}} {stats.get("queue_wait_seconds_total", 0)}')
+        lines.append(f'celery_task_retries_total{{task="{task_name}"}} {stats.get("retries", 0):g}')
+        lines.append(f'celery_task_failures_total{{task="{task_name}"}} {stats.get("failures", 0):g}')
+    try:
+        for queue, depth in queue_depths().items():
+            lines.append(f'celery_queue_depth{{queue="{queue}"}} {depth}')
+    except Exception:
+        logger.warning("Could not read Celery queue depths", exc_info=True)
+
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4')
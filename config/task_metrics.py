@@ -0,0 +1,81 @@
+import time
+
+from celery.signals import before_task_publish, task_prerun, task_postrun, task_retry, task_failure
+
+from .redis_client import get_redis
+
+
+METRICS_KEY = 'celery:metrics:{task}'
+
+_started = {}
+
+
+def metrics_key(task_name):
+    return METRICS_KEY.format(task=task_name)
+
+
+@before_task_publish.connect
+def stamp_published_at(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault('published_at', time.time())
+
+
+@task_prerun.connect
+def record_task_start(task_id=None, task=None, **kwargs):
+    _started[task_id] = time.time()
+
+
+@task_postrun.connect
+def record_task_finish(task_id=None, task=None, state=None, **kwargs):
+    started = _started.pop(task_id, None)
+    if started is None:
+        return
+    runtime = time.time() - started
+    published_at = getattr(task.request, 'published_at', None)
+
+    pipe = get_redis().pipeline(transaction=False)
+    key = metrics_key(task.name)
+    pipe.hincrby(key, 'count', 1)
+    pipe.hincrbyfloat(key, 'runtime_seconds_total', runtime)
+    if published_at:
+        pipe.hincrbyfloat(key, 'queue_wait_seconds_total', max(started - float(published_at), 0))
+    if state:
+        pipe.hincrby(key, f'state_{state.lower()}', 1)
+    pipe.execute()
+
+
+@task_retry.connect
+def record_task_retry(sender=None, **kwargs):
+    get_redis().hincrby(metrics_key(sender.name), 'retries', 1)
+
+
+@task_failure.connect
+def record_task_failure(sender=None, **kwargs):
+    get_redis().hincrby(metrics_key(sender.name), 'failures', 1)
+
+
+def queue_depths():
+    from .celery import TASK_QUEUES, app
+
+    depths = {}
+    with app.connection_for_read() as connection:
+        channel = connection.default_channel
+        for queue in TASK_QUEUES:
+            try:
+                depths[queue] = channel.queue_declare(queue, passive=True).message_count
+            except connection.channel_errors:
+                depths[queue] = 0
+    return depths
+
+
+def task_stats():
+    client = get_redis()
+    stats = {}
+    for key in client.scan_iter(match=METRICS_KEY.format(task='*')):
+        task_name = key.decode().split(':', 2)[2]
+        values = {field.decode(): float(value) for field, value in client.hgetall(key).items()}
+        count = values.get('count') or 1
+        values['runtime_seconds_avg'] = values.get('runtime_seconds_total', 0) / count
+        values['queue_wait_seconds_avg'] = values.get('queue_wait_seconds_total', 0) / count
+        stats[task_name] = values
+    return stats
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+from fakeredis import FakeConnection, FakeServer
+
+from . import redis_client
+
+
+class FakeRedisTestRunner(DiscoverRunner):
+    """
+    Runs the suite against one in-process fakeredis server, with Lua through
+    lupa, so the cache, the throttles and the OTP scripts behave as they do
+    against Redis without a server to reach.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        options = {'connection_class': FakeConnection, 'server': FakeServer()}
+        default_cache = settings.CACHES['default']
+        self.redis_settings = override_settings(
+            REDIS_OPTIONS=options,
+            CACHES={**settings.CACHES, 'default': {**default_cache, 'OPTIONS': {**default_cache.get('OPTIONS', {}), **options}}},
+        )
+        self.redis_settings.enable()
+        redis_client._client = None
+
+    def teardown_test_environment(self, **kwargs):
+        self.redis_settings.disable()
+        redis_client._client = None
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,46 @@
+import multiprocessing
+import os
+
+
+# WSGI by default; for ASGI run with
+#   GUNICORN_APP=config.asgi:application GUNICORN_WORKER_CLASS=uvicorn_worker.UvicornWorker
+wsgi_app = os.environ.get('GUNICORN_APP', 'config.wsgi:application')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Load Django once in the master so workers fork with code already imported.
+preload_app = True
+
+# Recycle workers to cap memory growth; the jitter keeps them from all
+# restarting at the same moment.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+    from store.warmup import warm_up_code_paths
+
+    warm_up_code_paths()
+
+
+def post_fork(server, worker):
+    from django.db import connections
+
+    # Never share a socket opened by the master with the workers.
+    connections.close_all()
+
+
+def post_worker_init(worker):
+    from store.warmup import warm_up
+
+    warm_up()
@@ -1,12 +1,20 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.utils import timezone
+from django.utils.html import format_html_join
 from django.utils.safestring import mark_safe
 
-from .models import Customer, Application, Discount, Service, Comment, Cart, CartItem, Order, OrderItem, ServiceField
+from .models import Customer, Application, Discount, Service, Comment, Cart, CartItem, Order, OrderItem, OrderStatusChange, OutboxEvent, ServiceField
+from .orders import transition_orders
+from .outbox import kick_relay
+from .paginations import EstimatedCountPaginator
+from .tasks import fulfill_order_items_task
 
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ["user", "phone_number"]
+    list_select_related = ["user"]
 
 
 class ServiceInline(admin.TabularInline):
@@ -17,7 +25,8 @@ class ServiceInline(admin.TabularInline):
 
 @admin.register(Application)
 class ApplicationAdmin(admin.ModelAdmin):
-    list_display = ["title", "short_description", "top_service"]
+    list_display = ["title", "short_description", "top_service", "fulfillment_provider"]
+    list_select_related = ["top_service"]
     inlines = [ServiceInline]
     readonly_fields = ("image_preview",)
 
@@ -30,7 +39,8 @@ class ApplicationAdmin(admin.ModelAdmin):
 
 @admin.register(Discount)
 class DiscountAdmin(admin.ModelAdmin):
-    list_display = ["name", "discount_percent"]
+    list_display = ["name", "discount_percent", "starts_at", "ends_at", "priority"]
+    filter_horizontal = ["applications"]
 
 
 class CommentsInline(admin.TabularInline):
@@ -41,6 +51,7 @@ class CommentsInline(admin.TabularInline):
 @admin.register(ServiceField)
 class ServiceFieldAdmin(admin.ModelAdmin):
     list_display = ["service", "field_name", "field_type", "is_required", "label"]
+    list_select_related = ["service"]
     readonly_fields = ("is_required",)
 
 
@@ -52,6 +63,7 @@ class ServiceFieldInline(admin.TabularInline):
 @admin.register(Service)
 class ServiceAdmin(admin.ModelAdmin):
     list_display = ["name", "application", "short_description", "price", "datetime_created", "discounts", "image"]
+    list_select_related = ["application", "discounts"]
     inlines = [CommentsInline, ServiceFieldInline]
     prepopulated_fields = {"slug": ("name",)}
     readonly_fields = ("datetime_created", "image_preview")
@@ -66,6 +78,7 @@ class ServiceAdmin(admin.ModelAdmin):
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     list_display = ["author", "service", "short_body", "status", "datetime_created"]
+    list_select_related = ["author", "service"]
 
 
 class CartItemInline(admin.TabularInline):
@@ -74,15 +87,35 @@ class CartItemInline(admin.TabularInline):
     extra = 1
 
 
+class EstimatedCountChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        # The paginator corrects an estimated count once it has read a page.
+        self.result_count = self.paginator.count
+
+
+class EstimatedCountAdmin(admin.ModelAdmin):
+    """
+    Changelist of a big table: paginated on estimated counts, which
+    admin/store/pagination.html labels as approximate.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
+
+
 @admin.register(Cart)
-class CartAdmin(admin.ModelAdmin):
+class CartAdmin(EstimatedCountAdmin):
     list_display = ["id", "datetime_created"]
     inlines = [CartItemInline]
 
 
 @admin.register(CartItem)
-class CartItemAdmin(admin.ModelAdmin):
+class CartItemAdmin(EstimatedCountAdmin):
     list_display = ["cart", "service"]
+    list_select_related = ["cart", "service"]
 
 
 class OrderItemInline(admin.TabularInline):
@@ -92,28 +125,83 @@ class OrderItemInline(admin.TabularInline):
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(EstimatedCountAdmin):
     list_display = ["id", "customer", "datetime_created", "status"]
+    list_select_related = ["customer__user"]
     inlines = [OrderItemInline]
+    actions = ["mark_paid", "cancel_unpaid"]
+
+    def transition(self, request, queryset, from_status, to_status):
+        results = transition_orders(queryset.values_list("pk", flat=True), from_status, to_status, user=request.user, note="admin action")
+        updated = sum(result == "updated" for result in results.values())
+        skipped = len(results) - updated
+        self.message_user(request, f"{updated} orders updated, {skipped} skipped because they were not {dict(Order.ORDER_STATUS)[from_status].lower()}.")
+
+    @admin.action(description="Mark selected unpaid orders as paid")
+    def mark_paid(self, request, queryset):
+        self.transition(request, queryset, Order.ORDER_STATUS_UNPAID, Order.ORDER_STATUS_PAID)
+
+    @admin.action(description="Cancel selected unpaid orders")
+    def cancel_unpaid(self, request, queryset):
+        self.transition(request, queryset, Order.ORDER_STATUS_UNPAID, Order.ORDER_STATUS_CANCELED)
 
 
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ["formatted_order", "service", "quantity", "price", "extra_data_preview"]
+class OrderItemAdmin(EstimatedCountAdmin):
+    list_display = ["formatted_order", "service", "quantity", "price", "extra_data_preview", "fulfillment_status"]
+    list_select_related = ["order__customer__user", "service"]
+    list_filter = ["fulfillment_status"]
+    readonly_fields = ["fulfillment_attempts", "fulfillment_error", "fulfillment_claimed_at", "fulfillment_retry_at", "fulfilled_at"]
+    actions = ["retry_fulfillment", "mark_fulfilled"]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related("service__required_fields")
 
     def extra_data_preview(self, obj):
         if not obj.extra_data:
             return "-"
-        items = []
-        for k, v in obj.extra_data.items():
-            field = ServiceField.objects.filter(service=obj.service, field_name=k).first()
-            label = field.label if field and field.label else k
-            items.append(f"{label}: {v}")
-        return mark_safe("<br>".join(items))
+        labels = {field.field_name: field.label for field in obj.service.required_fields.all() if field.label}
+        return format_html_join(mark_safe("<br>"), "{}: {}", ((labels.get(k, k), v) for k, v in obj.extra_data.items()))
     extra_data_preview.short_description = "more info"
 
     def formatted_order(self, obj):
         order = obj.order
-        customer_username = obj.order.customer.user.username
+        customer_username = order.customer.user.username
         return f"Order (ID = {order.id} , Customer = {customer_username})"
-    formatted_order.short_description = "Order"
\ No newline at end of file
+    formatted_order.short_description = "Order"
+
+    @admin.action(description="Retry fulfillment of selected items")
+    def retry_fulfillment(self, request, queryset):
+        queryset.filter(fulfillment_status=OrderItem.FULFILLMENT_FAILED).update(
+            fulfillment_status=OrderItem.FULFILLMENT_PENDING, fulfillment_attempts=0, fulfillment_retry_at=None,
+        )
+        fulfill_order_items_task.delay()
+
+    @admin.action(description="Mark selected items as fulfilled")
+    def mark_fulfilled(self, request, queryset):
+        queryset.exclude(fulfillment_status=OrderItem.FULFILLMENT_DONE).update(
+            fulfillment_status=OrderItem.FULFILLMENT_DONE, fulfillment_error="", fulfilled_at=timezone.now(),
+        )
+
+
+@admin.register(OrderStatusChange)
+class OrderStatusChangeAdmin(EstimatedCountAdmin):
+    list_display = ["order_id", "from_status", "to_status", "changed_by", "note", "datetime_created"]
+    list_select_related = ["changed_by"]
+    list_filter = ["to_status"]
+    readonly_fields = ["order", "from_status", "to_status", "changed_by", "note", "datetime_created"]
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(EstimatedCountAdmin):
+    list_display = ["id", "event_type", "order_id", "status", "datetime_created", "processed_at", "attempts"]
+    list_filter = ["status", "event_type"]
+    readonly_fields = ["order", "event_type", "payload", "status", "datetime_created", "processed_at", "attempts", "next_attempt_at", "last_error"]
+    actions = ["retry_events"]
+
+    @admin.action(description="Retry selected events")
+    def retry_events(self, request, queryset):
+        queryset.exclude(status=OutboxEvent.STATUS_PROCESSED).update(
+            status=OutboxEvent.STATUS_PENDING, attempts=0, next_attempt_at=None, last_error="",
+        )
+        kick_relay()
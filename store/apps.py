@@ -1,4 +1,7 @@
+from importlib import import_module
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class StoreConfig(AppConfig):
@@ -6,4 +9,6 @@ class StoreConfig(AppConfig):
     name = 'store'
 
     def ready(self):
-        import store.signals
\ No newline at end of file
+        import store.signals
+        for module in settings.FULFILLMENT_PROVIDER_MODULES:
+            import_module(module)
@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .models import Customer
+
+
+# Only what permission checks and the customer views read is cached; the
+# password hash never leaves the database. Other fields of the rebuilt
+# instances are deferred, so they load on access and save() leaves them be.
+CACHED_USER_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser')
+CACHED_CUSTOMER_FIELDS = ('id', 'user_id', 'phone_number', 'is_phone_verified')
+
+
+def auth_user_cache_key(user_id):
+    return f'auth_user_{user_id}'
+
+
+def restore(model, values):
+    field_names = [field.attname for field in model._meta.concrete_fields if field.attname in values]
+    return model.from_db('default', field_names, [values[name] for name in field_names])
+
+
+def cached_identity(user):
+    """The cacheable part of ``user`` and its customer (None when it has none)."""
+    customer = getattr(user, 'customer', None)
+    return {
+        'user': {field: getattr(user, field) for field in CACHED_USER_FIELDS},
+        'customer': None if customer is None else {field: getattr(customer, field) for field in CACHED_CUSTOMER_FIELDS},
+        'password_hash': get_md5_hash_password(user.password) if api_settings.CHECK_REVOKE_TOKEN else None,
+    }
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that keeps the user's fields, and its Customer's, in
+    the cache for ``AUTH_USER_CACHE_TTL`` seconds and exposes the customer as
+    ``request.customer`` (None for an account without a customer profile).
+    """
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            user, _token = result
+            request._request.customer = getattr(user, 'customer', None)
+        return result
+
+    def build_user(self, identity):
+        user = restore(self.user_model, identity['user'])
+        if identity['customer'] is not None:
+            user.customer = restore(Customer, identity['customer'])
+        return user
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        cache_key = auth_user_cache_key(user_id)
+        identity = cache.get(cache_key)
+        if identity is None:
+            try:
+                user = self.user_model.objects.select_related('customer').get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist as e:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found") from e
+            identity = cached_identity(user)
+            cache.set(cache_key, identity, settings.AUTH_USER_CACHE_TTL)
+        user = self.build_user(identity)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != identity['password_hash']:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
@@ -0,0 +1,129 @@
+import contextvars
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import orjson
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connection
+from django.urls import Resolver404, resolve
+
+from rest_framework.permissions import SAFE_METHODS
+
+from config.db_router import pin_to_primary
+
+
+logger = logging.getLogger(__name__)
+
+# Headers of the batch request that must not leak into its sub-requests.
+SKIPPED_META = {'CONTENT_LENGTH', 'CONTENT_TYPE', 'HTTP_IDEMPOTENCY_KEY', 'QUERY_STRING', 'wsgi.input'}
+
+# GET routes that change data; they would be run in parallel as reads.
+WRITING_GET_ROUTES = {'order-callback'}
+
+# Threads all batches of this process may run at once (BATCH_MAX_THREADS).
+_thread_slots = threading.BoundedSemaphore(settings.BATCH_MAX_THREADS)
+
+
+def build_sub_request(request, method, path, body):
+    """
+    A fresh HttpRequest for one sub-request, carrying the batch request's
+    user and customer so the view does not authenticate again.
+    """
+    url = urlsplit(path)
+    content = b'' if body is None else orjson.dumps(body)
+    meta = {key: value for key, value in request.META.items() if key not in SKIPPED_META}
+    meta.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(content)),
+        'HTTP_ACCEPT': 'application/json',
+        'wsgi.input': io.BytesIO(content),
+    })
+    sub_request = WSGIRequest(meta)
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+    sub_request.customer = getattr(request._request, 'customer', None)
+    return sub_request
+
+
+def dispatch(request, method, path, body):
+    """Run one sub-request against store/urls.py and return its result entry."""
+    try:
+        match = resolve(urlsplit(path).path, urlconf='store.urls')
+    except Resolver404:
+        return {'status': 404, 'body': {'detail': 'Not found.'}}
+    if match.url_name == 'batch':
+        return {'status': 400, 'body': {'detail': 'Batch requests cannot be nested.'}}
+    if match.url_name in WRITING_GET_ROUTES:
+        return {'status': 400, 'body': {'detail': 'This endpoint cannot be called in a batch.'}}
+
+    try:
+        response = match.func(build_sub_request(request, method, path, body), *match.args, **match.kwargs)
+    except Exception:
+        logger.exception("Batch sub-request %s %s failed", method, path)
+        return {'status': 500, 'body': {'detail': 'Internal server error.'}}
+    if hasattr(response, 'render'):
+        response.render()
+    result = {'status': response.status_code, 'body': None}
+    if response.content:
+        if response.get('Content-Type', '').startswith('application/json'):
+            # Already valid JSON; embedded as is instead of parsed and re-encoded.
+            result['body'] = orjson.Fragment(response.content)
+        else:
+            result['body'] = response.content.decode(response.charset)
+    if response.has_header('Retry-After'):
+        result['retry_after'] = response['Retry-After']
+    return result
+
+
+def dispatch_in_thread(context, request, method, path, body):
+    try:
+        return context.run(dispatch, request, method, path, body)
+    finally:
+        # Pool threads are thrown away after the batch; so is their connection.
+        connection.close()
+        _thread_slots.release()
+
+
+def run_batch(request, sub_requests):
+    """
+    Run ``sub_requests`` in order. Consecutive read-only ones run in parallel
+    on up to BATCH_MAX_WORKERS threads, as long as the process has thread
+    slots left, and on the request thread otherwise; a write waits for the
+    reads before it and is finished before anything after it starts.
+    Sub-requests are not atomic together: each write commits on its own, and
+    a successful one pins the user to the primary like a plain request would.
+    """
+    results = [None] * len(sub_requests)
+    reads = []
+
+    def flush_reads(pool):
+        futures = {}
+        for index, sub in reads[1:]:
+            if not _thread_slots.acquire(blocking=False):
+                break
+            futures[index] = pool.submit(dispatch_in_thread, contextvars.copy_context(), request, sub['method'], sub['path'], sub.get('body'))
+        for index, sub in reads:
+            if index not in futures:
+                results[index] = dispatch(request, sub['method'], sub['path'], sub.get('body'))
+        for index, future in futures.items():
+            results[index] = future.result()
+        reads.clear()
+
+    with ThreadPoolExecutor(max_workers=settings.BATCH_MAX_WORKERS, thread_name_prefix='batch') as pool:
+        for index, sub in enumerate(sub_requests):
+            if sub['method'] in SAFE_METHODS:
+                reads.append((index, sub))
+                continue
+            flush_reads(pool)
+            results[index] = dispatch(request, sub['method'], sub['path'], sub.get('body'))
+            if results[index]['status'] < 400 and request.user.is_authenticated:
+                pin_to_primary(request.user)
+        flush_reads(pool)
+    return results
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max, Min, Value
+from django.db.models.functions import Coalesce
+
+from .models import Application
+from .warmup import cache_warmer
+
+
+CATALOG_OVERVIEW_CACHE_KEY = 'catalog_overview'
+
+
+def build_catalog_overview():
+    """Every application with its service stats, in one grouped query."""
+    output_field = DecimalField(max_digits=12, decimal_places=2)
+    effective_price = Coalesce(
+        F('services__current_price__price'),
+        ExpressionWrapper(
+            F('services__price') * (Value(100) - Coalesce(F('services__discounts__discount_percent'), Value(0))) / Value(100),
+            output_field=output_field,
+        ),
+        output_field=output_field,
+    )
+    return list(
+        Application.objects.select_related('top_service__discounts', 'top_service__current_price').annotate(
+            service_count=Count('services', distinct=True),
+            min_price=Min(effective_price),
+            max_price=Max(effective_price),
+            best_discount_percent=Max('services__current_price__discount__discount_percent'),
+        ).order_by('pk')
+    )
+
+
+@cache_warmer
+def get_catalog_overview():
+    return cache.get_or_set(CATALOG_OVERVIEW_CACHE_KEY, build_catalog_overview, settings.CATALOG_OVERVIEW_CACHE_TTL)
+
+
+def invalidate_catalog_overview():
+    cache.delete(CATALOG_OVERVIEW_CACHE_KEY)
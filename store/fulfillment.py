@@ -0,0 +1,164 @@
+import logging
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Min, Q
+from django.utils import timezone
+
+from .models import Order, OrderItem, OutboxEvent
+from .outbox import outbox_handler
+
+
+logger = logging.getLogger(__name__)
+
+Provider = namedtuple('Provider', ['handler', 'concurrency'])
+
+_providers = {}
+
+
+class PermanentFulfillmentError(Exception):
+    """Raised by a handler when retrying cannot help, e.g. a malformed account name."""
+
+
+def fulfillment_provider(name, concurrency=None):
+    """
+    Register the decorated ``handler(item)`` for applications whose
+    ``fulfillment_provider`` is ``name``. At most ``concurrency`` of its items
+    (FULFILLMENT_DEFAULT_CONCURRENCY when None) are in flight at once.
+    """
+    def register(handler):
+        _providers[name] = Provider(handler, concurrency or settings.FULFILLMENT_DEFAULT_CONCURRENCY)
+        return handler
+    return register
+
+
+def claimable_items(provider=None, now=None):
+    """
+    Items of paid orders that are due: pending ones past their retry time,
+    and processing ones whose worker has not reported back within
+    FULFILLMENT_CLAIM_TIMEOUT seconds (it most likely died).
+    """
+    now = now or timezone.now()
+    stale = now - timedelta(seconds=settings.FULFILLMENT_CLAIM_TIMEOUT)
+    items = OrderItem.objects.filter(
+        Q(fulfillment_status=OrderItem.FULFILLMENT_PENDING) & (Q(fulfillment_retry_at__isnull=True) | Q(fulfillment_retry_at__lte=now))
+        | Q(fulfillment_status=OrderItem.FULFILLMENT_PROCESSING, fulfillment_claimed_at__lt=stale),
+        order__status=Order.ORDER_STATUS_PAID,
+    )
+    if provider is None:
+        return items.filter(service__application__fulfillment_provider__in=list(_providers))
+    return items.filter(service__application__fulfillment_provider=provider)
+
+
+def claim_items(provider, limit):
+    """
+    Mark up to ``limit`` due items of ``provider`` as processing and return
+    them. SKIP LOCKED lets a second dispatcher claim other items instead of
+    waiting for this one.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        pks = list(
+            claimable_items(provider, now).select_for_update(skip_locked=True, of=('self',))
+            .order_by('pk').values_list('pk', flat=True)[:limit]
+        )
+        OrderItem.objects.filter(pk__in=pks).update(
+            fulfillment_status=OrderItem.FULFILLMENT_PROCESSING, fulfillment_claimed_at=now,
+            fulfillment_attempts=F('fulfillment_attempts') + 1,
+        )
+    return list(OrderItem.objects.select_related('service__application', 'order__customer__user').filter(pk__in=pks))
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=settings.FULFILLMENT_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def fulfill(item, handler):
+    """Run ``handler`` for one claimed item and record the outcome."""
+    attempts = item.fulfillment_attempts
+    try:
+        if attempts > settings.FULFILLMENT_MAX_ATTEMPTS:
+            # Reclaimed after its workers kept dying mid-run.
+            raise PermanentFulfillmentError("Worker lost while fulfilling")
+        handler(item)
+    except Exception as e:
+        dead = isinstance(e, PermanentFulfillmentError) or attempts >= settings.FULFILLMENT_MAX_ATTEMPTS
+        logger.warning("Fulfillment of order item %s failed (attempt %s)", item.pk, attempts, exc_info=True)
+        OrderItem.objects.filter(pk=item.pk).update(
+            fulfillment_status=OrderItem.FULFILLMENT_FAILED if dead else OrderItem.FULFILLMENT_PENDING,
+            fulfillment_error=repr(e),
+            fulfillment_retry_at=None if dead else timezone.now() + retry_delay(attempts),
+        )
+        return False
+    else:
+        OrderItem.objects.filter(pk=item.pk).update(
+            fulfillment_status=OrderItem.FULFILLMENT_DONE, fulfillment_error='', fulfilled_at=timezone.now(),
+        )
+        return True
+    finally:
+        # Pool threads outlive the run; hand their connection back.
+        connection.close()
+
+
+def refresh_claims(pks):
+    """Renew the claim on items still in flight so they are not reclaimed as stale."""
+    OrderItem.objects.filter(pk__in=pks, fulfillment_status=OrderItem.FULFILLMENT_PROCESSING).update(
+        fulfillment_claimed_at=timezone.now(),
+    )
+
+
+def run_fulfillment(seconds, heartbeat=None):
+    """
+    Keep the worker pool busy for up to ``seconds``: whenever a provider is
+    below its concurrency limit, claim more of its items. Every
+    FULFILLMENT_HEARTBEAT_INTERVAL the claims of in-flight items are renewed
+    and ``heartbeat()`` is called; once it returns False (the dispatcher lost
+    its lock) no more items are claimed. Returns counts of fulfilled and
+    failed items.
+    """
+    deadline = time.monotonic() + seconds
+    next_heartbeat = time.monotonic() + settings.FULFILLMENT_HEARTBEAT_INTERVAL
+    results = Counter()
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=settings.FULFILLMENT_WORKERS, thread_name_prefix='fulfillment') as pool:
+        while True:
+            if time.monotonic() >= next_heartbeat:
+                next_heartbeat = time.monotonic() + settings.FULFILLMENT_HEARTBEAT_INTERVAL
+                refresh_claims([item.pk for item, _ in in_flight.values()])
+                if heartbeat is not None and not heartbeat():
+                    logger.warning("Fulfillment dispatcher lost its lock; finishing in-flight items only")
+                    deadline = 0
+            if time.monotonic() < deadline:
+                running = Counter(name for _, name in in_flight.values())
+                for name, provider in _providers.items():
+                    free = min(provider.concurrency - running[name], settings.FULFILLMENT_WORKERS - len(in_flight))
+                    if free <= 0:
+                        continue
+                    for item in claim_items(name, free):
+                        in_flight[pool.submit(fulfill, item, provider.handler)] = (item, name)
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, timeout=settings.FULFILLMENT_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                del in_flight[future]
+                results['fulfilled' if future.result() else 'failed'] += 1
+    return results
+
+
+def next_retry_at():
+    """When the earliest waiting retry of a provider-handled item is due, or None."""
+    return OrderItem.objects.filter(
+        fulfillment_status=OrderItem.FULFILLMENT_PENDING, fulfillment_retry_at__isnull=False,
+        order__status=Order.ORDER_STATUS_PAID, service__application__fulfillment_provider__in=list(_providers),
+    ).aggregate(next_retry=Min('fulfillment_retry_at'))['next_retry']
+
+
+@outbox_handler(OutboxEvent.ORDER_PAID)
+def start_fulfillment(event):
+    from .tasks import fulfill_order_items_task
+
+    transaction.on_commit(fulfill_order_items_task.delay)
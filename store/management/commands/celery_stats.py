@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from config.task_metrics import queue_depths, task_stats
+
+
+class Command(BaseCommand):
+    help = "Show Celery queue depths and per-task latency, retry and failure counters."
+
+    def handle(self, *args, **options):
+        self.stdout.write("Queue depth")
+        for queue, depth in queue_depths().items():
+            self.stdout.write(f"  {queue:<16} {depth}")
+
+        self.stdout.write("Tasks")
+        for task_name, stats in sorted(task_stats().items()):
+            self.stdout.write(
+                f"  {task_name}: count={int(stats.get('count', 0))} "
+                f"avg_runtime={stats['runtime_seconds_avg'] * 1000:.1f}ms "
+                f"avg_wait={stats['queue_wait_seconds_avg'] * 1000:.1f}ms "
+                f"retries={int(stats.get('retries', 0))} failures={int(stats.get('failures', 0))}"
+            )
@@ -0,0 +1,43 @@
+# Generated by Django 6.0 on 2026-10-19 17:52
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_comment_counters(apps, schema_editor):
+    Service = apps.get_model('store', 'Service')
+    Comment = apps.get_model('store', 'Comment')
+    approved = Comment.objects.filter(service=OuterRef('pk'), status='a')
+    Service.objects.update(
+        approved_comment_count=Coalesce(
+            Subquery(approved.order_by().values('service').annotate(count=Count('pk')).values('count')), 0
+        ),
+        latest_comment_at=Subquery(approved.order_by('-datetime_created').values('datetime_created')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_application_image'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='service',
+            name='approved_comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='latest_comment_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('status', 'a')), fields=['service', 'datetime_created'], name='store_comment_approved_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 6.0 on 2026-10-19 17:55
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_service_prices(apps, schema_editor):
+    Service = apps.get_model('store', 'Service')
+    ServicePrice = apps.get_model('store', 'ServicePrice')
+    now = timezone.now()
+    rows = []
+    for service in Service.objects.select_related('discounts').iterator(chunk_size=2000):
+        price = service.price
+        if service.discounts is not None:
+            price = price * (Decimal(100) - service.discounts.discount_percent) / Decimal(100)
+        rows.append(ServicePrice(service=service, discount=service.discounts, price=price.quantize(Decimal('0.01')), refreshed_at=now))
+    ServicePrice.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_service_comment_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discount',
+            name='applications',
+            field=models.ManyToManyField(blank=True, help_text='Apply to every service of these applications', related_name='discounts', to='store.application'),
+        ),
+        migrations.AddField(
+            model_name='discount',
+            name='ends_at',
+            field=models.DateTimeField(blank=True, help_text='Leave empty to never end', null=True),
+        ),
+        migrations.AddField(
+            model_name='discount',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0, help_text="The highest priority active discount wins; on a tie a service's own discount beats an application-wide one, then the larger percentage wins"),
+        ),
+        migrations.AddField(
+            model_name='discount',
+            name='starts_at',
+            field=models.DateTimeField(blank=True, help_text='Leave empty to start immediately', null=True),
+        ),
+        migrations.CreateModel(
+            name='ServicePrice',
+            fields=[
+                ('service', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='current_price', serialize=False, to='store.service')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('refreshed_at', models.DateTimeField()),
+                ('discount', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='store.discount')),
+            ],
+        ),
+        migrations.RunPython(backfill_service_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 6.0 on 2026-10-19 18:03
+
+from django.db import migrations, models
+
+
+def mark_paid_items_fulfilled(apps, schema_editor):
+    # Items paid for before this migration were fulfilled by hand.
+    OrderItem = apps.get_model('store', 'OrderItem')
+    OrderItem.objects.filter(order__status='p').update(fulfillment_status='d')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0022_outboxevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='application',
+            name='fulfillment_provider',
+            field=models.CharField(blank=True, help_text="Name of the fulfillment provider that activates this application's services; leave empty to fulfill by hand", max_length=50),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='fulfilled_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='fulfillment_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='fulfillment_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='fulfillment_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='fulfillment_retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='fulfillment_status',
+            field=models.CharField(choices=[('p', 'Pending'), ('r', 'Processing'), ('d', 'Fulfilled'), ('f', 'Failed')], default='p', max_length=1),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(condition=models.Q(('fulfillment_status__in', ['p', 'r'])), fields=['fulfillment_status', 'fulfillment_retry_at'], name='store_item_unfulfilled_idx'),
+        ),
+        migrations.RunPython(mark_paid_items_fulfilled, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 6.0 on 2026-10-19 18:26
+
+from django.db import migrations, models
+
+
+def set_event_status(apps, schema_editor):
+    # Events that used up OUTBOX_MAX_ATTEMPTS (5) were left for an operator.
+    OutboxEvent = apps.get_model('store', 'OutboxEvent')
+    OutboxEvent.objects.filter(processed_at__isnull=False).update(status='d')
+    OutboxEvent.objects.filter(processed_at__isnull=True, attempts__gte=5).update(status='x')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0025_imageupload'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='outboxevent',
+            name='store_outbox_pending_idx',
+        ),
+        migrations.AddField(
+            model_name='outboxevent',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='outboxevent',
+            name='status',
+            field=models.CharField(choices=[('p', 'Pending'), ('d', 'Processed'), ('x', 'Dead')], default='p', max_length=1),
+        ),
+        migrations.RunPython(set_event_status, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(condition=models.Q(('status', 'p')), fields=['id'], name='store_outbox_pending_idx'),
+        ),
+    ]
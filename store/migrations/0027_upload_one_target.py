@@ -0,0 +1,27 @@
+# Generated by Django 6.0 on 2026-10-19 18:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def delete_untargeted_uploads(apps, schema_editor):
+    ImageUpload = apps.get_model('store', 'ImageUpload')
+    ImageUpload.objects.filter(
+        models.Q(application__isnull=True, service__isnull=True) | models.Q(application__isnull=False, service__isnull=False)
+    ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0026_outbox_status_backoff'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_untargeted_uploads, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='imageupload',
+            constraint=models.CheckConstraint(condition=models.Q(models.Q(('application__isnull', False), ('service__isnull', True)), models.Q(('application__isnull', True), ('service__isnull', False)), _connector='OR'), name='store_upload_one_target'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.conf import settings
+
+from rest_framework.permissions import SAFE_METHODS
+
+from config.db_router import start_replica_reads, stop_replica_reads, is_pinned_to_primary
+
+
+class ReplicaReadMixin:
+    """
+    Serve safe requests of the view from a read replica, unless the user
+    wrote something within the last ``REPLICA_STICKY_SECONDS``.
+    """
+    replica_reads_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and settings.DATABASE_REPLICAS and not is_pinned_to_primary(request.user):
+            self.replica_reads_token = start_replica_reads()
+
+    def dispatch(self, request, *args, **kwargs):
+        # finalize_response() is skipped when the view raises something DRF
+        # does not handle; the thread must not keep reading from a replica.
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self.replica_reads_token is not None:
+                stop_replica_reads(self.replica_reads_token)
+                self.replica_reads_token = None
@@ -1,6 +1,7 @@
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
+from django.db.models import F, OuterRef, Q, Subquery
 from django.template.defaultfilters import truncatechars
 
 from decimal import Decimal
@@ -32,6 +33,10 @@ class Application(models.Model):
     description = models.TextField()
     top_service = models.ForeignKey('Service', null=True, blank=True, on_delete=models.SET_NULL, related_name='applications')
     image = models.ImageField(upload_to='applications/images/', null=True, blank=True)
+    fulfillment_provider = models.CharField(
+        max_length=50, blank=True,
+        help_text="Name of the fulfillment provider that activates this application's services; leave empty to fulfill by hand"
+    )
 
     def __str__(self):
         return self.title
@@ -48,6 +53,13 @@ class Discount(models.Model):
         help_text="Enter the discount percentage"
     )
     name = models.CharField(max_length=250)
+    starts_at = models.DateTimeField(null=True, blank=True, help_text="Leave empty to start immediately")
+    ends_at = models.DateTimeField(null=True, blank=True, help_text="Leave empty to never end")
+    priority = models.PositiveSmallIntegerField(
+        default=0,
+        help_text="The highest priority active discount wins; on a tie a service's own discount beats an application-wide one, then the larger percentage wins"
+    )
+    applications = models.ManyToManyField(Application, blank=True, related_name='discounts', help_text="Apply to every service of these applications")
 
     def __str__(self):
         return self.name
@@ -63,8 +75,14 @@ class Service(models.Model):
     datetime_created = models.DateTimeField(auto_now_add=True)
     datetime_modified = models.DateTimeField(auto_now=True)
     discounts = models.ForeignKey(Discount, null=True, blank=True, on_delete=models.SET_NULL)
+    approved_comment_count = models.PositiveIntegerField(default=0, editable=False)
+    latest_comment_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     def get_discounted_price(self):
+        try:
+            return self.current_price.price
+        except ServicePrice.DoesNotExist:
+            pass
         if self.discounts:
             discount_factor = Decimal(1) - (self.discounts.discount_percent / Decimal(100))
             return self.price * discount_factor
@@ -80,6 +98,37 @@ class Service(models.Model):
     def short_description(self):
         return truncatechars(self.description, 100)
 
+    @classmethod
+    def apply_approved_comment_deltas(cls, deltas):
+        """
+        Shift ``approved_comment_count`` by ``{service_id: delta}`` and refresh
+        ``latest_comment_at``, one UPDATE per distinct delta.
+        """
+        latest_approved = Comment.objects.filter(
+            service=OuterRef('pk'), status=Comment.COMMENT_STATUS_APPROVED
+        ).order_by('-datetime_created').values('datetime_created')[:1]
+        by_delta = {}
+        for service_id, delta in deltas.items():
+            if delta:
+                by_delta.setdefault(delta, []).append(service_id)
+        for delta, service_ids in by_delta.items():
+            cls.objects.filter(pk__in=service_ids).update(
+                approved_comment_count=F('approved_comment_count') + delta,
+                latest_comment_at=Subquery(latest_approved),
+            )
+
+
+class ServicePrice(models.Model):
+    """
+    A service's effective price under the discount that currently wins for
+    it. Rebuilt by store.pricing.refresh_service_prices() whenever discounts
+    change or a discount window opens or closes.
+    """
+    service = models.OneToOneField(Service, on_delete=models.CASCADE, primary_key=True, related_name='current_price')
+    discount = models.ForeignKey(Discount, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    price = models.DecimalField(max_digits=12, decimal_places=2)
+    refreshed_at = models.DateTimeField()
+
 
 class Comment(models.Model):
     COMMENT_STATUS_WAITING = 'w'
@@ -98,6 +147,15 @@ class Comment(models.Model):
     datetime_created = models.DateTimeField(auto_now_add=True)
     datetime_modified = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['service', 'datetime_created'],
+                name='store_comment_approved_idx',
+                condition=Q(status='a'),
+            ),
+        ]
+
     @property
     def short_body(self):
         return truncatechars(self.body, 75)
@@ -145,16 +203,95 @@ class Order(models.Model):
 
 
 class OrderItem(models.Model):
+    FULFILLMENT_PENDING = 'p'
+    FULFILLMENT_PROCESSING = 'r'
+    FULFILLMENT_DONE = 'd'
+    FULFILLMENT_FAILED = 'f'
+    FULFILLMENT_STATUS = [
+        (FULFILLMENT_PENDING, 'Pending'),
+        (FULFILLMENT_PROCESSING, 'Processing'),
+        (FULFILLMENT_DONE, 'Fulfilled'),
+        (FULFILLMENT_FAILED, 'Failed'),
+    ]
+
     order = models.ForeignKey(Order, on_delete=models.PROTECT, related_name="items")
     service = models.ForeignKey(Service, on_delete=models.PROTECT)
     price = models.DecimalField(max_digits=10, decimal_places=0)
     quantity = models.PositiveSmallIntegerField(default=1)
     extra_data = models.JSONField(default=dict, blank=True, null=True)
+    fulfillment_status = models.CharField(max_length=1, choices=FULFILLMENT_STATUS, default=FULFILLMENT_PENDING)
+    fulfillment_attempts = models.PositiveSmallIntegerField(default=0)
+    fulfillment_error = models.TextField(blank=True)
+    fulfillment_claimed_at = models.DateTimeField(null=True, blank=True)
+    fulfillment_retry_at = models.DateTimeField(null=True, blank=True)
+    fulfilled_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['fulfillment_status', 'fulfillment_retry_at'],
+                condition=Q(fulfillment_status__in=['p', 'r']), name='store_item_unfulfilled_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.service.name} - {self.order.customer}"
 
 
+class OrderStatusChange(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.PROTECT, related_name="status_changes")
+    from_status = models.CharField(max_length=1, choices=Order.ORDER_STATUS)
+    to_status = models.CharField(max_length=1, choices=Order.ORDER_STATUS)
+    changed_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    note = models.CharField(max_length=250, blank=True)
+    datetime_created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Order {self.order_id}: {self.get_from_status_display()} -> {self.get_to_status_display()}"
+
+
+class OutboxEvent(models.Model):
+    """
+    A side effect of an order change, written in the same transaction as the
+    change and handed to its handlers later by store.tasks.relay_outbox_task.
+    """
+    ORDER_CREATED = 'order.created'
+    ORDER_PAID = 'order.paid'
+    ORDER_CANCELED = 'order.canceled'
+    EVENT_TYPES = [
+        (ORDER_CREATED, 'Order created'),
+        (ORDER_PAID, 'Order paid'),
+        (ORDER_CANCELED, 'Order canceled'),
+    ]
+
+    STATUS_PENDING = 'p'
+    STATUS_PROCESSED = 'd'
+    STATUS_DEAD = 'x'
+    STATUS = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSED, 'Processed'),
+        (STATUS_DEAD, 'Dead'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.PROTECT, related_name='events')
+    event_type = models.CharField(max_length=50, choices=EVENT_TYPES)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=1, choices=STATUS, default=STATUS_PENDING)
+    datetime_created = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=Q(status='p'), name='store_outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} (Order = {self.order_id})"
+
+
 class ServiceField(models.Model):
     service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='required_fields')
     field_name = models.CharField(max_length=100)
@@ -163,4 +300,49 @@ class ServiceField(models.Model):
     label = models.CharField(max_length=200, blank=True)
 
     def __str__(self):
-        return f"{self.service.name} - {self.field_name}"
\ No newline at end of file
+        return f"{self.service.name} - {self.field_name}"
+
+
+class ImageUpload(models.Model):
+    """
+    An image sent in chunks for an application or a service. Chunks are
+    appended to ``temp_path`` and, once complete, store.tasks validates the
+    file and attaches it to the target's ``image``.
+    """
+    STATUS_UPLOADING = 'u'
+    STATUS_PROCESSING = 'p'
+    STATUS_DONE = 'd'
+    STATUS_FAILED = 'f'
+    STATUS = [
+        (STATUS_UPLOADING, 'Uploading'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid4)
+    application = models.ForeignKey(Application, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    service = models.ForeignKey(Service, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    filename = models.CharField(max_length=250)
+    size = models.PositiveIntegerField()
+    received = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=1, choices=STATUS, default=STATUS_UPLOADING)
+    error = models.TextField(blank=True)
+    uploaded_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL, related_name='+')
+    datetime_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(application__isnull=False, service__isnull=True) | Q(application__isnull=True, service__isnull=False),
+                name='store_upload_one_target',
+            ),
+        ]
+
+    @property
+    def temp_path(self):
+        return settings.IMAGE_UPLOAD_TEMP_DIR / f'{self.pk}.part'
+
+    @property
+    def target(self):
+        return self.application or self.service
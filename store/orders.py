@@ -0,0 +1,126 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+
+from .models import Order, OrderStatusChange, OutboxEvent
+from .outbox import kick_relay
+
+
+# The only status changes an order can make; paid and canceled are final.
+ALLOWED_TRANSITIONS = {
+    (Order.ORDER_STATUS_UNPAID, Order.ORDER_STATUS_PAID),
+    (Order.ORDER_STATUS_UNPAID, Order.ORDER_STATUS_CANCELED),
+}
+
+STATUS_EVENTS = {
+    Order.ORDER_STATUS_PAID: OutboxEvent.ORDER_PAID,
+    Order.ORDER_STATUS_CANCELED: OutboxEvent.ORDER_CANCELED,
+}
+
+
+def transition_orders(order_ids, from_status, to_status, user=None, note='', **payload):
+    """
+    Move every order in ``order_ids`` that is still in ``from_status`` to
+    ``to_status`` with one guarded UPDATE, and write the audit rows and
+    outbox events (carrying ``payload``) for those in bulk. Returns ``{order_id: result}`` where
+    result is 'updated', 'not_found' or the status that blocked the change.
+    Raises ValueError for a pair not in ALLOWED_TRANSITIONS.
+    """
+    if (from_status, to_status) not in ALLOWED_TRANSITIONS:
+        raise ValueError(f"Orders cannot move from {from_status!r} to {to_status!r}.")
+    order_ids = set(order_ids)
+    with transaction.atomic():
+        matched = dict(
+            Order.objects.select_for_update().filter(pk__in=order_ids, status=from_status).values_list('pk', 'customer_id')
+        )
+        Order.objects.filter(pk__in=matched, status=from_status).update(status=to_status)
+        OrderStatusChange.objects.bulk_create(
+            OrderStatusChange(order_id=pk, from_status=from_status, to_status=to_status, changed_by=user, note=note)
+            for pk in matched
+        )
+        event_type = STATUS_EVENTS.get(to_status)
+        if event_type and matched:
+            OutboxEvent.objects.bulk_create(OutboxEvent(order_id=pk, event_type=event_type, payload=payload) for pk in matched)
+            transaction.on_commit(kick_relay)
+        invalidate_customer_summaries(matched.values())
+
+    results = dict.fromkeys(order_ids, 'not_found')
+    unmatched = order_ids - set(matched)
+    if unmatched:
+        results.update(Order.objects.filter(pk__in=unmatched).values_list('pk', 'status'))
+    results.update(dict.fromkeys(matched, 'updated'))
+    return results
+
+
+def customer_summary_version_key(customer_id):
+    return f'customer_summary_version_{customer_id}'
+
+
+def customer_summary_version(customer_id):
+    key = customer_summary_version_key(customer_id)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock so a lost or expired counter never lands on a
+        # version still cached; the summaries it points at expire long before.
+        cache.add(key, time.time_ns(), settings.CUSTOMER_SUMMARY_CACHE_TTL * 10)
+        version = cache.get(key)
+    return version
+
+
+def customer_summary_cache_key(customer_id, version):
+    return f'customer_summary_{customer_id}_{version}'
+
+
+def build_customer_summary(customer_id):
+    """Order count per status, total spent and the latest order, from one grouped query."""
+    rows = list(
+        Order.objects.filter(customer_id=customer_id).order_by().values('status').annotate(
+            order_count=Count('pk', distinct=True),
+            spent=Sum(F('items__price') * F('items__quantity')),
+            last_id=Max('pk'),
+            last_created=Max('datetime_created'),
+        )
+    )
+    last_order = None
+    if rows:
+        latest = max(rows, key=lambda row: row['last_id'])
+        last_order = {'id': latest['last_id'], 'datetime_created': latest['last_created'], 'status': latest['status']}
+    by_status = {row['status']: row for row in rows}
+    paid = by_status.get(Order.ORDER_STATUS_PAID)
+    return {
+        'order_count': sum(row['order_count'] for row in rows),
+        'orders_by_status': {status: by_status[status]['order_count'] if status in by_status else 0 for status, _ in Order.ORDER_STATUS},
+        'total_spent': (paid['spent'] or 0) if paid else 0,
+        'last_order': last_order,
+    }
+
+
+def get_customer_summary(customer_id):
+    """
+    The cached summary under the customer's current version. A summary built
+    from rows read before a commit lands under the old version, which no
+    reader asks for once the commit has bumped it.
+    """
+    return cache.get_or_set(
+        customer_summary_cache_key(customer_id, customer_summary_version(customer_id)),
+        lambda: build_customer_summary(customer_id), settings.CUSTOMER_SUMMARY_CACHE_TTL,
+    )
+
+
+def invalidate_customer_summaries(customer_ids):
+    """Bump the customers' summary versions once the current transaction commits."""
+    keys = [customer_summary_version_key(customer_id) for customer_id in set(customer_ids)]
+
+    def bump_versions():
+        for key in keys:
+            try:
+                cache.incr(key)
+            except ValueError:
+                # No version yet; the next read starts a fresh one.
+                pass
+
+    if keys:
+        transaction.on_commit(bump_versions)
@@ -0,0 +1,126 @@
+import time
+
+from django.conf import settings
+
+from config.redis_client import get_redis
+
+
+# A user's whole OTP state lives in one hash:
+#   code, phone, code_expires  - the pending phone change and its code
+#   last_sent                  - for the resend cooldown
+#   win_start, win_count, prev_count - sliding window counter of sends
+#   attempts                   - failed verifications against the current code
+ISSUE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local phone = ARGV[3]
+local code_ttl = tonumber(ARGV[4])
+local cooldown = tonumber(ARGV[5])
+local window = tonumber(ARGV[6])
+local limit = tonumber(ARGV[7])
+
+local state = redis.call('HMGET', KEYS[1], 'phone', 'code_expires', 'last_sent', 'win_start', 'win_count', 'prev_count')
+
+if phone == '' then
+    if not state[1] or tonumber(state[2] or '0') < now then
+        return {1, 0, ''}
+    end
+    phone = state[1]
+end
+
+local last_sent = tonumber(state[3] or '0')
+if now - last_sent < cooldown then
+    return {2, cooldown - (now - last_sent), phone}
+end
+
+local current_start = now - (now % window)
+local win_start = tonumber(state[4] or '0')
+local count = tonumber(state[5] or '0')
+local prev = tonumber(state[6] or '0')
+if win_start ~= current_start then
+    if win_start == current_start - window then
+        prev = count
+    else
+        prev = 0
+    end
+    count = 0
+end
+
+local elapsed = now - current_start
+if prev * (window - elapsed) / window + count >= limit then
+    return {3, window - elapsed, phone}
+end
+
+redis.call('HSET', KEYS[1],
+    'code', ARGV[2], 'phone', phone, 'code_expires', now + code_ttl, 'attempts', 0,
+    'last_sent', now, 'win_start', current_start, 'win_count', count + 1, 'prev_count', prev)
+redis.call('EXPIRE', KEYS[1], window * 2)
+return {0, 0, phone}
+"""
+
+VERIFY_SCRIPT = """
+local now = tonumber(ARGV[1])
+local state = redis.call('HMGET', KEYS[1], 'code', 'phone', 'code_expires')
+if not state[1] or not state[2] or tonumber(state[3] or '0') < now then
+    return false
+end
+if state[1] ~= ARGV[2] then
+    if redis.call('HINCRBY', KEYS[1], 'attempts', 1) >= tonumber(ARGV[3]) then
+        redis.call('HDEL', KEYS[1], 'code', 'phone', 'code_expires')
+    end
+    return false
+end
+redis.call('HDEL', KEYS[1], 'code', 'phone', 'code_expires', 'attempts')
+return state[2]
+"""
+
+
+class OtpStore:
+    ISSUED = 0
+    NO_PENDING_PHONE = 1
+    COOLDOWN = 2
+    LIMIT_REACHED = 3
+
+    def __init__(self, prefix='otp'):
+        self.prefix = prefix
+        self.issue_script = None
+        self.verify_script = None
+
+    def key(self, user_id):
+        return f'{self.prefix}:{user_id}'
+
+    def client(self):
+        client = get_redis()
+        if self.issue_script is None:
+            self.issue_script = client.register_script(ISSUE_SCRIPT)
+            self.verify_script = client.register_script(VERIFY_SCRIPT)
+        return client
+
+    def issue(self, user_id, code, phone=None):
+        """
+        Store a new code, for ``phone`` or for the already pending phone when
+        resending. Returns ``(status, retry_after_seconds, phone)``.
+        """
+        client = self.client()
+        status, retry_after, phone = self.issue_script(
+            keys=[self.key(user_id)],
+            args=[
+                int(time.time()), code, str(phone) if phone else '',
+                settings.OTP_CODE_TTL, settings.OTP_RESEND_COOLDOWN,
+                settings.OTP_SEND_WINDOW, settings.OTP_MAX_SENDS_PER_WINDOW,
+            ],
+            client=client,
+        )
+        return int(status), int(retry_after), phone.decode()
+
+    def verify(self, user_id, code):
+        """Consume the code and return the pending phone, or None."""
+        client = self.client()
+        phone = self.verify_script(
+            keys=[self.key(user_id)],
+            args=[int(time.time()), code, settings.OTP_MAX_VERIFY_ATTEMPTS],
+            client=client,
+        )
+        return phone.decode() if phone else None
+
+
+otp_store = OtpStore()
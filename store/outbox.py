@@ -0,0 +1,111 @@
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, Min, OuterRef, Q
+from django.utils import timezone
+
+from .models import Order, OutboxEvent
+from .sms import send_sms
+
+
+logger = logging.getLogger(__name__)
+
+_handlers = defaultdict(list)
+
+
+def outbox_handler(event_type):
+    """Register the decorated function to run for every ``event_type`` event."""
+    def register(func):
+        _handlers[event_type].append(func)
+        return func
+    return register
+
+
+def kick_relay():
+    from .tasks import relay_outbox_task
+
+    try:
+        relay_outbox_task.delay()
+    except Exception:
+        # The event is already committed; the periodic relay sweep picks it up.
+        logger.warning("Could not queue the outbox relay", exc_info=True)
+
+
+def record_event(order, event_type, **payload):
+    """
+    Add an event for ``order`` to the current transaction. The relay is
+    queued once the transaction commits, so handlers never see an event
+    whose order change was rolled back.
+    """
+    event = OutboxEvent.objects.create(order=order, event_type=event_type, payload=payload)
+    transaction.on_commit(kick_relay)
+    return event
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def pending_events(now=None):
+    """
+    Pending events that are due and next in line for their order: an event
+    is held back while an earlier pending one of the same order (even one
+    waiting out a retry delay) exists, so handlers see each order's events
+    in the order they were written. Dead events no longer hold anything up.
+    """
+    now = now or timezone.now()
+    earlier = OutboxEvent.objects.filter(order=OuterRef('order'), status=OutboxEvent.STATUS_PENDING, pk__lt=OuterRef('pk'))
+    return OutboxEvent.objects.filter(
+        Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now), status=OutboxEvent.STATUS_PENDING,
+    ).exclude(Exists(earlier)).order_by('pk')
+
+
+def relay_outbox_batch(batch_size):
+    """
+    Run the handlers of up to ``batch_size`` due events. Rows are claimed
+    with SKIP LOCKED so parallel relays split the backlog instead of waiting
+    on each other. A failed event waits OUTBOX_RETRY_DELAY seconds, doubled
+    per attempt, and is marked dead after OUTBOX_MAX_ATTEMPTS.
+    Returns ``(processed, failed)``.
+    """
+    processed = failed = 0
+    with transaction.atomic():
+        now = timezone.now()
+        events = list(pending_events(now).select_for_update(skip_locked=True)[:batch_size])
+        for event in events:
+            try:
+                with transaction.atomic():
+                    for handler in _handlers[event.event_type]:
+                        handler(event)
+            except Exception as e:
+                logger.exception("Outbox handler failed for event %s", event.pk)
+                event.attempts += 1
+                event.last_error = repr(e)
+                if event.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                    event.status = OutboxEvent.STATUS_DEAD
+                else:
+                    event.next_attempt_at = now + retry_delay(event.attempts)
+                failed += 1
+            else:
+                event.status = OutboxEvent.STATUS_PROCESSED
+                event.processed_at = now
+                processed += 1
+        OutboxEvent.objects.bulk_update(events, ['status', 'processed_at', 'attempts', 'next_attempt_at', 'last_error'])
+    return processed, failed
+
+
+def next_attempt_at():
+    """When the earliest event waiting out a retry delay is due, or None."""
+    return OutboxEvent.objects.filter(
+        status=OutboxEvent.STATUS_PENDING, next_attempt_at__isnull=False,
+    ).aggregate(next_attempt=Min('next_attempt_at'))['next_attempt']
+
+
+@outbox_handler(OutboxEvent.ORDER_PAID)
+def send_payment_confirmation(event):
+    order = Order.objects.select_related('customer').get(pk=event.order_id)
+    if order.customer.phone_number:
+        send_sms(order.customer.phone_number, f'Payment for order {order.pk} was confirmed. Reference: {order.payment_ref_id}')
@@ -1,5 +1,123 @@
+import json
+
+from django.conf import settings
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+
+def estimate_count(queryset):
+    """
+    Planner row estimate for ``queryset`` on PostgreSQL: pg_class.reltuples
+    for a whole table, the EXPLAIN estimate for anything filtered. None on
+    other databases or when the table has never been analyzed.
+    """
+    if not isinstance(queryset, QuerySet):
+        return None
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    query = queryset.query
+    with connection.cursor() as cursor:
+        if not query.where and not query.distinct and not query.combinator:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None
+        sql, params = query.sql_with_params()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class EstimatedPage(Page):
+    """A page whose neighbours are known from the rows read, not from the count."""
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def next_page_number(self):
+        if not self._has_next:
+            raise EmptyPage(self.paginator.error_messages['no_results'])
+        return self.number + 1
+
+    def previous_page_number(self):
+        if self.number <= 1:
+            raise EmptyPage(self.paginator.error_messages['min_page'])
+        return self.number - 1
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Uses the planner's row estimate as the count once it reaches
+    PAGINATION_ESTIMATE_THRESHOLD, so big tables don't pay for an exact
+    COUNT(*). Smaller (including most filtered) sets still count exactly.
+
+    An estimate can be off either way, so with one a page reads a row past
+    its end to learn whether there is a next page, any page number that
+    still has rows is valid, and the count is corrected to agree with what
+    the page saw; on the last page it becomes exact.
+    """
+
+    count_is_estimate = False
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is not None and estimate >= settings.PAGINATION_ESTIMATE_THRESHOLD:
+            self.count_is_estimate = True
+            return estimate
+        return Paginator.count.func(self)
+
+    def page(self, number):
+        self.count  # Decides whether the count is an estimate.
+        if not self.count_is_estimate:
+            return super().page(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages['invalid_page'])
+        if number < 1:
+            raise EmptyPage(self.error_messages['min_page'])
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(self.error_messages['no_results'])
+        has_next = len(rows) > self.per_page
+        seen = bottom + len(rows)
+        if has_next:
+            self.__dict__['count'] = max(self.count, seen)
+        else:
+            self.__dict__['count'] = seen
+            self.count_is_estimate = False
+        self.__dict__.pop('num_pages', None)
+        return EstimatedPage(rows[:self.per_page], number, self, has_next)
 
 
 class DefaultPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+    django_paginator_class = EstimatedCountPaginator
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.page.paginator.count,
+            'count_is_estimate': self.page.paginator.count_is_estimate,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count_is_estimate'] = {'type': 'boolean', 'example': False}
+        return response_schema
@@ -0,0 +1,119 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .catalog import invalidate_catalog_overview
+from .models import Discount, Service, ServicePrice
+
+
+CENT = Decimal('0.01')
+
+
+def active_discounts(now):
+    return Discount.objects.filter(
+        Q(starts_at__isnull=True) | Q(starts_at__lte=now),
+        Q(ends_at__isnull=True) | Q(ends_at__gt=now),
+    ).prefetch_related('applications')
+
+
+def targeted_services(discount_id):
+    """Services a discount applies to: its own, and every service of its applications."""
+    applications = Discount.applications.through.objects.filter(discount_id=discount_id).values('application_id')
+    return Service.objects.filter(Q(discounts_id=discount_id) | Q(application_id__in=applications))
+
+
+def winning_discount(service, own_discounts, application_discounts):
+    """
+    Highest priority wins; on a tie the service's own discount beats an
+    application-wide one, then the larger percentage wins.
+    """
+    candidates = [(discount.priority, 1, discount.discount_percent, discount) for discount in own_discounts.get(service.discounts_id, ())]
+    candidates += [(discount.priority, 0, discount.discount_percent, discount) for discount in application_discounts.get(service.application_id, ())]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda candidate: candidate[:3])[3]
+
+
+def refresh_service_prices(service_ids=None, now=None):
+    """
+    Recompute the ServicePrice rows of ``service_ids`` (every service when
+    None) for the discounts active at ``now``.
+    """
+    now = now or timezone.now()
+    own_discounts = {}
+    application_discounts = defaultdict(list)
+    for discount in active_discounts(now):
+        own_discounts[discount.pk] = [discount]
+        for application in discount.applications.all():
+            application_discounts[application.pk].append(discount)
+
+    services = Service.objects.only('pk', 'price', 'application_id', 'discounts_id')
+    if service_ids is not None:
+        services = services.filter(pk__in=service_ids)
+
+    rows = []
+    for service in services.iterator(chunk_size=2000):
+        discount = winning_discount(service, own_discounts, application_discounts)
+        price = service.price
+        if discount is not None:
+            price = price * (Decimal(100) - discount.discount_percent) / Decimal(100)
+        rows.append(ServicePrice(service_id=service.pk, discount=discount, price=price.quantize(CENT), refreshed_at=now))
+
+    ServicePrice.objects.bulk_create(
+        rows, batch_size=1000,
+        update_conflicts=True, unique_fields=['service'], update_fields=['discount', 'price', 'refreshed_at'],
+    )
+    invalidate_catalog_overview()
+    return len(rows)
+
+
+def next_price_boundary(now):
+    """The next moment a discount window opens or closes, or None."""
+    bounds = Discount.objects.aggregate(
+        next_start=Min('starts_at', filter=Q(starts_at__gt=now)),
+        next_end=Min('ends_at', filter=Q(ends_at__gt=now)),
+    )
+    upcoming = [moment for moment in bounds.values() if moment is not None]
+    return min(upcoming) if upcoming else None
+
+
+def schedule_next_price_refresh(now=None):
+    """
+    Queue a full refresh for the next window boundary when it is within
+    PRICE_REFRESH_ETA_HORIZON seconds; later ones are left to the periodic
+    refresh_prices_if_due(), since brokers redeliver long ETA tasks. Every
+    discount change calls this, so the cache key keeps one task per boundary.
+    """
+    from .tasks import refresh_service_prices_task
+
+    now = now or timezone.now()
+    boundary = next_price_boundary(now)
+    if boundary is None or (boundary - now).total_seconds() > settings.PRICE_REFRESH_ETA_HORIZON:
+        return None
+    timeout = int((boundary - now).total_seconds()) + 60
+    if cache.add(f'price_refresh_{int(boundary.timestamp())}', True, timeout=timeout):
+        refresh_service_prices_task.apply_async(eta=boundary)
+    return boundary
+
+
+def refresh_prices_if_due(now=None):
+    """
+    Refresh every price if a discount window opened or closed since the
+    oldest ServicePrice was computed. Beat runs this every
+    PRICE_REFRESH_INTERVAL seconds as the fallback for boundaries no ETA
+    task covered. Returns the number of rows refreshed.
+    """
+    now = now or timezone.now()
+    oldest = ServicePrice.objects.aggregate(oldest=Min('refreshed_at'))['oldest']
+    if oldest is None:
+        if not Service.objects.exists():
+            return 0
+    elif not Discount.objects.filter(
+        Q(starts_at__gt=oldest, starts_at__lte=now) | Q(ends_at__gt=oldest, ends_at__lte=now)
+    ).exists():
+        return 0
+    return refresh_service_prices(now=now)
@@ -3,7 +3,9 @@ from django.db import transaction
 
 from rest_framework import serializers
 
-from .models import Application, Customer, Service, Comment, Cart, CartItem, Order, OrderItem, Discount, ServiceField
+from .models import Application, Customer, Service, Comment, Cart, CartItem, ImageUpload, Order, OrderItem, OutboxEvent, Discount, ServiceField
+from .orders import ALLOWED_TRANSITIONS
+from .outbox import record_event
 
 
 class ApplicationSerializer(serializers.ModelSerializer):
@@ -17,7 +19,7 @@ class ApplicationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Application
-        fields = ["title", "description", "top_service", "image", "image_url"]
+        fields = ["id", "title", "description", "top_service", "image", "image_url"]
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -49,6 +51,32 @@ class ApplicationSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
+class TopServiceSerializer(serializers.ModelSerializer):
+    discounted_price = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Service
+        fields = ["id", "name", "price", "discounted_price"]
+
+    def get_discounted_price(self, obj):
+        return obj.get_discounted_price()
+
+
+class ApplicationOverviewSerializer(serializers.ModelSerializer):
+    top_service = TopServiceSerializer(read_only=True)
+    image_url = serializers.SerializerMethodField()
+    service_count = serializers.IntegerField(read_only=True)
+    min_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    max_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    best_discount_percent = serializers.DecimalField(max_digits=5, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = Application
+        fields = ["id", "title", "description", "image_url", "top_service", "service_count", "min_price", "max_price", "best_discount_percent"]
+
+    get_image_url = ApplicationSerializer.get_image_url
+
+
 class ServiceFieldSerializer(serializers.ModelSerializer):
     class Meta:
         model = ServiceField
@@ -68,7 +96,7 @@ class ServiceSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Service
-        fields = ["id", "name", "description", "price", "discounts", "discounted_price", "image", "image_url", "required_fields"]
+        fields = ["id", "name", "description", "price", "discounts", "discounted_price", "image", "image_url", "required_fields", "approved_comment_count", "latest_comment_at"]
     
     def get_discounted_price(self, obj):
         return obj.get_discounted_price()
@@ -100,6 +128,23 @@ class CommentSerializer(serializers.ModelSerializer):
         read_only_fields = ["author"]
 
 
+class CommentModerationSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=1000)
+    status = serializers.ChoiceField(choices=[Comment.COMMENT_STATUS_APPROVED, Comment.COMMENT_STATUS_NOT_APPROVED])
+
+
+class OrderStatusTransitionSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=5000)
+    from_status = serializers.ChoiceField(choices=Order.ORDER_STATUS)
+    to_status = serializers.ChoiceField(choices=Order.ORDER_STATUS)
+    note = serializers.CharField(max_length=250, required=False, allow_blank=True)
+
+    def validate(self, data):
+        if (data['from_status'], data['to_status']) not in ALLOWED_TRANSITIONS:
+            raise serializers.ValidationError("Orders cannot move from this status to that one.")
+        return data
+
+
 class CartItemExtraDataSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
@@ -239,7 +284,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = OrderItem
-        fields = ["id", "service", "quantity", "price", "item_total_price", "extra_data"]
+        fields = ["id", "service", "quantity", "price", "item_total_price", "extra_data", "fulfillment_status"]
 
     def get_item_total_price(self, obj):
         return obj.quantity * obj.price
@@ -315,12 +360,12 @@ class OrderCreateSerializer(serializers.Serializer):
         with transaction.atomic():
             cart_id = self.validated_data["cart_id"]
             user = self.context["user"]
-            customer = Customer.objects.get(user=user)
+            customer = self.context.get("customer") or Customer.objects.get(user=user)
 
             order = Order(customer=customer, status=Order.ORDER_STATUS_UNPAID)
             order.save()
 
-            cart_items = CartItem.objects.select_related("service").filter(cart_id=cart_id)
+            cart_items = CartItem.objects.select_related("service__discounts", "service__current_price").filter(cart_id=cart_id)
 
             order_items = []
             for item in cart_items:
@@ -338,13 +383,15 @@ class OrderCreateSerializer(serializers.Serializer):
 
             Cart.objects.filter(pk=cart_id).delete()
 
+            record_event(order, OutboxEvent.ORDER_CREATED)
+
             return order
 
 
 class DiscountSerializer(serializers.ModelSerializer):
     class Meta:
         model = Discount
-        fields = ["id", "name", "discount_percent"]
+        fields = ["id", "name", "discount_percent", "starts_at", "ends_at", "priority", "applications"]
 
 
 class CustomerSerializer(serializers.ModelSerializer):
@@ -357,6 +404,43 @@ class CustomerSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'username', 'email', 'is_phone_verified']
 
 
+class LastOrderSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    datetime_created = serializers.DateTimeField()
+    status = serializers.ChoiceField(choices=Order.ORDER_STATUS)
+
+
+class CustomerSummarySerializer(serializers.Serializer):
+    order_count = serializers.IntegerField()
+    orders_by_status = serializers.DictField(child=serializers.IntegerField())
+    total_spent = serializers.DecimalField(max_digits=14, decimal_places=0)
+    last_order = LastOrderSerializer(allow_null=True)
+
+
+class BatchSubRequestSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'], default='GET')
+    path = serializers.RegexField(r'^/', max_length=2000)
+    body = serializers.JSONField(required=False)
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = BatchSubRequestSerializer(many=True, allow_empty=False, max_length=settings.BATCH_MAX_REQUESTS)
+
+
+class ImageUploadSerializer(serializers.ModelSerializer):
+    size = serializers.IntegerField(min_value=1, max_value=settings.IMAGE_UPLOAD_MAX_SIZE)
+
+    class Meta:
+        model = ImageUpload
+        fields = ["id", "application", "service", "filename", "size", "received", "status", "error", "datetime_created"]
+        read_only_fields = ["id", "received", "status", "error", "datetime_created"]
+
+    def validate(self, data):
+        if bool(data.get('application')) == bool(data.get('service')):
+            raise serializers.ValidationError("Set exactly one of application and service.")
+        return data
+
+
 class EmptySerializer(serializers.Serializer):
     pass
 
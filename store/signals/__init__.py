@@ -1,4 +1,13 @@
-from .signals import create_customer_profile
+from .signals import (
+    create_customer_profile, invalidate_cached_user, invalidate_cached_customer, remember_comment_status, update_service_comment_stats,
+    uncount_deleted_comment, invalidate_catalog, refresh_service_price, refresh_discounted_prices, refresh_retargeted_prices,
+    invalidate_customer_summary, invalidate_item_customer_summary,
+)
 
 
-__all__ = ['create_customer_profile']
\ No newline at end of file
+__all__ = [
+    'create_customer_profile', 'invalidate_cached_user', 'invalidate_cached_customer',
+    'remember_comment_status', 'update_service_comment_stats', 'uncount_deleted_comment', 'invalidate_catalog',
+    'refresh_service_price', 'refresh_discounted_prices', 'refresh_retargeted_prices', 'invalidate_customer_summary',
+    'invalidate_item_customer_summary',
+]
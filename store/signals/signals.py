@@ -1,11 +1,98 @@
-from django.db.models.signals import post_save
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 
 from core.models import CustomUser
-from ..models import Customer
+from ..authentication import auth_user_cache_key
+from ..catalog import invalidate_catalog_overview
+from ..pricing import refresh_service_prices
+from ..models import Application, Customer, Comment, Discount, Order, OrderItem, Service
+from ..orders import invalidate_customer_summaries
+from ..tasks import refresh_service_prices_task
 
 
 @receiver(post_save, sender=CustomUser)
 def create_customer_profile(sender, instance, created, **kwargs):
     if created:
-        Customer.objects.create(user=instance)
\ No newline at end of file
+        Customer.objects.create(user=instance)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    cache.delete(auth_user_cache_key(instance.pk))
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def invalidate_cached_customer(sender, instance, **kwargs):
+    cache.delete(auth_user_cache_key(instance.user_id))
+
+
+@receiver(pre_save, sender=Comment)
+def remember_comment_status(sender, instance, raw=False, **kwargs):
+    instance._previous_status = None
+    if not raw and not instance._state.adding:
+        instance._previous_status = Comment.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+
+@receiver(post_save, sender=Comment)
+def update_service_comment_stats(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    was_approved = getattr(instance, '_previous_status', None) == Comment.COMMENT_STATUS_APPROVED
+    is_approved = instance.status == Comment.COMMENT_STATUS_APPROVED
+    if was_approved != is_approved:
+        Service.apply_approved_comment_deltas({instance.service_id: 1 if is_approved else -1})
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_deleted_comment(sender, instance, **kwargs):
+    if instance.status == Comment.COMMENT_STATUS_APPROVED:
+        Service.apply_approved_comment_deltas({instance.service_id: -1})
+
+
+@receiver(post_save, sender=Application)
+@receiver(post_delete, sender=Application)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+def invalidate_catalog(sender, instance, **kwargs):
+    invalidate_catalog_overview()
+
+
+@receiver(post_save, sender=Service)
+def refresh_service_price(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_service_prices([instance.pk])
+
+
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+def refresh_discounted_prices(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(refresh_service_prices_task.delay)
+
+
+@receiver(m2m_changed, sender=Discount.applications.through)
+def refresh_retargeted_prices(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(refresh_service_prices_task.delay)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_customer_summary(sender, instance, **kwargs):
+    invalidate_customer_summaries([instance.customer_id])
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def invalidate_item_customer_summary(sender, instance, **kwargs):
+    if OrderItem.order.is_cached(instance):
+        customer_ids = [instance.order.customer_id]
+    else:
+        customer_ids = Order.objects.filter(pk=instance.order_id).values_list('customer_id', flat=True)
+    invalidate_customer_summaries(customer_ids)
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+
+import requests
+from django.conf import settings
+from kavenegar import KavenegarAPI, APIException, HTTPException
+
+from config import metrics
+from config.redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+SMS_OUTBOX_KEY = 'sms:outbox'
+# The batch being sent; it stays here until Kavenegar has answered.
+SMS_PROCESSING_KEY = 'sms:outbox:processing'
+
+# Returns the batch left in the processing list by a failed or crashed
+# flush, or else moves up to ARGV[1] messages there from the outbox.
+TAKE_BATCH_SCRIPT = """
+local pending = redis.call('LRANGE', KEYS[2], 0, -1)
+if #pending > 0 then
+    return pending
+end
+local batch = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #batch > 0 then
+    redis.call('LTRIM', KEYS[1], #batch, -1)
+    redis.call('RPUSH', KEYS[2], unpack(batch))
+end
+return batch
+"""
+
+
+class SessionKavenegarAPI(KavenegarAPI):
+    """
+    KavenegarAPI posts through a bare ``requests.post`` which opens a new TLS
+    connection per message. This keeps one pooled session per client instead.
+    """
+
+    def __init__(self, apikey, base_url, timeout=10):
+        super().__init__(apikey)
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=10)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _request(self, action, method, params={}):
+        url = f'{self.base_url}/{self.apikey}/{action}/{method}.json'
+        try:
+            with metrics.timer('kavenegar'):
+                content = self.session.post(url, data=params, timeout=self.timeout).content
+        except requests.exceptions.RequestException as e:
+            raise HTTPException(e)
+        try:
+            response = json.loads(content.decode('utf-8'))
+        except ValueError as e:
+            raise HTTPException(e)
+        if response['return']['status'] != 200:
+            raise APIException(f"APIException[{response['return']['status']}] {response['return']['message']}")
+        return response['entries']
+
+
+_client = None
+_client_pid = None
+
+
+def get_sms_client():
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = SessionKavenegarAPI(settings.KAVENEGAR_API_KEY, settings.KAVENEGAR_API_URL, settings.KAVENEGAR_TIMEOUT)
+        _client_pid = os.getpid()
+    return _client
+
+
+def send_sms_now(phone, message):
+    params = {
+        'sender': settings.KAVENEGAR_SENDER,
+        'receptor': str(phone),
+        'message': message
+    }
+    return get_sms_client().sms_send(params)
+
+
+def send_sms_batch(messages):
+    params = {
+        'sender': json.dumps([settings.KAVENEGAR_SENDER] * len(messages)),
+        'receptor': json.dumps([str(phone) for phone, _ in messages]),
+        'message': json.dumps([message for _, message in messages], ensure_ascii=False),
+    }
+    return get_sms_client().sms_sendarray(params)
+
+
+def send_sms(phone, message, otp=False):
+    """
+    OTP messages skip the outbox and go out on their own task right away.
+    Everything else is buffered in Redis and sent with the array-send API,
+    flushed once a batch fills up or ``SMS_BATCH_INTERVAL`` seconds after the
+    first message landed in an empty outbox; beat also flushes every
+    ``SMS_FLUSH_INTERVAL`` seconds for anything those runs left behind.
+    """
+    from .tasks import send_sms_task, flush_sms_outbox_task
+
+    if otp:
+        send_sms_task.delay(str(phone), message)
+        return
+
+    length = get_redis().rpush(SMS_OUTBOX_KEY, json.dumps([str(phone), message]))
+    if length % settings.SMS_BATCH_SIZE == 0:
+        flush_sms_outbox_task.delay()
+    elif length == 1:
+        flush_sms_outbox_task.apply_async(countdown=settings.SMS_BATCH_INTERVAL)
+
+
+def take_sms_batch(size):
+    """
+    The next batch to send, kept in the processing list until
+    ack_sms_batch(). A batch whose send failed or whose worker died comes
+    back first, so delivery is at least once: a crash after Kavenegar
+    accepted a batch but before the ack sends it again.
+    """
+    raw_messages = get_redis().eval(TAKE_BATCH_SCRIPT, 2, SMS_OUTBOX_KEY, SMS_PROCESSING_KEY, size)
+    return [tuple(json.loads(raw)) for raw in raw_messages]
+
+
+def ack_sms_batch():
+    get_redis().delete(SMS_PROCESSING_KEY)
@@ -1,17 +1,122 @@
+import logging
+
 from celery import shared_task
-from kavenegar import KavenegarAPI
 from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from kavenegar import APIException, HTTPException
+
+from config.locks import acquire_lock, extend_lock, release_lock
+
+from .fulfillment import claimable_items, next_retry_at, run_fulfillment
+from .outbox import next_attempt_at, relay_outbox_batch
+from .pricing import refresh_prices_if_due, refresh_service_prices, schedule_next_price_refresh
+from .sms import ack_sms_batch, send_sms_now, send_sms_batch, take_sms_batch
+from .uploads import delete_stale_uploads, process_upload
+
 
-@shared_task
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True, acks_late=True, reject_on_worker_lost=True, autoretry_for=(HTTPException,), max_retries=3, retry_backoff=2)
 def send_sms_task(phone, message):
     try:
-        api = KavenegarAPI(settings.KAVENEGAR_API_KEY)
-        params = {
-            'sender': settings.KAVENEGAR_SENDER,
-            'receptor': str(phone),
-            'message': message
-        }
-        response = api.sms_send(params)
-        return {"status": "success", "response": response}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        send_sms_now(phone, message)
+    except APIException:
+        logger.exception("Kavenegar rejected a message to %s", phone)
+
+
+@shared_task(bind=True, ignore_result=True, rate_limit='60/m', max_retries=5, default_retry_delay=10)
+def flush_sms_outbox_task(self):
+    """
+    One flusher at a time drains the outbox; a batch that could not be sent
+    stays in the processing list for the retry or the next beat run.
+    """
+    token = acquire_lock('sms_flush', settings.SMS_FLUSH_LOCK_TIMEOUT)
+    if token is None:
+        return
+    try:
+        while True:
+            batch = take_sms_batch(settings.SMS_BATCH_SIZE)
+            if not batch:
+                break
+            try:
+                send_sms_batch(batch)
+            except HTTPException as e:
+                raise self.retry(exc=e)
+            except APIException:
+                logger.exception("Kavenegar rejected a batch of %s messages", len(batch))
+            ack_sms_batch()
+            extend_lock('sms_flush', token, settings.SMS_FLUSH_LOCK_TIMEOUT)
+    finally:
+        release_lock('sms_flush', token)
+
+
+@shared_task(ignore_result=True, acks_late=True)
+def refresh_service_prices_task():
+    refresh_service_prices()
+    schedule_next_price_refresh()
+
+
+@shared_task(ignore_result=True)
+def refresh_due_service_prices_task():
+    refresh_prices_if_due()
+    schedule_next_price_refresh()
+
+
+@shared_task(bind=True, ignore_result=True)
+def relay_outbox_task(self):
+    """
+    Drain the due events, then queue one run for the earliest retry; beat
+    also runs this every OUTBOX_SWEEP_INTERVAL seconds for anything missed.
+    """
+    while True:
+        processed, failed = relay_outbox_batch(settings.OUTBOX_BATCH_SIZE)
+        if not processed and not failed:
+            break
+    retry_at = next_attempt_at()
+    if retry_at is None:
+        return
+    timeout = max(int((retry_at - timezone.now()).total_seconds()), 0) + 60
+    if cache.add(f'outbox_retry_{int(retry_at.timestamp())}', True, timeout):
+        self.apply_async(eta=retry_at)
+
+
+@shared_task(bind=True, ignore_result=True)
+def fulfill_order_items_task(self):
+    """
+    One dispatcher at a time feeds the fulfillment pool, so the per-provider
+    limits hold across workers; a dispatcher already running picks up new
+    items itself.
+    """
+    token = acquire_lock('fulfillment_dispatcher', settings.FULFILLMENT_CLAIM_TIMEOUT)
+    if token is None:
+        return
+
+    def heartbeat():
+        return extend_lock('fulfillment_dispatcher', token, settings.FULFILLMENT_CLAIM_TIMEOUT)
+
+    try:
+        results = run_fulfillment(settings.FULFILLMENT_RUN_SECONDS, heartbeat)
+    finally:
+        release_lock('fulfillment_dispatcher', token)
+    logger.info("Fulfillment run: %s fulfilled, %s failed", results['fulfilled'], results['failed'])
+
+    if claimable_items().exists():
+        self.delay()
+        return
+    retry_at = next_retry_at()
+    if retry_at is not None and cache.add(f'fulfillment_retry_{int(retry_at.timestamp())}', True, settings.FULFILLMENT_RUN_SECONDS):
+        self.apply_async(eta=retry_at)
+
+
+@shared_task(ignore_result=True, acks_late=True)
+def process_image_upload_task(upload_id):
+    process_upload(upload_id)
+
+
+@shared_task(ignore_result=True)
+def delete_stale_uploads_task():
+    cleaned = delete_stale_uploads()
+    if cleaned:
+        logger.info("Cleaned up %s abandoned image uploads", cleaned)
@@ -1,3 +1,1356 @@
-from django.test import TestCase
+import io
+import json
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import admin as admin_site
+from django.core.cache import cache, caches
+from django.core.paginator import EmptyPage
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from PIL import Image
+from kavenegar import HTTPException
+from rest_framework.exceptions import ParseError
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIClient, force_authenticate
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import AccessToken
+
+from config.cache import MISSING, CachedValue, LocalTier
+from config.celery import app as celery_app
+from config.compression import CompressionMiddleware, accepted_encodings
+from config.db_router import PrimaryStickinessMiddleware, ReplicaRouter, is_pinned_to_primary, pin_to_primary, primary_pin_exempt
+from config.idempotency import IdempotencyMiddleware, idempotency_cache_key
+from config.locks import acquire_lock, release_lock
+from config.metrics import RequestTimings, _current, histograms
+from config.redis_client import get_redis
+from config.task_metrics import record_task_finish, record_task_start, stamp_published_at, task_stats
+from core.models import CustomUser
+from .authentication import auth_user_cache_key
+from .fulfillment import PermanentFulfillmentError, _providers, claimable_items, fulfillment_provider, refresh_claims, run_fulfillment
+from .mixins import ReplicaReadMixin
+from .models import Application, Customer, Service, ServiceField, Comment, Cart, CartItem, ImageUpload, Order, OrderItem, OrderStatusChange, OutboxEvent, Discount
+from .orders import build_customer_summary, customer_summary_cache_key, customer_summary_version, get_customer_summary
+from .otp import OtpStore
+from .parsers import ORJSONParser
+from .paginations import EstimatedCountPaginator, estimate_count
+from .outbox import _handlers, pending_events, relay_outbox_batch
+from .pricing import refresh_prices_if_due, refresh_service_prices, schedule_next_price_refresh, targeted_services
+from .renderers import ORJSONRenderer
+from .serializers import ApplicationSerializer
+from .sms import SMS_OUTBOX_KEY, SMS_PROCESSING_KEY, send_sms, take_sms_batch
+from .tasks import delete_stale_uploads_task, process_image_upload_task, send_sms_task
+from .throttling import take_tokens
+from .uploads import delete_stale_uploads, process_upload
+from .urls import urlpatterns
+
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# Route name -> (method, expected status, maximum queries). Every route in
+# store/urls.py needs an entry, it must answer with the expected status so
+# its success path is what gets counted, and its query count must be the
+# same whether the seeded tables hold SMALL or LARGE rows per relation.
+QUERY_BUDGETS = {
+    'application-list': ('get', 200, 3),
+    'application-detail': ('get', 200, 2),
+    'application-overview': ('get', 200, 2),
+    'application-service-list': ('get', 200, 4),
+    'application-service-detail': ('get', 200, 3),
+    'service-comment-list': ('get', 200, 3),
+    'service-comment-detail': ('get', 200, 2),
+    'cart-list': ('post', 201, 4),
+    'cart-detail': ('get', 200, 5),
+    'cart-item-list': ('get', 200, 3),
+    'cart-item-detail': ('get', 200, 3),
+    'order-list': ('get', 200, 5),
+    'order-detail': ('get', 200, 4),
+    'order-pay': ('post', 200, 5),
+    'order-transition': ('post', 200, 7),
+    'order-callback': ('get', 200, 13),
+    'order-item-list': ('get', 200, 3),
+    'order-item-detail': ('get', 200, 3),
+    'discount-list': ('get', 200, 3),
+    'discount-detail': ('get', 200, 3),
+    'discount-service-list': ('get', 200, 4),
+    'discount-service-detail': ('get', 200, 3),
+    'discount-service-comment-list': ('get', 200, 3),
+    'discount-service-comment-detail': ('get', 200, 2),
+    'customer-list': ('get', 200, 3),
+    'customer-detail': ('get', 200, 2),
+    'customer-me': ('get', 200, 1),
+    'customer-summary': ('get', 200, 2),
+    'customer-verify-phone': ('post', 200, 2),
+    'customer-resend-otp': ('post', 200, 1),
+    'comment-moderate': ('post', 200, 6),
+    'upload-list': ('post', 201, 3),
+    'upload-detail': ('get', 200, 2),
+    'upload-chunk': ('put', 200, 6),
+    'upload-complete': ('post', 202, 6),
+    'batch': ('post', 200, 8),
+}
+
+# Which seeded object a detail route's pk refers to, by route name or else
+# by router basename.
+DETAIL_OBJECTS = {
+    'order-pay': 'unpaid_order',
+    'upload-complete': 'received_upload',
+    'application': 'application',
+    'application-service': 'service',
+    'service-comment': 'comment',
+    'cart': 'cart',
+    'cart-item': 'cart_item',
+    'order': 'order',
+    'order-item': 'order_item',
+    'discount': 'discount',
+    'discount-service': 'service',
+    'discount-service-comment': 'comment',
+    'customer': 'customer',
+    'upload': 'upload',
+}
+
+# Request bodies, or callables building one from the seeded objects.
+REQUEST_DATA = {
+    'batch': lambda objects: {'requests': [
+        {'path': '/customers/me/'},
+        {'method': 'POST', 'path': '/carts/'},
+        {'path': f"/carts/{objects['cart'].pk}/"},
+    ]},
+    'customer-verify-phone': {'code': '000000'},
+    # Leaves objects['order'] unpaid for order-callback.
+    'order-transition': lambda objects: {'ids': [order.pk for order in objects['orders'][1:]], 'from_status': 'u', 'to_status': 'c'},
+    'upload-list': lambda objects: {'application': objects['application'].pk, 'filename': 'cover.png', 'size': 1024},
+    'comment-moderate': lambda objects: {'ids': [comment.pk for comment in objects['comments']], 'status': 'a'},
+}
+
+# Raw request bodies, as (body, content type, headers), for routes that do not take JSON.
+RAW_REQUESTS = {
+    'upload-chunk': (b'\0' * 512, 'application/octet-stream', {'Upload-Offset': '0'}),
+}
+
+# Model name -> maximum queries for its admin changelist page.
+ADMIN_QUERY_BUDGETS = {
+    'customer': 5,
+    'application': 5,
+    'discount': 5,
+    'servicefield': 5,
+    'service': 5,
+    'comment': 5,
+    'cart': 5,
+    'cartitem': 5,
+    'order': 5,
+    'orderitem': 6,
+    'outboxevent': 5,
+    'orderstatuschange': 5,
+}
+
+SMALL, LARGE = 2, 6
+
+
+def store_routes():
+    return {
+        pattern.name: pattern for pattern in urlpatterns
+        if isinstance(pattern, URLPattern) and pattern.name != 'api-root' and 'format' not in pattern.pattern.regex.groupindex
+    }
+
+
+def zarinpal_response(url, json=None, **kwargs):
+    response = mock.Mock()
+    response.json.return_value = {'data': {'code': 100, 'authority': 'A0001', 'ref_id': 1}}
+    return response
+
+
+def seed_store(size):
+    """Create ``size`` rows per relation; returns a superuser and one object of each kind."""
+    admin = CustomUser.objects.create_superuser(username=f'admin_{size}', email=f'admin_{size}@example.com', password='password')
+    discounts = [Discount.objects.create(name=f'Discount {size}-{i}', discount_percent=Decimal(10)) for i in range(size)]
+    applications = [Application.objects.create(title=f'Application {size}-{i}', description='Application') for i in range(size)]
+    application = applications[0]
+    services = []
+    for i in range(size):
+        service = Service.objects.create(
+            name=f'Service {size}-{i}', application=application, slug=f'service-{size}-{i}',
+            description='Service', price=Decimal(100_000), discounts=discounts[0],
+        )
+        ServiceField.objects.create(service=service, field_name='username', field_type='username', label='Username')
+        ServiceField.objects.create(service=service, field_name='password', field_type='password')
+        services.append(service)
+    for other, service in zip(applications, services):
+        other.top_service = service
+        other.save()
+
+    service = services[0]
+    users = [CustomUser.objects.create_user(username=f'user_{size}-{i}', email=f'user_{size}-{i}@example.com') for i in range(size)]
+    comments = [
+        Comment.objects.create(author=user, service=service, body='Comment', status=Comment.COMMENT_STATUS_APPROVED if i % 2 == 0 else Comment.COMMENT_STATUS_WAITING)
+        for i, user in enumerate(users)
+    ]
+
+    cart = Cart.objects.create()
+    cart_items = [CartItem.objects.create(cart=cart, service=service, extra_data={'username': 'u', 'password': 'p'}) for service in services]
+
+    orders = []
+    for customer in [admin.customer] + [user.customer for user in users]:
+        order = Order.objects.create(customer=customer)
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, service=service, price=service.price, extra_data={'username': 'u', 'password': 'p'}) for service in services
+        )
+        orders.append(order)
+    order = orders[0]
+    order.payment_authority = 'A0001'
+    order.save()
+
+    unpaid_order = Order.objects.create(customer=admin.customer)
+    OrderItem.objects.bulk_create(
+        OrderItem(order=unpaid_order, service=service, price=service.price, extra_data={'username': 'u', 'password': 'p'}) for service in services
+    )
+
+    upload = ImageUpload.objects.create(application=application, filename='cover.png', size=1024, uploaded_by=admin)
+    received_upload = ImageUpload.objects.create(service=service, filename='cover.png', size=1024, received=1024, uploaded_by=admin)
+
+    return admin, {
+        'application': application,
+        'service': service,
+        'comment': comments[0],
+        'comments': comments,
+        'cart': cart,
+        'cart_item': cart_items[0],
+        'order': order,
+        'orders': orders,
+        'unpaid_order': unpaid_order,
+        'order_item': order.items.first(),
+        'discount': discounts[0],
+        'customer': admin.customer,
+        'upload': upload,
+        'received_upload': received_upload,
+    }
+
+
+@override_settings(CACHES=LOCMEM_CACHES, IMAGE_UPLOAD_TEMP_DIR=Path(tempfile.mkdtemp()))
+class QueryBudgetTests(TestCase):
+    def url_for(self, name, pattern, objects):
+        values = {
+            'application_pk': objects['application'].pk,
+            'service_pk': objects['service'].pk,
+            'cart_pk': objects['cart'].pk,
+            'order_pk': objects['order'].pk,
+            'discount_pk': objects['discount'].pk,
+            'discount_service_pk': objects['service'].pk,
+        }
+        kwargs = {key: values[key] for key in pattern.pattern.regex.groupindex if key in values}
+        if 'pk' in pattern.pattern.regex.groupindex:
+            kwargs['pk'] = objects[DETAIL_OBJECTS.get(name) or DETAIL_OBJECTS[name.rpartition('-')[0]]].pk
+        url = reverse(name, kwargs=kwargs)
+        if name == 'order-callback':
+            url += '?Authority=A0001&Status=OK'
+        return url
+
+    def count_queries(self, size):
+        admin, objects = seed_store(size)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(admin)}')
+        counts = {}
+        for name, pattern in store_routes().items():
+            if name not in QUERY_BUDGETS:
+                continue
+            method, expected_status, _ = QUERY_BUDGETS[name]
+            url = self.url_for(name, pattern, objects)
+            data = REQUEST_DATA.get(name)
+            if callable(data):
+                data = data(objects)
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                if name in RAW_REQUESTS:
+                    body, content_type, headers = RAW_REQUESTS[name]
+                    response = getattr(client, method)(url, body, content_type=content_type, headers=headers)
+                else:
+                    response = getattr(client, method)(url, data, format='json')
+            self.assertEqual(response.status_code, expected_status, f'{name}: {response.content[:200]}')
+            counts[name] = len(queries)
+        return counts
+
+    def test_every_route_has_a_budget(self):
+        self.assertEqual(set(store_routes()) - set(QUERY_BUDGETS), set())
+
+    @mock.patch('store.views.send_sms')
+    @mock.patch('store.views.otp_store.issue', return_value=(OtpStore.ISSUED, 0, '+989121234567'))
+    @mock.patch('store.views.otp_store.verify', side_effect=lambda user_id, code: f'+98912{user_id:07d}')
+    @mock.patch('store.views.requests.post', side_effect=zarinpal_response)
+    def test_query_counts_do_not_grow_with_rows(self, *mocks):
+        small = self.count_queries(SMALL)
+        large = self.count_queries(LARGE)
+        for name, (_, _, budget) in QUERY_BUDGETS.items():
+            with self.subTest(route=name):
+                self.assertLessEqual(large[name], budget)
+                self.assertEqual(large[name], small[name], 'query count grows with the number of rows')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AdminQueryBudgetTests(TestCase):
+    def count_queries(self, size):
+        admin, _ = seed_store(size)
+        self.client.force_login(admin)
+        counts = {}
+        for model in admin_site.site._registry:
+            if model._meta.app_label != 'store':
+                continue
+            name = model._meta.model_name
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(f'admin:store_{name}_changelist'))
+            self.assertEqual(response.status_code, 200)
+            counts[name] = len(queries)
+        return counts
+
+    def test_every_admin_has_a_budget(self):
+        registered = {model._meta.model_name for model in admin_site.site._registry if model._meta.app_label == 'store'}
+        self.assertEqual(registered - set(ADMIN_QUERY_BUDGETS), set())
+
+    def test_changelist_query_counts_do_not_grow_with_rows(self):
+        small = self.count_queries(SMALL)
+        large = self.count_queries(LARGE)
+        for name, budget in ADMIN_QUERY_BUDGETS.items():
+            with self.subTest(model=name):
+                self.assertLessEqual(large[name], budget)
+                self.assertEqual(large[name], small[name], 'query count grows with the number of rows')
+
+
+@override_settings(OTP_CODE_TTL=300, OTP_RESEND_COOLDOWN=60, OTP_SEND_WINDOW=3600, OTP_MAX_SENDS_PER_WINDOW=3, OTP_MAX_VERIFY_ATTEMPTS=3)
+class OtpStoreTests(SimpleTestCase):
+    def setUp(self):
+        get_redis().flushdb()
+        self.store = OtpStore(prefix='test_otp')
+        self.now = 1_000_000
+        patcher = mock.patch('store.otp.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_issue_then_verify_consumes_the_code(self):
+        self.assertEqual(self.store.issue(1, '123456', phone='+989121234567'), (OtpStore.ISSUED, 0, '+989121234567'))
+        self.assertEqual(self.store.verify(1, '123456'), '+989121234567')
+        self.assertIsNone(self.store.verify(1, '123456'))
+
+    def test_resend_needs_a_pending_phone(self):
+        self.assertEqual(self.store.issue(1, '123456')[0], OtpStore.NO_PENDING_PHONE)
+        self.store.issue(1, '123456', phone='+989121234567')
+        self.now += 60
+        self.assertEqual(self.store.issue(1, '654321'), (OtpStore.ISSUED, 0, '+989121234567'))
+        self.assertEqual(self.store.verify(1, '654321'), '+989121234567')
+
+    def test_resend_cooldown(self):
+        self.store.issue(1, '123456', phone='+989121234567')
+        self.now += 20
+        self.assertEqual(self.store.issue(1, '654321')[:2], (OtpStore.COOLDOWN, 40))
+
+    def test_send_limit_per_window(self):
+        for _ in range(3):
+            self.assertEqual(self.store.issue(1, '123456', phone='+989121234567')[0], OtpStore.ISSUED)
+            self.now += 60
+        status, retry_after, _ = self.store.issue(1, '123456', phone='+989121234567')
+        self.assertEqual(status, OtpStore.LIMIT_REACHED)
+        self.assertGreater(retry_after, 0)
+
+    def test_wrong_guesses_burn_the_code(self):
+        self.store.issue(1, '123456', phone='+989121234567')
+        for _ in range(3):
+            self.assertIsNone(self.store.verify(1, '000000'))
+        self.assertIsNone(self.store.verify(1, '123456'))
+
+    def test_expired_code_is_rejected(self):
+        self.store.issue(1, '123456', phone='+989121234567')
+        self.now += 301
+        self.assertIsNone(self.store.verify(1, '123456'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='buyer', email='buyer@example.com', password='password')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(self.user)}')
+
+    def test_cache_holds_no_password_hash(self):
+        self.client.get(reverse('customer-me'))
+        identity = cache.get(auth_user_cache_key(self.user.pk))
+        self.assertNotIn('password', identity['user'])
+        self.assertEqual(identity['customer']['id'], self.user.customer.pk)
+
+    def test_saving_the_cached_user_keeps_uncached_fields(self):
+        self.client.get(reverse('customer-me'))
+        response = self.client.patch('/auth/users/me/', {'email': 'new@example.com'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email, 'new@example.com')
+        self.assertTrue(self.user.check_password('password'))
+
+    def test_account_without_customer_profile_gets_404(self):
+        Customer.objects.filter(user=self.user).delete()
+        for method, name in [('get', 'customer-me'), ('get', 'customer-summary'), ('post', 'customer-verify-phone'), ('post', 'order-list')]:
+            with self.subTest(route=name):
+                response = getattr(self.client, method)(reverse(name), {'code': '000000'} if method == 'post' else None, format='json')
+                self.assertEqual(response.status_code, 404)
+
+
+class TwoTierCacheTests(SimpleTestCase):
+    def setUp(self):
+        get_redis().flushdb()
+        self.cache = caches['default']
+        self.cache.clear()
+
+    def test_local_tier_expires_and_evicts(self):
+        tier = LocalTier('test', max_entries=2, timeout=5)
+        tier.set('a', 1, None)
+        tier.set('b', 2, None)
+        tier.set('c', 3, None)
+        self.assertIs(tier.get('a'), MISSING)
+        self.assertEqual(tier.get('c'), 3)
+        tier.set('d', 4, 0)
+        self.assertIs(tier.get('d'), MISSING)
+        with mock.patch('config.cache.time.monotonic', return_value=time.monotonic() + 6):
+            self.assertIs(tier.get('c'), MISSING)
+
+    def test_local_tier_drops_keys_published_by_other_processes(self):
+        tier = LocalTier('test', max_entries=10, timeout=5)
+        tier.origin = 'mine'
+        tier.set('a', 1, None)
+        tier.handle(json.dumps({'origin': 'mine', 'keys': ['a']}))
+        self.assertEqual(tier.get('a'), 1)
+        tier.handle(json.dumps({'origin': 'theirs', 'keys': ['a']}))
+        self.assertIs(tier.get('a'), MISSING)
+
+    def test_writes_reach_both_tiers(self):
+        self.cache.set('key', 'value', 60)
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_mutating_a_returned_value_does_not_change_the_cache(self):
+        self.cache.set('list', {'items': [1]}, 60)
+        self.cache.get('list')['items'].append(2)
+        self.assertEqual(self.cache.get('list'), {'items': [1]})
+        computed = self.cache.get_or_set('computed', lambda: {'items': [1]}, 60)
+        computed['items'].append(2)
+        self.assertEqual(self.cache.get_or_set('computed', lambda: None, 60), {'items': [1]})
+
+    def test_get_or_set_computes_once_for_concurrent_misses(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda _: self.cache.get_or_set('shared', compute, 60), range(4)))
+        self.assertEqual(results, ['value'] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_lock_is_released_only_by_its_holder(self):
+        cache_key = self.cache.make_and_validate_key('locked')
+        token = self.cache.acquire_lock(cache_key, blocking=False)
+        self.assertIsNone(self.cache.acquire_lock(cache_key, blocking=False))
+        self.cache.release_lock(cache_key, 'someone else')
+        self.assertIsNone(self.cache.acquire_lock(cache_key, blocking=False))
+        self.cache.release_lock(cache_key, token)
+        self.assertIsNotNone(self.cache.acquire_lock(cache_key, blocking=False))
+
+    def test_values_near_expiry_are_refreshed_early(self):
+        self.assertTrue(self.cache.should_refresh_early(CachedValue('v', 10, time.time())))
+        self.assertFalse(self.cache.should_refresh_early(CachedValue('v', 0, time.time() + 60)))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DiscountTargetingTests(TestCase):
+    def setUp(self):
+        self.application = Application.objects.create(title='Application', description='Application')
+        self.other_application = Application.objects.create(title='Other', description='Other')
+        self.discount = Discount.objects.create(name='Discount', discount_percent=Decimal(20))
+        self.discount.applications.add(self.application)
+        self.own = Service.objects.create(name='Own', application=self.other_application, slug='own', description='s', price=Decimal(100), discounts=self.discount)
+        self.by_application = Service.objects.create(name='App', application=self.application, slug='app', description='s', price=Decimal(100))
+        Service.objects.create(name='Untargeted', application=self.other_application, slug='none', description='s', price=Decimal(100))
+
+    def test_discount_services_include_application_targets(self):
+        self.assertEqual(set(targeted_services(self.discount.pk)), {self.own, self.by_application})
+        response = APIClient().get(reverse('discount-service-list', kwargs={'discount_pk': self.discount.pk}))
+        self.assertEqual({row['id'] for row in response.json()['results']}, {self.own.pk, self.by_application.pk})
+
+    def test_refresh_if_due_only_after_a_window_boundary(self):
+        refresh_service_prices()
+        now = timezone.now()
+        self.assertEqual(refresh_prices_if_due(now), 0)
+        Discount.objects.filter(pk=self.discount.pk).update(ends_at=now + timedelta(minutes=1))
+        self.assertEqual(refresh_prices_if_due(now), 0)
+        self.assertEqual(refresh_prices_if_due(now + timedelta(minutes=2)), 3)
+        self.by_application.refresh_from_db()
+        self.assertEqual(self.by_application.current_price.price, Decimal(100))
+
+    @override_settings(PRICE_REFRESH_ETA_HORIZON=600)
+    @mock.patch('store.tasks.refresh_service_prices_task.apply_async')
+    def test_only_near_boundaries_get_an_eta_task(self, apply_async):
+        now = timezone.now()
+        Discount.objects.filter(pk=self.discount.pk).update(starts_at=now + timedelta(hours=2))
+        self.assertIsNone(schedule_next_price_refresh(now))
+        self.assertEqual(schedule_next_price_refresh(now + timedelta(hours=2) - timedelta(minutes=5)), now + timedelta(hours=2))
+        apply_async.assert_called_once()
+
+
+@override_settings(CACHES=LOCMEM_CACHES, IDEMPOTENCY_WAIT_TIMEOUT=0.3)
+class IdempotencyMiddlewareTests(TestCase):
+    def setUp(self):
+        get_redis().flushdb()
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='buyer', email='buyer@example.com')
+        self.responses = []
+        self.middleware = IdempotencyMiddleware(self.respond)
+
+    def respond(self, request):
+        status_code = self.responses.pop(0)
+        return HttpResponse(f'response {status_code}', status=status_code)
+
+    def post(self, body='{}', key='key-1', user=None):
+        token = AccessToken.for_user(user or self.user)
+        request = RequestFactory().post(
+            '/carts/', body, content_type='application/json',
+            headers={'Idempotency-Key': key, 'Authorization': f'JWT {token}'},
+        )
+        return self.middleware(request)
+
+    def test_success_is_replayed(self):
+        self.responses = [201]
+        first = self.post()
+        second = self.post()
+        self.assertEqual((second.status_code, second.content), (201, first.content))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.responses, [])
+
+    def test_key_survives_a_token_refresh_but_not_another_user(self):
+        self.responses = [201, 201]
+        self.post()
+        self.assertEqual(self.post()['Idempotent-Replayed'], 'true')
+        other = CustomUser.objects.create_user(username='other', email='other@example.com')
+        self.assertFalse(self.post(user=other).has_header('Idempotent-Replayed'))
+
+    def test_different_body_is_rejected(self):
+        self.responses = [201]
+        self.post(body='{"a": 1}')
+        self.assertEqual(self.post(body='{"a": 2}').status_code, 422)
+
+    def test_transient_failures_are_not_stored(self):
+        for status_code in (401, 403, 409, 429, 503):
+            with self.subTest(status=status_code):
+                self.responses = [status_code, 201]
+                self.assertEqual(self.post(key=f'key-{status_code}').status_code, status_code)
+                self.assertEqual(self.post(key=f'key-{status_code}').status_code, 201)
+
+    def test_deterministic_client_errors_are_stored(self):
+        self.responses = [400]
+        self.post()
+        self.assertEqual(self.post()['Idempotent-Replayed'], 'true')
+
+    def test_duplicate_in_flight_gets_409(self):
+        scope = f'user:{self.user.pk}'
+        request = RequestFactory().post('/carts/', '{}', content_type='application/json')
+        token = acquire_lock(idempotency_cache_key(scope, request, 'key-1'), 60)
+        self.assertIsNotNone(token)
+        response = self.post()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_response_stored_before_the_lock_is_replayed(self):
+        self.responses = [201]
+        self.post()
+        real_get = cache.get
+        lookups = []
+
+        def get(key, *args):
+            # The retry's first look misses, as if the original were still running.
+            lookups.append(key)
+            return None if len(lookups) == 1 else real_get(key, *args)
+
+        with mock.patch('config.idempotency.cache.get', side_effect=get):
+            response = self.post()
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.responses, [])
+
+    def test_lock_is_released_only_by_its_holder(self):
+        token = acquire_lock('shared', 60)
+        self.assertFalse(release_lock('shared', 'stale holder'))
+        self.assertIsNone(acquire_lock('shared', 60))
+        self.assertTrue(release_lock('shared', token))
+        self.assertIsNotNone(acquire_lock('shared', 60))
+
+
+THROTTLE_SETTINGS = {
+    'DEFAULT_THROTTLE_RATES': {'cart_read': '120/min', 'cart_write': '2/min', 'cart_object_read': '3/min', 'cart_object_write': '60/min'},
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TokenBucketTests(TestCase):
+    def setUp(self):
+        get_redis().flushdb()
+
+    def test_bucket_denies_when_empty_and_refills(self):
+        with mock.patch('store.throttling.time.time', return_value=1000.0):
+            self.assertEqual(take_tokens([('bucket', '2/min')]), 0)
+            self.assertEqual(take_tokens([('bucket', '2/min')]), 0)
+            self.assertAlmostEqual(take_tokens([('bucket', '2/min')]), 30)
+        with mock.patch('store.throttling.time.time', return_value=1030.0):
+            self.assertEqual(take_tokens([('bucket', '2/min')]), 0)
+
+    def test_denied_request_takes_from_no_bucket(self):
+        with mock.patch('store.throttling.time.time', return_value=1000.0):
+            take_tokens([('empty', '1/min')])
+            self.assertGreater(take_tokens([('full', '5/min'), ('empty', '1/min')]), 0)
+            for _ in range(5):
+                self.assertEqual(take_tokens([('full', '5/min')]), 0)
+
+    def test_anonymous_clients_cannot_rotate_forwarded_for(self):
+        client = APIClient()
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, **THROTTLE_SETTINGS}):
+            statuses = [client.post(reverse('cart-list'), HTTP_X_FORWARDED_FOR=f'10.0.0.{i}').status_code for i in range(3)]
+        self.assertEqual(statuses, [201, 201, 429])
+
+    def test_object_bucket_is_shared_across_clients(self):
+        cart = Cart.objects.create()
+        url = reverse('cart-detail', kwargs={'pk': cart.pk})
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, **THROTTLE_SETTINGS}):
+            statuses = [APIClient(REMOTE_ADDR=f'10.0.0.{i}').get(url).status_code for i in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, OUTBOX_MAX_ATTEMPTS=3, OUTBOX_RETRY_DELAY=30)
+class OutboxRelayTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = CustomUser.objects.create_user(username='buyer', email='buyer@example.com')
+        self.order = Order.objects.create(customer=user.customer)
+        self.handled = []
+        self.failing = set()
+        patcher = mock.patch.dict(_handlers, {OutboxEvent.ORDER_CREATED: [self.handle], OutboxEvent.ORDER_PAID: [self.handle]})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        logger_patcher = mock.patch('store.outbox.logger')
+        logger_patcher.start()
+        self.addCleanup(logger_patcher.stop)
+
+    def handle(self, event):
+        if event.event_type in self.failing:
+            raise RuntimeError('provider down')
+        self.handled.append(event.pk)
+
+    def relay_at(self, now):
+        with mock.patch('store.outbox.timezone.now', return_value=now):
+            return relay_outbox_batch(100)
+
+    def test_failed_event_backs_off_then_dies(self):
+        event = OutboxEvent.objects.create(order=self.order, event_type=OutboxEvent.ORDER_PAID)
+        self.failing.add(OutboxEvent.ORDER_PAID)
+        now = timezone.now()
+        self.assertEqual(self.relay_at(now), (0, 1))
+        event.refresh_from_db()
+        self.assertEqual(event.next_attempt_at, now + timedelta(seconds=30))
+        self.assertEqual(self.relay_at(now + timedelta(seconds=29)), (0, 0))
+        self.assertEqual(self.relay_at(now + timedelta(seconds=30)), (0, 1))
+        event.refresh_from_db()
+        self.assertEqual(event.next_attempt_at, now + timedelta(seconds=90))
+        self.relay_at(now + timedelta(seconds=90))
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), (OutboxEvent.STATUS_DEAD, 3))
+        self.assertFalse(pending_events(now + timedelta(days=1)).exists())
+
+    def test_order_events_wait_for_an_earlier_retry(self):
+        first = OutboxEvent.objects.create(order=self.order, event_type=OutboxEvent.ORDER_CREATED)
+        second = OutboxEvent.objects.create(order=self.order, event_type=OutboxEvent.ORDER_PAID)
+        self.failing.add(OutboxEvent.ORDER_CREATED)
+        now = timezone.now()
+        self.relay_at(now)
+        self.assertEqual(self.handled, [])
+        self.failing.clear()
+        self.assertEqual(self.relay_at(now + timedelta(seconds=30)), (1, 0))
+        self.assertEqual(self.relay_at(now + timedelta(seconds=30)), (1, 0))
+        self.assertEqual(self.handled, [first.pk, second.pk])
+
+    def test_dead_event_does_not_block_the_order(self):
+        OutboxEvent.objects.create(order=self.order, event_type=OutboxEvent.ORDER_CREATED, status=OutboxEvent.STATUS_DEAD, attempts=3)
+        later = OutboxEvent.objects.create(order=self.order, event_type=OutboxEvent.ORDER_PAID)
+        self.assertEqual(self.relay_at(timezone.now()), (1, 0))
+        self.assertEqual(self.handled, [later.pk])
+
+    @mock.patch('store.tasks.relay_outbox_task.apply_async')
+    def test_relay_task_queues_one_retry(self, apply_async):
+        from .tasks import relay_outbox_task
+
+        OutboxEvent.objects.create(order=self.order, event_type=OutboxEvent.ORDER_PAID)
+        self.failing.add(OutboxEvent.ORDER_PAID)
+        relay_outbox_task.run()
+        relay_outbox_task.run()
+        apply_async.assert_called_once()
+        event = OutboxEvent.objects.get()
+        self.assertEqual(apply_async.call_args.kwargs['eta'], event.next_attempt_at)
+
+
+# One worker at a time: the SQLite test database locks whole tables across threads.
+@override_settings(CACHES=LOCMEM_CACHES, FULFILLMENT_WORKERS=1, FULFILLMENT_MAX_ATTEMPTS=2, FULFILLMENT_POLL_INTERVAL=0.01)
+class FulfillmentTests(TransactionTestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(_providers, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        logger_patcher = mock.patch('store.fulfillment.logger')
+        logger_patcher.start()
+        self.addCleanup(logger_patcher.stop)
+        fulfillment_provider('dummy', concurrency=2)(self.activate)
+
+        application = Application.objects.create(title='Application', description='Application', fulfillment_provider='dummy')
+        service = Service.objects.create(name='Service', application=application, slug='service', description='s', price=Decimal(100))
+        user = CustomUser.objects.create_user(username='buyer', email='buyer@example.com')
+        self.order = Order.objects.create(customer=user.customer, status=Order.ORDER_STATUS_PAID)
+        self.items = {
+            outcome: OrderItem.objects.create(order=self.order, service=service, price=service.price, extra_data={'username': outcome})
+            for outcome in ('ok', 'flaky', 'invalid')
+        }
+
+    def activate(self, item):
+        outcome = item.extra_data['username']
+        if outcome == 'flaky':
+            raise RuntimeError('provider timed out')
+        if outcome == 'invalid':
+            raise PermanentFulfillmentError('no such account')
+
+    def status(self, outcome):
+        item = OrderItem.objects.get(pk=self.items[outcome].pk)
+        return item.fulfillment_status, item.fulfillment_attempts
+
+    def test_success_retry_and_dead_letter(self):
+        self.assertEqual(run_fulfillment(0.5), {'fulfilled': 1, 'failed': 2})
+        self.assertEqual(self.status('ok'), (OrderItem.FULFILLMENT_DONE, 1))
+        self.assertEqual(self.status('invalid'), (OrderItem.FULFILLMENT_FAILED, 1))
+        self.assertEqual(self.status('flaky'), (OrderItem.FULFILLMENT_PENDING, 1))
+        self.assertIsNotNone(OrderItem.objects.get(pk=self.items['flaky'].pk).fulfillment_retry_at)
+
+        OrderItem.objects.filter(pk=self.items['flaky'].pk).update(fulfillment_retry_at=timezone.now())
+        self.assertEqual(run_fulfillment(0.5), {'failed': 1})
+        self.assertEqual(self.status('flaky'), (OrderItem.FULFILLMENT_FAILED, 2))
+
+    def test_renewed_claims_are_not_reclaimed(self):
+        stale = timezone.now() - timedelta(seconds=settings.FULFILLMENT_CLAIM_TIMEOUT + 1)
+        OrderItem.objects.update(fulfillment_status=OrderItem.FULFILLMENT_PROCESSING, fulfillment_claimed_at=stale)
+        self.assertEqual(claimable_items('dummy').count(), 3)
+        refresh_claims([self.items['ok'].pk])
+        self.assertEqual(claimable_items('dummy').count(), 2)
+
+    @override_settings(FULFILLMENT_HEARTBEAT_INTERVAL=0)
+    def test_lost_lock_stops_claiming(self):
+        heartbeat = mock.Mock(return_value=False)
+        self.assertEqual(run_fulfillment(5, heartbeat), {})
+        heartbeat.assert_called_once()
+        self.assertEqual(claimable_items('dummy').count(), 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class OrderTransitionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = CustomUser.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        customer = CustomUser.objects.create_user(username='buyer', email='buyer@example.com').customer
+        self.unpaid = Order.objects.create(customer=customer)
+        self.paid = Order.objects.create(customer=customer, status=Order.ORDER_STATUS_PAID)
+
+    def transition(self, ids, from_status, to_status):
+        return self.client.post(reverse('order-transition'), {'ids': ids, 'from_status': from_status, 'to_status': to_status}, format='json')
+
+    def test_results_and_audit_rows(self):
+        missing = self.paid.pk + 1
+        response = self.transition([self.unpaid.pk, self.paid.pk, missing], 'u', 'c')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'updated': 1,
+            'results': [{'id': self.unpaid.pk, 'result': 'updated'}, {'id': self.paid.pk, 'result': 'p'}, {'id': missing, 'result': 'not_found'}],
+        })
+        change = OrderStatusChange.objects.get()
+        self.assertEqual((change.order_id, change.from_status, change.to_status, change.changed_by), (self.unpaid.pk, 'u', 'c', self.admin))
+        self.assertEqual(list(OutboxEvent.objects.values_list('order_id', 'event_type')), [(self.unpaid.pk, OutboxEvent.ORDER_CANCELED)])
+
+    def test_disallowed_transitions_are_rejected(self):
+        for from_status, to_status in (('p', 'u'), ('c', 'p'), ('p', 'c'), ('u', 'u')):
+            with self.subTest(from_status=from_status, to_status=to_status):
+                self.assertEqual(self.transition([self.paid.pk], from_status, to_status).status_code, 400)
+        self.assertFalse(OrderStatusChange.objects.exists())
+        self.paid.refresh_from_db()
+        self.assertEqual(self.paid.status, Order.ORDER_STATUS_PAID)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CustomerSummaryCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = CustomUser.objects.create_user(username='buyer', email='buyer@example.com').customer
+        self.service = Service.objects.create(
+            name='Service', application=Application.objects.create(title='Application', description='Application'),
+            slug='service', description='s', price=Decimal(100),
+        )
+        self.order = Order.objects.create(customer=self.customer, status=Order.ORDER_STATUS_PAID)
+
+    def test_item_changes_bump_the_version(self):
+        self.assertEqual(get_customer_summary(self.customer.pk)['total_spent'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            item = OrderItem.objects.create(order=self.order, service=self.service, price=Decimal(100))
+        self.assertEqual(get_customer_summary(self.customer.pk)['total_spent'], 100)
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderItem.objects.get(pk=item.pk).delete()
+        self.assertEqual(get_customer_summary(self.customer.pk)['total_spent'], 0)
+
+    def test_summary_built_before_a_commit_is_not_served_after_it(self):
+        version = customer_summary_version(self.customer.pk)
+        stale = build_customer_summary(self.customer.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderItem.objects.create(order=self.order, service=self.service, price=Decimal(100))
+        # A slow reader that started before the commit stores its result late.
+        cache.set(customer_summary_cache_key(self.customer.pk, version), stale)
+        self.assertNotEqual(customer_summary_version(self.customer.pk), version)
+        self.assertEqual(get_customer_summary(self.customer.pk)['total_spent'], 100)
+
+    def test_version_key_expires(self):
+        with mock.patch.object(cache, 'add', wraps=cache.add) as add:
+            customer_summary_version(self.customer.pk)
+        add.assert_called_once_with(mock.ANY, mock.ANY, settings.CUSTOMER_SUMMARY_CACHE_TTL * 10)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='buyer', email='buyer@example.com')
+        self.order = Order.objects.create(customer=self.user.customer)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(self.user)}')
+        # Sub-requests on pool threads would not see this test's transaction.
+        patcher = mock.patch('store.batch._thread_slots', threading.BoundedSemaphore(1))
+        self.slots = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.slots.acquire()
+
+    def batch(self, *sub_requests):
+        response = self.client.post(reverse('batch'), {'requests': list(sub_requests)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return [result['status'] for result in response.json()['responses']]
+
+    def test_results_keep_request_order(self):
+        statuses = self.batch(
+            {'path': f'/orders/{self.order.pk}/'},
+            {'method': 'POST', 'path': '/carts/'},
+            {'path': '/no-such-route/'},
+            {'method': 'POST', 'path': '/batch/', 'body': {'requests': []}},
+            {'path': f'/orders/{self.order.pk}/callback/?Status=OK&Authority=A1'},
+            {'path': '/customers/me/'},
+        )
+        self.assertEqual(statuses, [200, 201, 404, 400, 400, 200])
+
+    def test_successful_write_pins_the_user(self):
+        self.batch({'path': '/customers/me/'}, {'path': f'/orders/{self.order.pk}/'})
+        self.assertFalse(is_pinned_to_primary(self.user))
+        self.batch({'method': 'POST', 'path': '/carts/'})
+        self.assertTrue(is_pinned_to_primary(self.user))
+
+    @mock.patch('store.batch.dispatch_in_thread')
+    def test_reads_run_inline_without_thread_slots(self, dispatch_in_thread):
+        self.assertEqual(self.batch({'path': '/customers/me/'}, {'path': '/customers/me/'}), [200, 200])
+        dispatch_in_thread.assert_not_called()
+
+
+@override_settings(CACHES=LOCMEM_CACHES, IMAGE_UPLOAD_TEMP_DIR=Path(tempfile.mkdtemp()), MEDIA_ROOT=Path(tempfile.mkdtemp()))
+class ImageUploadTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.application = Application.objects.create(title='Application', description='Application')
+
+    def start(self, content):
+        response = self.client.post(reverse('upload-list'), {'application': self.application.pk, 'filename': 'cover.png', 'size': len(content)}, format='json')
+        return ImageUpload.objects.get(pk=response.json()['id'])
+
+    def put_chunk(self, upload, offset, data):
+        return self.client.generic(
+            'PUT', reverse('upload-chunk', kwargs={'pk': upload.pk}), data, content_type='application/octet-stream', headers={'Upload-Offset': str(offset)},
+        )
+
+    def test_resume_after_offset_conflict(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8)).save(buffer, format='PNG')
+        content = buffer.getvalue()
+        half = len(content) // 2
+        upload = self.start(content)
+
+        self.assertEqual(self.put_chunk(upload, 0, content[:half]).json()['received'], half)
+        retried = self.put_chunk(upload, 0, content[:half])
+        self.assertEqual((retried.status_code, retried.json()['received']), (409, half))
+        self.assertEqual(self.put_chunk(upload, half, content[half:]).status_code, 200)
+        with mock.patch('store.tasks.process_image_upload_task.delay'):
+            self.assertEqual(self.client.post(reverse('upload-complete', kwargs={'pk': upload.pk})).status_code, 202)
+
+        process_upload(upload.pk)
+        upload.refresh_from_db()
+        self.application.refresh_from_db()
+        self.assertEqual(upload.status, ImageUpload.STATUS_DONE)
+        self.assertTrue(self.application.image.name.endswith('.png'))
+        self.assertFalse(upload.temp_path.exists())
+
+    @mock.patch('store.uploads.logger')
+    def test_non_image_is_rejected(self, logger):
+        content = b'<?php echo "not an image"; ?>'
+        upload = self.start(content)
+        self.put_chunk(upload, 0, content)
+        ImageUpload.objects.filter(pk=upload.pk).update(status=ImageUpload.STATUS_PROCESSING)
+        process_upload(upload.pk)
+        upload.refresh_from_db()
+        self.assertEqual((upload.status, upload.error), (ImageUpload.STATUS_FAILED, 'File is not a valid image.'))
+        self.assertFalse(upload.temp_path.exists())
+        self.application.refresh_from_db()
+        self.assertFalse(self.application.image)
+
+    @mock.patch('store.uploads.logger')
+    def test_storage_errors_fail_the_upload(self, logger):
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8)).save(buffer, format='PNG')
+        upload = self.start(buffer.getvalue())
+        self.put_chunk(upload, 0, buffer.getvalue())
+        ImageUpload.objects.filter(pk=upload.pk).update(status=ImageUpload.STATUS_PROCESSING)
+        with mock.patch('django.core.files.storage.FileSystemStorage.save', side_effect=OSError('No space left on device')):
+            process_upload(upload.pk)
+        upload.refresh_from_db()
+        self.assertEqual((upload.status, upload.error), (ImageUpload.STATUS_FAILED, 'The image could not be stored.'))
+        self.assertFalse(upload.temp_path.exists())
+
+    @override_settings(IMAGE_UPLOAD_TTL=3600)
+    def test_stale_uploads_are_cleaned_up(self):
+        stale = self.start(b'x' * 10)
+        stuck = self.start(b'x' * 10)
+        fresh = self.start(b'x' * 10)
+        self.put_chunk(stale, 0, b'x' * 5)
+        self.put_chunk(stuck, 0, b'x' * 10)
+        ImageUpload.objects.filter(pk=stuck.pk).update(status=ImageUpload.STATUS_PROCESSING)
+        ImageUpload.objects.filter(pk__in=[stale.pk, stuck.pk]).update(datetime_created=timezone.now() - timedelta(hours=2))
+        self.assertEqual(delete_stale_uploads(), 2)
+        self.assertEqual(dict(ImageUpload.objects.values_list('pk', 'status')), {stuck.pk: ImageUpload.STATUS_FAILED, fresh.pk: ImageUpload.STATUS_UPLOADING})
+        self.assertFalse(stale.temp_path.exists())
+        self.assertFalse(stuck.temp_path.exists())
+
+    def test_upload_needs_exactly_one_target(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ImageUpload.objects.create(filename='cover.png', size=1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PaymentCallbackTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        customer = CustomUser.objects.create_user(username='buyer', email='buyer@example.com').customer
+        self.order = Order.objects.create(customer=customer, payment_authority='A0001')
+
+    def callback(self, status_param='OK', authority='A0001'):
+        return APIClient().get(reverse('order-callback', kwargs={'pk': self.order.pk}), {'Status': status_param, 'Authority': authority})
+
+    def events(self):
+        return list(OutboxEvent.objects.values_list('event_type', flat=True))
+
+    @mock.patch('store.views.requests.post', side_effect=zarinpal_response)
+    def test_paid_order_is_left_alone(self, post):
+        self.assertEqual(self.callback().status_code, 200)
+        for status_param, authority in (('NOK', 'A0001'), ('OK', 'forged'), ('OK', 'A0001')):
+            with self.subTest(status=status_param, authority=authority):
+                response = self.callback(status_param, authority)
+                self.assertEqual((response.status_code, response.json()['ref_id']), (200, '1'))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.ORDER_STATUS_PAID)
+        self.assertEqual(self.events(), [OutboxEvent.ORDER_PAID])
+        self.assertEqual(list(OrderStatusChange.objects.values_list('from_status', 'to_status', 'note')), [('u', 'p', 'payment callback')])
+        post.assert_called_once()
+
+    def test_canceled_order_stays_canceled(self):
+        self.assertEqual(self.callback('NOK').status_code, 400)
+        with mock.patch('store.views.requests.post', side_effect=zarinpal_response) as post:
+            self.assertEqual(self.callback().status_code, 400)
+        post.assert_not_called()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.ORDER_STATUS_CANCELED)
+        self.assertEqual(self.events(), [OutboxEvent.ORDER_CANCELED])
+
+    def test_concurrent_callback_records_one_payment(self):
+        def paid_meanwhile(url, json=None, **kwargs):
+            # The other callback commits while this one waits on ZarinPal.
+            Order.objects.filter(pk=self.order.pk).update(status=Order.ORDER_STATUS_PAID, payment_ref_id='1')
+            return zarinpal_response(url, json, **kwargs)
+
+        with mock.patch('store.views.requests.post', side_effect=paid_meanwhile):
+            self.assertEqual(self.callback().status_code, 200)
+        self.assertEqual(self.events(), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PAGINATION_ESTIMATE_THRESHOLD=5)
+class EstimatedCountPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = CustomUser.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        Order.objects.bulk_create(Order(customer=self.admin.customer) for _ in range(25))
+        self.orders = Order.objects.order_by('pk')
+
+    def postgres(self, row):
+        connection = mock.MagicMock(vendor='postgresql')
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = row
+        return mock.patch('store.paginations.connections', {'default': connection}), cursor
+
+    def test_estimate_from_reltuples(self):
+        patcher, cursor = self.postgres((5000,))
+        with patcher:
+            self.assertEqual(estimate_count(Order.objects.all()), 5000)
+        self.assertIn('pg_class', cursor.execute.call_args.args[0])
+        patcher, cursor = self.postgres((-1,))
+        with patcher:
+            self.assertIsNone(estimate_count(Order.objects.all()))
+
+    def test_estimate_from_explain(self):
+        plan = [{'Plan': {'Plan Rows': 1234}}]
+        for row in ((plan,), (json.dumps(plan),)):
+            patcher, cursor = self.postgres(row)
+            with patcher:
+                self.assertEqual(estimate_count(Order.objects.filter(pk__gt=0)), 1234)
+            self.assertTrue(cursor.execute.call_args.args[0].startswith('EXPLAIN (FORMAT JSON) '))
+
+    def test_other_databases_and_small_estimates_count_exactly(self):
+        self.assertIsNone(estimate_count(Order.objects.all()))
+        with mock.patch('store.paginations.estimate_count', return_value=4):
+            paginator = EstimatedCountPaginator(self.orders, 10)
+            self.assertEqual((paginator.count, paginator.count_is_estimate), (25, False))
+
+    @mock.patch('store.paginations.estimate_count', return_value=10)
+    def test_underestimate_still_reaches_every_row(self, estimate):
+        pages = []
+        number = 1
+        while True:
+            page = EstimatedCountPaginator(self.orders, 10).page(number)
+            pages.append(len(page.object_list))
+            if not page.has_next():
+                break
+            number = page.next_page_number()
+        self.assertEqual(pages, [10, 10, 5])
+        self.assertEqual((page.paginator.count, page.paginator.count_is_estimate), (25, False))
+
+    @mock.patch('store.paginations.estimate_count', return_value=1000)
+    def test_overestimate_has_no_next_past_the_end(self, estimate):
+        paginator = EstimatedCountPaginator(self.orders, 10)
+        self.assertFalse(paginator.page(3).has_next())
+        with self.assertRaises(EmptyPage):
+            EstimatedCountPaginator(self.orders, 10).page(4)
+
+    @mock.patch('store.paginations.estimate_count', return_value=10)
+    def test_api_and_admin_follow_the_rows(self, estimate):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        response = client.get(reverse('order-list'))
+        self.assertIsNotNone(response.json()['next'])
+        self.assertTrue(response.json()['count_is_estimate'])
+        self.assertEqual(client.get(reverse('order-list'), {'page': 3}).json()['next'], None)
+
+        client.force_login(self.admin)
+        with mock.patch.object(admin_site.site._registry[Order], 'list_per_page', 5):
+            response = client.get(reverse('admin:store_order_changelist'), {'p': 3})
+            self.assertEqual(response.context['cl'].result_count, 16)
+            self.assertContains(response, 'About 16 orders')
+            response = client.get(reverse('admin:store_order_changelist'), {'p': 5})
+            self.assertEqual(response.context['cl'].result_count, 25)
+            self.assertContains(response, '\n25 orders')
+
+
+@override_settings(COMPRESSION_MIN_SIZE=100)
+class CompressionTests(SimpleTestCase):
+    def setUp(self):
+        self.middleware = CompressionMiddleware(lambda request: None)
+
+    def compress(self, content, accept_encoding='gzip, br', **headers):
+        request = RequestFactory().get('/', headers={'Accept-Encoding': accept_encoding})
+        response = HttpResponse(content, content_type='application/json', headers=headers)
+        return self.middleware.process_response(request, response)
+
+    def test_negotiation(self):
+        cases = {
+            'gzip, br': 'br',
+            'gzip;q=1, br;q=0.5': 'gzip',
+            '*': 'br',
+            'br;q=0, *;q=0.5': 'gzip',
+            'gzip;q=0, br;q=0': None,
+            'identity': None,
+            '': None,
+        }
+        for header, expected in cases.items():
+            with self.subTest(header=header):
+                self.assertEqual(self.middleware.choose_encoding(header), expected)
+        self.assertEqual(accepted_encodings('BR;q=0, gzip;q=bad'), {'br': 0.0, 'gzip': 0.0})
+        with mock.patch('config.compression.brotli', None):
+            self.assertEqual(self.middleware.choose_encoding('br, gzip;q=0.1'), 'gzip')
+
+    def test_large_response_is_compressed_with_a_weak_etag(self):
+        content = b'{"name": "service"}' * 20
+        response = self.compress(content, ETag='"abc"')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+        self.assertEqual(response['ETag'], 'W/"abc"')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertLess(len(response.content), len(content))
+
+    def test_small_or_encoded_responses_are_left_alone(self):
+        small = self.compress(b'{}')
+        self.assertFalse(small.has_header('Content-Encoding'))
+        self.assertFalse(small.has_header('Vary'))
+        encoded = self.compress(b'x' * 200, **{'Content-Encoding': 'gzip'})
+        self.assertEqual(encoded.content, b'x' * 200)
+        refused = self.compress(b'x' * 200, accept_encoding='br;q=0')
+        self.assertEqual((refused.content, refused['Vary']), (b'x' * 200, 'Accept-Encoding'))
+
+
+class ORJSONTests(SimpleTestCase):
+    def test_decimals_are_exact_numbers(self):
+        self.assertEqual(ORJSONRenderer().render({'price': Decimal('1.10')}), b'{"price":1.10}')
+        with self.assertRaises(TypeError):
+            ORJSONRenderer().render({'price': Decimal('NaN')})
+
+    def test_output_stays_a_javascript_subset(self):
+        self.assertEqual(ORJSONRenderer().render({'text': 'a\u2028b\u2029c'}), b'{"text":"a\\u2028b\\u2029c"}')
+
+    def test_indent_and_drf_types(self):
+        data = {'when': datetime(2026, 1, 2, 3, 4, 5, tzinfo=UTC), 'none': None}
+        self.assertEqual(ORJSONRenderer().render(data), b'{"when":"2026-01-02T03:04:05Z","none":null}')
+        self.assertIn(b'\n  "none"', ORJSONRenderer().render(data, 'application/json; indent=4'))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_parser(self):
+        self.assertEqual(ORJSONParser().parse(io.BytesIO(b'{"a": [1, 2.5]}')), {'a': [1, 2.5]})
+        with self.assertRaisesMessage(ParseError, 'JSON parse error'):
+            ORJSONParser().parse(io.BytesIO(b'{"a": '))
+
+
+@override_settings(SMS_BATCH_SIZE=3, SMS_BATCH_INTERVAL=5)
+class SmsOutboxTests(SimpleTestCase):
+    def setUp(self):
+        get_redis().flushdb()
+
+    def queue(self, count):
+        with mock.patch('store.tasks.flush_sms_outbox_task.delay') as delay, \
+                mock.patch('store.tasks.flush_sms_outbox_task.apply_async') as apply_async:
+            for i in range(count):
+                send_sms(f'+98912000000{i}', f'message {i}')
+        return delay, apply_async
+
+    def test_flush_is_scheduled_for_the_first_message_and_each_full_batch(self):
+        delay, apply_async = self.queue(7)
+        apply_async.assert_called_once_with(countdown=5)
+        self.assertEqual(delay.call_count, 2)
+
+    @mock.patch('store.tasks.send_sms_batch')
+    def test_flush_drains_in_batches(self, send_sms_batch):
+        self.queue(5)
+        from .tasks import flush_sms_outbox_task
+
+        flush_sms_outbox_task.run()
+        self.assertEqual([len(call.args[0]) for call in send_sms_batch.call_args_list], [3, 2])
+        self.assertEqual(send_sms_batch.call_args_list[0].args[0][0], ('+989120000000', 'message 0'))
+        self.assertEqual((get_redis().llen(SMS_OUTBOX_KEY), get_redis().llen(SMS_PROCESSING_KEY)), (0, 0))
+
+    def test_failed_batch_is_sent_first_next_time(self):
+        from .tasks import flush_sms_outbox_task
+
+        self.queue(4)
+        with mock.patch('store.tasks.send_sms_batch', side_effect=HTTPException('timed out')) as send_sms_batch:
+            with self.assertRaises(HTTPException):
+                flush_sms_outbox_task.run()
+        failed = send_sms_batch.call_args.args[0]
+        self.assertEqual(get_redis().llen(SMS_PROCESSING_KEY), 3)
+        with mock.patch('store.tasks.send_sms_batch') as send_sms_batch:
+            flush_sms_outbox_task.run()
+        self.assertEqual([call.args[0] for call in send_sms_batch.call_args_list], [failed, [('+989120000003', 'message 3')]])
+
+    def test_batch_of_a_dead_worker_is_taken_again(self):
+        self.queue(2)
+        batch = take_sms_batch(3)
+        self.assertEqual(take_sms_batch(3), batch)
+        self.assertEqual(get_redis().llen(SMS_OUTBOX_KEY), 0)
+
+
+class RoutedView(APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        if request.query_params.get('fail'):
+            raise RuntimeError('view failed')
+        return Response({'db': ReplicaRouter().db_for_read(Order)})
+
+    post = get
+
+
+class ReplicaRoutedView(ReplicaReadMixin, RoutedView):
+    pass
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DATABASE_REPLICAS=['replica_0'])
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='buyer', email='buyer@example.com')
+
+    def routed_to(self, view, method='get', user=None):
+        request = getattr(RequestFactory(), method)('/')
+        if user is not None:
+            force_authenticate(request, user)
+        return view.as_view()(request).data['db']
+
+    def test_only_safe_requests_of_the_mixin_use_a_replica(self):
+        self.assertEqual(self.routed_to(ReplicaRoutedView), 'replica_0')
+        self.assertEqual(self.routed_to(ReplicaRoutedView, 'post'), 'default')
+        self.assertEqual(self.routed_to(RoutedView), 'default')
+        self.assertEqual(ReplicaRouter().db_for_read(Order), 'default')
+        self.assertEqual(ReplicaRouter().db_for_write(Order), 'default')
+
+    def test_pinned_user_reads_from_the_primary(self):
+        self.assertEqual(self.routed_to(ReplicaRoutedView, user=self.user), 'replica_0')
+        pin_to_primary(self.user)
+        self.assertEqual(self.routed_to(ReplicaRoutedView, user=self.user), 'default')
+
+    def test_replica_reads_end_when_the_view_raises(self):
+        with self.assertRaises(RuntimeError):
+            ReplicaRoutedView.as_view()(RequestFactory().get('/', {'fail': 1}))
+        self.assertEqual(ReplicaRouter().db_for_read(Order), 'default')
+
+    def middleware_pins(self, method, status_code, view=None):
+        cache.clear()
+        request = getattr(RequestFactory(), method)('/')
+        request.user = self.user
+        middleware = PrimaryStickinessMiddleware(lambda request: HttpResponse(status=status_code))
+        middleware.process_view(request, view or (lambda request: None), (), {})
+        middleware(request)
+        return is_pinned_to_primary(self.user)
+
+    def test_successful_writes_pin_the_user(self):
+        self.assertTrue(self.middleware_pins('post', 201))
+        self.assertTrue(self.middleware_pins('delete', 204))
+        self.assertFalse(self.middleware_pins('post', 400))
+        self.assertFalse(self.middleware_pins('get', 200))
+        self.assertFalse(self.middleware_pins('post', 201, primary_pin_exempt(lambda request: None)))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_redis().flushdb()
+        histograms.pending.clear()
+
+    def test_server_timing_header(self):
+        seed_store(2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('application-list'))
+        self.assertEqual(response.status_code, 200)
+        parts = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertRegex(parts['app'], r'^dur=\d+\.\d$')
+        self.assertRegex(parts['db'], rf'^dur=\d+\.\d;desc="{len(queries)}"$')
+        self.assertRegex(parts['serialize'], r'^dur=\d+\.\d;desc="1"$')
+
+    @override_settings(METRICS_TOKEN='secret', METRICS_FLUSH_INTERVAL=0)
+    def test_metrics_require_the_token(self):
+        self.client.get(reverse('application-list'))
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http_requests_total{endpoint="ApplicationViewSet.list",status="200"} 1', response.content)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_without_a_token_are_internal_only(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        with self.settings(INTERNAL_IPS=[]):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+    def test_timed_serializer_data_is_unchanged(self):
+        _admin, objects = seed_store(2)
+        applications = Application.objects.order_by('pk')
+        expected = ApplicationSerializer(applications, many=True).to_representation(applications)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            serializer = ApplicationSerializer(applications, many=True)
+            data = serializer.data
+        finally:
+            _current.reset(token)
+        self.assertEqual(data, expected)
+        self.assertIs(data.serializer, serializer)
+        self.assertEqual(timings.counts['serialize'], 1)
+        self.assertEqual(ApplicationSerializer(objects['application']).data['id'], objects['application'].pk)
+
+
+class CeleryTaskTests(TestCase):
+    QUEUES = {
+        'store.tasks.send_sms_task': 'otp',
+        'store.tasks.flush_sms_outbox_task': 'notifications',
+        'store.tasks.relay_outbox_task': 'notifications',
+        'store.tasks.fulfill_order_items_task': 'payments',
+        'store.tasks.refresh_service_prices_task': 'maintenance',
+        'store.tasks.refresh_due_service_prices_task': 'maintenance',
+        'store.tasks.process_image_upload_task': 'maintenance',
+        'store.tasks.delete_stale_uploads_task': 'maintenance',
+    }
+
+    def setUp(self):
+        get_redis().flushdb()
+
+    def test_every_store_task_has_a_queue(self):
+        names = {name for name in celery_app.tasks if name.startswith('store.tasks.')}
+        self.assertEqual(names, set(self.QUEUES))
+        for name in names:
+            with self.subTest(task=name):
+                self.assertEqual(celery_app.amqp.router.route({}, name)['queue'].name, self.QUEUES[name])
+
+    def test_task_runs_are_counted(self):
+        delete_stale_uploads_task.apply()
+        stats = task_stats()['store.tasks.delete_stale_uploads_task']
+        self.assertEqual(stats['count'], 1)
+        self.assertEqual(stats['state_success'], 1)
+        self.assertGreaterEqual(stats['runtime_seconds_total'], 0)
+
+    def test_queue_wait_comes_from_the_publish_header(self):
+        headers = {}
+        stamp_published_at(headers=headers)
+        task = SimpleNamespace(name='store.tasks.relay_outbox_task', request=SimpleNamespace(published_at=headers['published_at'] - 5))
+        record_task_start(task_id='task-1', task=task)
+        record_task_finish(task_id='task-1', task=task, state='SUCCESS')
+        stats = task_stats()['store.tasks.relay_outbox_task']
+        self.assertEqual(stats['count'], 1)
+        self.assertGreaterEqual(stats['queue_wait_seconds_total'], 5)
+
+    def test_failures_and_retries_are_counted(self):
+        with mock.patch('store.tasks.process_upload', side_effect=RuntimeError):
+            process_image_upload_task.apply(args=(1,))
+        with mock.patch('store.tasks.send_sms_now', side_effect=HTTPException):
+            send_sms_task.apply(args=('09120000000', 'code'))
+        stats = task_stats()
+        self.assertEqual(stats['store.tasks.process_image_upload_task']['failures'], 1)
+        self.assertEqual(stats['store.tasks.send_sms_task']['retries'], send_sms_task.max_retries)
+        self.assertEqual(stats['store.tasks.send_sms_task']['failures'], 1)
@@ -0,0 +1,127 @@
+import logging
+import time
+
+from redis import RedisError
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from config.redis_client import get_redis
+
+
+logger = logging.getLogger(__name__)
+
+# Each KEYS[i] is a token bucket hash (tokens, updated) refilled at
+# ARGV[2i + 1] tokens per second up to ARGV[2i] tokens; ARGV[1] is now.
+# A request takes one token from every bucket, or from none of them, and
+# gets back how many seconds to wait when any bucket is empty.
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local tokens = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local refill = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'updated')
+    local available = tonumber(state[1] or capacity)
+    local updated = tonumber(state[2] or now)
+    available = math.min(capacity, available + math.max(0, now - updated) * refill)
+    tokens[i] = available
+    if available < 1 then
+        wait = math.max(wait, (1 - available) / refill)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local refill = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', key, 'tokens', tostring(tokens[i] - 1), 'updated', ARGV[1])
+    redis.call('EXPIRE', key, math.ceil(capacity / refill) + 1)
+end
+return '0'
+"""
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+_script = None
+
+
+def parse_rate(rate):
+    """'30/min' -> (30 tokens of burst, 0.5 tokens refilled per second)."""
+    num, period = rate.split('/')
+    capacity = int(num)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+def take_tokens(buckets):
+    """
+    Take a token from every ``(key, rate)`` bucket in one script call.
+    Returns the seconds to wait, 0 when the request may proceed.
+    """
+    global _script
+    client = get_redis()
+    if _script is None:
+        _script = client.register_script(TOKEN_BUCKET_SCRIPT)
+    args = [repr(time.time())]
+    for _, rate in buckets:
+        args.extend(parse_rate(rate))
+    return float(_script(keys=[key for key, _ in buckets], args=args, client=client))
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token buckets per client (the user when authenticated, else the IP) and,
+    when ``object_kwarg`` names a URL kwarg, per object too, so one cart
+    cannot be hammered from many addresses. Rates come from
+    DEFAULT_THROTTLE_RATES as ``<scope>_read`` / ``<scope>_write`` and
+    ``<scope>_object_read`` / ``<scope>_object_write``; a rate set to None
+    disables that bucket. If Redis is unavailable requests are let through.
+    """
+
+    scope = None
+    object_kwarg = None
+
+    def __init__(self):
+        self.retry_after = None
+
+    def get_buckets(self, request, view):
+        kind = 'read' if request.method in ('GET', 'HEAD', 'OPTIONS') else 'write'
+        rates = api_settings.DEFAULT_THROTTLE_RATES
+        if request.user and request.user.is_authenticated:
+            ident = f'user_{request.user.pk}'
+        else:
+            ident = f'ip_{self.get_ident(request)}'
+        buckets = [(f'throttle:{self.scope}_{kind}:{ident}', rates.get(f'{self.scope}_{kind}'))]
+        object_id = view.kwargs.get(self.object_kwarg) if self.object_kwarg else None
+        if object_id is not None:
+            buckets.append((f'throttle:{self.scope}_object_{kind}:{object_id}', rates.get(f'{self.scope}_object_{kind}')))
+        return [(key, rate) for key, rate in buckets if rate is not None]
+
+    def allow_request(self, request, view):
+        buckets = self.get_buckets(request, view)
+        if not buckets:
+            return True
+        try:
+            self.retry_after = take_tokens(buckets)
+        except RedisError:
+            logger.warning("Throttle buckets unavailable, letting the request through", exc_info=True)
+            return True
+        return self.retry_after == 0
+
+    def wait(self):
+        return self.retry_after
+
+
+class CartThrottle(TokenBucketThrottle):
+    scope = 'cart'
+    object_kwarg = 'pk'
+
+
+class CartItemThrottle(TokenBucketThrottle):
+    scope = 'cart'
+    object_kwarg = 'cart_pk'
+
+
+class CommentThrottle(TokenBucketThrottle):
+    scope = 'comment'
@@ -0,0 +1,123 @@
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from .models import ImageUpload
+
+
+logger = logging.getLogger(__name__)
+
+
+class UploadOffsetMismatch(Exception):
+    """The chunk does not start where the upload currently ends."""
+
+
+def append_chunk(upload_id, offset, data):
+    """
+    Append ``data`` to the upload's temporary file if it starts at
+    ``offset``. The row lock serializes chunks of the same upload, so a
+    retried chunk can never be written twice. Returns the locked upload.
+    """
+    with transaction.atomic():
+        upload = ImageUpload.objects.select_for_update().get(pk=upload_id)
+        if upload.status != ImageUpload.STATUS_UPLOADING or offset != upload.received:
+            raise UploadOffsetMismatch(upload)
+        settings.IMAGE_UPLOAD_TEMP_DIR.mkdir(parents=True, exist_ok=True)
+        with open(upload.temp_path, 'r+b' if offset else 'wb') as f:
+            # Drops bytes of an earlier attempt whose row update rolled back.
+            f.seek(offset)
+            f.truncate()
+            f.write(data)
+        upload.received = offset + len(data)
+        upload.save(update_fields=['received'])
+    return upload
+
+
+def validate_image(path):
+    """Return the image's format, raising ValueError when it is not acceptable."""
+    try:
+        with Image.open(path) as image:
+            image_format = image.format
+            width, height = image.size
+            image.verify()
+    except Image.DecompressionBombError:
+        raise ValueError("Image dimensions are too large.")
+    except Exception:
+        raise ValueError("File is not a valid image.")
+    if image_format not in settings.IMAGE_UPLOAD_FORMATS:
+        raise ValueError(f"Unsupported image format {image_format}.")
+    if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+        raise ValueError("Image dimensions are too large.")
+    return image_format
+
+
+def process_upload(upload_id):
+    """
+    Validate a completed upload and save it as its target's image. The
+    upload ends up done or failed and its temporary file is removed
+    whatever goes wrong; a row left processing by a lost worker is failed
+    by delete_stale_uploads().
+    """
+    upload = ImageUpload.objects.select_related('application', 'service').get(pk=upload_id)
+    if upload.status != ImageUpload.STATUS_PROCESSING:
+        return
+    path = upload.temp_path
+    stored_name = None
+    try:
+        if os.path.getsize(path) != upload.size:
+            raise ValueError("Uploaded size does not match the declared size.")
+        image_format = validate_image(path)
+        target = upload.target
+        name = f'{os.path.splitext(os.path.basename(upload.filename))[0]}.{settings.IMAGE_UPLOAD_FORMATS[image_format]}'
+        with open(path, 'rb') as f:
+            target.image.save(name, File(f), save=False)
+        stored_name = target.image.name
+        target.save(update_fields=['image'])
+    except (FileNotFoundError, ValueError) as e:
+        logger.warning("Image upload %s rejected: %s", upload.pk, e)
+        upload.status = ImageUpload.STATUS_FAILED
+        upload.error = str(e)
+    except Exception:
+        logger.exception("Image upload %s could not be stored", upload.pk)
+        if stored_name:
+            target.image.storage.delete(stored_name)
+        upload.status = ImageUpload.STATUS_FAILED
+        upload.error = "The image could not be stored."
+    else:
+        upload.status = ImageUpload.STATUS_DONE
+    try:
+        upload.save(update_fields=['status', 'error'])
+    finally:
+        path.unlink(missing_ok=True)
+
+
+def delete_stale_uploads(now=None):
+    """
+    Clean up uploads IMAGE_UPLOAD_TTL seconds after they were started:
+    ones still receiving chunks are deleted, ones still processing (their
+    worker was lost) are marked failed, and both lose their temporary
+    files. Rows a chunk is being written to are skipped until the next
+    sweep. Returns how many uploads were cleaned up.
+    """
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.IMAGE_UPLOAD_TTL)
+    with transaction.atomic():
+        stale = list(
+            ImageUpload.objects.select_for_update(skip_locked=True)
+            .filter(status__in=[ImageUpload.STATUS_UPLOADING, ImageUpload.STATUS_PROCESSING], datetime_created__lt=cutoff)
+            .only('pk', 'status')
+        )
+        ImageUpload.objects.filter(
+            pk__in=[upload.pk for upload in stale if upload.status == ImageUpload.STATUS_UPLOADING],
+        ).delete()
+        ImageUpload.objects.filter(
+            pk__in=[upload.pk for upload in stale if upload.status == ImageUpload.STATUS_PROCESSING],
+        ).update(status=ImageUpload.STATUS_FAILED, error="Processing did not finish.")
+    for upload in stale:
+        upload.temp_path.unlink(missing_ok=True)
+    return len(stale)
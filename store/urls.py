@@ -1,5 +1,9 @@
+from django.urls import path
+
 from rest_framework_nested import routers
 
+from config.db_router import primary_pin_exempt
+
 from . import views
 
 
@@ -9,6 +13,8 @@ router.register("carts", views.CartViewSet, basename="cart")
 router.register("orders", views.OrderViewSet, basename="order")
 router.register("discounts", views.DiscountViewSet, basename="discount")
 router.register("customers", views.CustomerViewSet, basename="customer")
+router.register("comments", views.CommentModerationViewSet, basename="comment")
+router.register("uploads", views.ImageUploadViewSet, basename="upload")
 
 
 services_router = routers.NestedDefaultRouter(router, "applications", lookup="application")
@@ -30,4 +36,4 @@ comment_router = routers.NestedDefaultRouter(services_router, "services", lookup
 comment_router.register("comments", views.CommentViewSet, basename="service-comment")
 
 
-urlpatterns = router.urls + services_router.urls + comment_router.urls + cartitem_router.urls + orderitem_router.urls + discount_services_router.urls + discount_services_comment_router.urls
\ No newline at end of file
+urlpatterns = [path("batch/", primary_pin_exempt(views.BatchView.as_view()), name="batch")] + router.urls + services_router.urls + comment_router.urls + cartitem_router.urls + orderitem_router.urls + discount_services_router.urls + discount_services_comment_router.urls
\ No newline at end of file
@@ -1,56 +1,74 @@
 from django.core.exceptions import PermissionDenied
-from django.core.cache import cache
 from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
 from django.conf import settings
 from django.db import transaction
-from django.utils import timezone
 
 from django_filters.rest_framework import DjangoFilterBackend
 
 import requests
 import secrets
 import string
+from collections import Counter
 
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin
 from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, GenericViewSet, ModelViewSet, ReadOnlyModelViewSet
 from rest_framework.filters import SearchFilter, OrderingFilter
 
-from kavenegar import KavenegarAPI
-from datetime import timedelta
+from config import metrics
 
+from .batch import run_batch
+from .catalog import get_catalog_overview
 from .filters import ServiceFilter, OrderFilter
-from .models import Application, Customer, Service, Comment, Cart, CartItem, Order, OrderItem, Discount, ServiceField
+from .mixins import ReplicaReadMixin
+from .models import Application, Customer, Service, Comment, Cart, CartItem, ImageUpload, Order, OrderItem, Discount, ServiceField
+from .orders import get_customer_summary, transition_orders
+from .otp import OtpStore, otp_store
 from .paginations import DefaultPagination
 from .permissions import IsAdminOrReadOnly, IsCommentAuthorOrAdmin
-from .serializers import AddCartItemSerializer, ApplicationSerializer, CustomerSerializer, OrderCreateSerializer, OrderForAdminSerializer, ServiceSerializer, CommentSerializer, CartSerializer, CartItemSerializer, OrderSerializer, OrderItemSerializer, DiscountSerializer, UpdateCartItemSerializer, EmptySerializer, VerifySerializer
-from .tasks import send_sms_task
+from .pricing import targeted_services
+from .serializers import AddCartItemSerializer, ApplicationOverviewSerializer, ApplicationSerializer, BatchSerializer, CommentModerationSerializer, CustomerSerializer, CustomerSummarySerializer, ImageUploadSerializer, OrderCreateSerializer, OrderForAdminSerializer, OrderStatusTransitionSerializer, ServiceSerializer, CommentSerializer, CartSerializer, CartItemSerializer, OrderSerializer, OrderItemSerializer, DiscountSerializer, UpdateCartItemSerializer, EmptySerializer, VerifySerializer
+from .sms import send_sms
+from .throttling import CartItemThrottle, CartThrottle, CommentThrottle
+from .uploads import UploadOffsetMismatch, append_chunk
 
 
+def request_customer(request):
+    """The customer profile CachedJWTAuthentication put on the request; 404 for accounts without one."""
+    customer = getattr(request, 'customer', None)
+    if customer is None:
+        raise NotFound("This account has no customer profile.")
+    return customer
 
-def send_sms(phone, message):
-        api = KavenegarAPI(settings.KAVENEGAR_API_KEY)
-        params = {
-            'sender': settings.KAVENEGAR_SENDER,
-            'receptor': str(phone),
-            'message': message
-        }
-        response = api.sms_send(params)
+
+def approved_for_public(queryset, action):
+    # Public reads only see approved comments, newest first, which is what
+    # the partial store_comment_approved_idx index covers.
+    if action in ['list', 'retrieve']:
+        return queryset.filter(status=Comment.COMMENT_STATUS_APPROVED).order_by('-datetime_created')
+    return queryset
 
 
-class ApplicationViewSet(ModelViewSet):
+class ApplicationViewSet(ReplicaReadMixin, ModelViewSet):
     serializer_class = ApplicationSerializer
     permission_classes = [IsAdminOrReadOnly]
     pagination_class = DefaultPagination
     parser_classes = [MultiPartParser, FormParser]
 
     def get_queryset(self):
-        return Application.objects.select_related("top_service").all()
+        return Application.objects.select_related("top_service__current_price").all()
+
+    @action(detail=False, methods=['GET'], url_path='overview')
+    def overview(self, request):
+        serializer = ApplicationOverviewSerializer(get_catalog_overview(), many=True, context={'request': request})
+        return Response(serializer.data)
 
     def initialize_request(self, request, *args, **kwargs):
         request = super().initialize_request(request, *args, **kwargs)
@@ -61,7 +79,7 @@ class ApplicationViewSet(ModelViewSet):
         return request
 
 
-class ServiceViewSet(ModelViewSet):
+class ServiceViewSet(ReplicaReadMixin, ModelViewSet):
     serializer_class = ServiceSerializer
     parser_classes = [MultiPartParser, FormParser]
     permission_classes = [IsAdminOrReadOnly]
@@ -74,7 +92,7 @@ class ServiceViewSet(ModelViewSet):
     
     def get_queryset(self):
         application_pk = self.kwargs["application_pk"]
-        return Service.objects.filter(application_id=application_pk).select_related('discounts').prefetch_related('required_fields')
+        return Service.objects.filter(application_id=application_pk).select_related('discounts', 'current_price').prefetch_related('required_fields')
     
     def perform_create(self, serializer):
         application = get_object_or_404(Application, pk=self.kwargs['application_pk'])
@@ -89,14 +107,16 @@ class ServiceViewSet(ModelViewSet):
         return request
 
 
-class CommentViewSet(ModelViewSet):
+class CommentViewSet(ReplicaReadMixin, ModelViewSet):
     serializer_class = CommentSerializer
     pagination_class = DefaultPagination
+    throttle_classes = [CommentThrottle]
     
     def get_queryset(self):
         application_pk = self.kwargs["application_pk"]
         service_pk = self.kwargs["service_pk"]
-        return Comment.objects.select_related("author").filter(service_id=service_pk, service__application_id=application_pk).all()
+        queryset = Comment.objects.select_related("author").filter(service_id=service_pk, service__application_id=application_pk)
+        return approved_for_public(queryset, self.action)
     
     def perform_create(self, serializer):
         service = get_object_or_404(Service, pk=self.kwargs['service_pk'])
@@ -111,12 +131,13 @@ class CommentViewSet(ModelViewSet):
 class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
     serializer_class = CartSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [CartThrottle]
 
     def get_queryset(self):
         return Cart.objects.prefetch_related(
             Prefetch(
                 'items',
-                queryset=CartItem.objects.select_related('service').prefetch_related(
+                queryset=CartItem.objects.select_related('service__current_price').prefetch_related(
                     Prefetch('service__required_fields', queryset=ServiceField.objects.all()),
                     'service__discounts'
                 )
@@ -132,10 +153,11 @@ class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, Gener
 class CartItemViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
     permission_classes = [AllowAny]
+    throttle_classes = [CartItemThrottle]
 
     def get_queryset(self):
         cart_pk = self.kwargs["cart_pk"]
-        return CartItem.objects.select_related('service__discounts').prefetch_related(
+        return CartItem.objects.select_related('service__discounts', 'service__current_price').prefetch_related(
             'service__required_fields'
         ).filter(cart_id=cart_pk)
 
@@ -159,13 +181,15 @@ class OrderViewSet(ModelViewSet):
     def get_permissions(self):
         if self.action == 'callback':
             return [AllowAny()]
+        if self.action == 'transition':
+            return [IsAdminUser()]
         return [IsAuthenticated()]
 
     def get_queryset(self):
         queryset = Order.objects.prefetch_related(
             Prefetch(
                 'items',
-                queryset=OrderItem.objects.select_related('service__discounts').prefetch_related('service__required_fields')
+                queryset=OrderItem.objects.select_related('service__discounts', 'service__current_price').prefetch_related('service__required_fields')
             )
         ).select_related('customer__user')
 
@@ -179,6 +203,9 @@ class OrderViewSet(ModelViewSet):
         
         if self.action == 'pay':
             return EmptySerializer
+
+        if self.action == 'transition':
+            return OrderStatusTransitionSerializer
         
         if self.request.user.is_staff:
             return OrderForAdminSerializer
@@ -189,7 +216,7 @@ class OrderViewSet(ModelViewSet):
         return {"user": self.request.user, "request": self.request}
 
     def create(self, request, *args, **kwargs):
-        customer = Customer.objects.get(user=request.user)
+        customer = request_customer(request)
 
         if not customer.phone_number:
             return Response(
@@ -203,13 +230,24 @@ class OrderViewSet(ModelViewSet):
 
         serializer = OrderCreateSerializer(
             data=request.data,
-            context={'user': request.user}
+            context={'user': request.user, 'customer': customer}
         )
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
         order_serializer = OrderSerializer(order)
         return Response(order_serializer.data, status=status.HTTP_201_CREATED)
     
+    @action(detail=False, methods=['post'], url_path='transition')
+    def transition(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        results = transition_orders(data['ids'], data['from_status'], data['to_status'], user=request.user, note=data.get('note', ''))
+        return Response({
+            'updated': sum(result == 'updated' for result in results.values()),
+            'results': [{'id': pk, 'result': result} for pk, result in sorted(results.items())],
+        }, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['post'], url_path='pay')
     def pay(self, request, pk=None):
         order = self.get_object()
@@ -228,7 +266,8 @@ class OrderViewSet(ModelViewSet):
         }
 
         try:
-            response = requests.post(settings.ZARINPAL_REQUEST_URL, json=data)
+            with metrics.timer('zarinpal'):
+                response = requests.post(settings.ZARINPAL_REQUEST_URL, json=data, timeout=settings.ZARINPAL_TIMEOUT)
             result = response.json()
         except Exception as e:
             return Response({'error': f'Error connecting to ZarinPal{str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -246,14 +285,16 @@ class OrderViewSet(ModelViewSet):
     @action(detail=True, methods=['get'], url_path='callback')
     def callback(self, request, pk=None):
         order = get_object_or_404(Order, pk=pk)
+        if order.status != Order.ORDER_STATUS_UNPAID:
+            return self.callback_response(order)
         authority = request.query_params.get('Authority')
         status_param = request.query_params.get('Status')
 
 
         if status_param != 'OK' or order.payment_authority != authority:
-            order.status = Order.ORDER_STATUS_CANCELED
-            order.save()
-            return Response({'error': 'Payment unsuccessful or canceled'}, status=status.HTTP_400_BAD_REQUEST)
+            transition_orders([order.pk], Order.ORDER_STATUS_UNPAID, Order.ORDER_STATUS_CANCELED, note='payment callback')
+            order.refresh_from_db()
+            return self.callback_response(order)
 
         total_price = sum(item.quantity * item.price for item in order.items.all())
         amount = int(total_price * 10)
@@ -265,22 +306,33 @@ class OrderViewSet(ModelViewSet):
         }
 
         try:
-            response = requests.post(settings.ZARINPAL_VERIFY_URL, json=data)
+            with metrics.timer('zarinpal'):
+                response = requests.post(settings.ZARINPAL_VERIFY_URL, json=data, timeout=settings.ZARINPAL_TIMEOUT)
             result = response.json()
         except Exception as e:
             return Response({'error': f'Error in payment confirmation: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        with transaction.atomic():
-            if 'data' in result and result['data'].get('code') in [100, 101]:
-                order.status = Order.ORDER_STATUS_PAID
-                order.payment_ref_id = result['data'].get('ref_id')
-                order.save()
-                return Response({'success': 'Payment successfully confirmed', 'ref_id': order.payment_ref_id}, status=status.HTTP_200_OK)
-            else:
-                error_msg = result.get('errors', {}).get('message', 'Unknown error')
-                order.status = Order.ORDER_STATUS_CANCELED
-                order.save()
+        # The gateway redirect and a browser refresh can both get here; the
+        # guarded transition lets only the first one change the order.
+        if 'data' in result and result['data'].get('code') in [100, 101]:
+            ref_id = result['data'].get('ref_id')
+            with transaction.atomic():
+                results = transition_orders([order.pk], Order.ORDER_STATUS_UNPAID, Order.ORDER_STATUS_PAID, note='payment callback', ref_id=ref_id)
+                if results[order.pk] == 'updated':
+                    Order.objects.filter(pk=order.pk).update(payment_ref_id=ref_id)
+        else:
+            error_msg = result.get('errors', {}).get('message', 'Unknown error')
+            results = transition_orders([order.pk], Order.ORDER_STATUS_UNPAID, Order.ORDER_STATUS_CANCELED, note='payment callback', error=error_msg)
+            if results[order.pk] == 'updated':
                 return Response({'error': error_msg}, status=status.HTTP_400_BAD_REQUEST)
+        order.refresh_from_db()
+        return self.callback_response(order)
+
+    def callback_response(self, order):
+        """The callback's answer for an order that is no longer unpaid."""
+        if order.status == Order.ORDER_STATUS_PAID:
+            return Response({'success': 'Payment successfully confirmed', 'ref_id': order.payment_ref_id}, status=status.HTTP_200_OK)
+        return Response({'error': 'Payment unsuccessful or canceled'}, status=status.HTTP_400_BAD_REQUEST)
 
 
 class OrderItemsViewSet(ReadOnlyModelViewSet):
@@ -289,12 +341,12 @@ class OrderItemsViewSet(ReadOnlyModelViewSet):
 
     def get_queryset(self):
         order_pk = self.kwargs["order_pk"]
-        return OrderItem.objects.select_related('service__discounts').prefetch_related('service__required_fields').filter(order_id=order_pk)
+        return OrderItem.objects.select_related('service__discounts', 'service__current_price').prefetch_related('service__required_fields').filter(order_id=order_pk)
 
 
-class DiscountViewSet(ModelViewSet):
+class DiscountViewSet(ReplicaReadMixin, ModelViewSet):
     serializer_class = DiscountSerializer
-    queryset = Discount.objects.all()
+    queryset = Discount.objects.prefetch_related('applications')
     permission_classes = [IsAdminOrReadOnly]
 
 
@@ -305,21 +357,22 @@ class DiscountServicesViewSet(ModelViewSet):
     pagination_class = DefaultPagination
 
     def get_queryset(self):
-        discount_pk = self.kwargs["discount_pk"]
-        return Service.objects.filter(discounts_id=discount_pk).select_related('discounts').prefetch_related('required_fields')
+        return targeted_services(self.kwargs["discount_pk"]).select_related('discounts', 'current_price').prefetch_related('required_fields')
 
 
 class DiscountServicesCommentViewSet(ModelViewSet):
     serializer_class = CommentSerializer
     pagination_class = DefaultPagination
+    throttle_classes = [CommentThrottle]
 
     def get_queryset(self):
         discount_service_pk = self.kwargs["discount_service_pk"]
         discount_pk = self.kwargs["discount_pk"]
-        return Comment.objects.select_related("author").filter(service_id=discount_service_pk, service__discounts__id=discount_pk).all()
+        queryset = Comment.objects.select_related("author").filter(service_id=discount_service_pk, service__in=targeted_services(discount_pk))
+        return approved_for_public(queryset, self.action)
 
     def perform_create(self, serializer):
-        service = get_object_or_404(Service, pk=self.kwargs['discount_service_pk'])
+        service = get_object_or_404(targeted_services(self.kwargs['discount_pk']), pk=self.kwargs['discount_service_pk'])
         serializer.save(author=self.request.user, service=service)
 
     def get_permissions(self):
@@ -328,6 +381,32 @@ class DiscountServicesCommentViewSet(ModelViewSet):
         return [IsCommentAuthorOrAdmin()]
 
 
+class CommentModerationViewSet(GenericViewSet):
+    permission_classes = [IsAdminUser]
+    serializer_class = CommentModerationSerializer
+
+    @action(detail=False, methods=['POST'], url_path='moderate')
+    def moderate(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        new_status = serializer.validated_data['status']
+
+        with transaction.atomic():
+            comments = Comment.objects.filter(pk__in=serializer.validated_data['ids']).exclude(status=new_status)
+            changed = list(comments.select_for_update().values_list('pk', 'service_id', 'status'))
+            Comment.objects.filter(pk__in=[pk for pk, _, _ in changed]).update(status=new_status)
+
+            deltas = Counter()
+            for _, service_id, old_status in changed:
+                if new_status == Comment.COMMENT_STATUS_APPROVED:
+                    deltas[service_id] += 1
+                elif old_status == Comment.COMMENT_STATUS_APPROVED:
+                    deltas[service_id] -= 1
+            Service.apply_approved_comment_deltas(deltas)
+
+        return Response({'updated': len(changed)}, status=status.HTTP_200_OK)
+
+
 class CustomerViewSet(GenericViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = CustomerSerializer
@@ -337,6 +416,8 @@ class CustomerViewSet(GenericViewSet):
     def get_serializer_class(self):
         if self.action == 'verify_phone':
             return VerifySerializer
+        if self.action == 'summary':
+            return CustomerSummarySerializer
         return CustomerSerializer
 
     def list(self, request):
@@ -363,7 +444,7 @@ class CustomerViewSet(GenericViewSet):
 
     @action(detail=False, methods=['GET', 'PATCH', 'PUT'], url_path='me')
     def me(self, request):
-        customer = Customer.objects.select_related("user").get(user=request.user)
+        customer = request_customer(request)
 
         if request.method == 'GET':
             serializer = self.get_serializer(customer)
@@ -377,9 +458,10 @@ class CustomerViewSet(GenericViewSet):
             if new_phone == customer.phone_number:
                 return Response(serializer.data)
             code = ''.join(secrets.choice(string.digits) for _ in range(6))
-            cache.set(f'pending_phone_{request.user.id}', str(new_phone), 300)
-            cache.set(f'phone_verify_{request.user.id}', code, 300)
-            send_sms_task.delay(new_phone, f'Your verification code is: {code}')
+            otp_status, retry_after, _ = otp_store.issue(request.user.id, code, phone=new_phone)
+            if otp_status != OtpStore.ISSUED:
+                return self.otp_error_response(otp_status, retry_after)
+            send_sms(new_phone, f'Your verification code is: {code}', otp=True)
             serializer.validated_data.pop('phone_number', None)
             serializer.save()
             
@@ -391,22 +473,24 @@ class CustomerViewSet(GenericViewSet):
         serializer.save()
         return Response(serializer.data)
     
+    @action(detail=False, methods=['GET'], url_path='me/summary')
+    def summary(self, request):
+        serializer = self.get_serializer(get_customer_summary(request_customer(request).pk))
+        return Response(serializer.data)
+
     @action(detail=False, methods=['POST'], url_path='verify-phone')
     def verify_phone(self, request):
         serializer = VerifySerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         code = serializer.validated_data['code']
+        customer = request_customer(request)
 
-        stored_code = cache.get(f'phone_verify_{request.user.id}')
-        pending_phone = cache.get(f'pending_phone_{request.user.id}')
-        
-        if stored_code and code == stored_code and pending_phone:
-            customer = Customer.objects.get(user=request.user)
+        pending_phone = otp_store.verify(request.user.id, code)
+
+        if pending_phone:
             customer.phone_number = pending_phone
             customer.is_phone_verified = True
             customer.save()
-            cache.delete(f'phone_verify_{request.user.id}')
-            cache.delete(f'pending_phone_{request.user.id}')
             customer_serializer = CustomerSerializer(customer)
             return Response({'detail': 'Phone number verified and saved successfully.', 'data': customer_serializer.data}, status=status.HTTP_200_OK)
         else:
@@ -414,30 +498,81 @@ class CustomerViewSet(GenericViewSet):
     
     @action(detail=False, methods=['POST'], url_path='resend-otp')
     def resend_otp(self, request):
-        user_id = request.user.id
-        pending_phone = cache.get(f'pending_phone_{user_id}')
-        if not pending_phone:
+        code = str(secrets.randbelow(900000) + 100000)
+        otp_status, retry_after, pending_phone = otp_store.issue(request.user.id, code)
+        if otp_status != OtpStore.ISSUED:
+            return self.otp_error_response(otp_status, retry_after)
+
+        send_sms(pending_phone, f'Your new verification code is: {code}', otp=True)
+
+        return Response({'detail': 'Verification code resent successfully.'}, status=status.HTTP_200_OK)
+
+    def otp_error_response(self, otp_status, retry_after):
+        if otp_status == OtpStore.NO_PENDING_PHONE:
             return Response({'error': 'No pending phone number change. Please initiate a phone change first.'}, status=status.HTTP_400_BAD_REQUEST)
+        if otp_status == OtpStore.COOLDOWN:
+            return Response({'error': f'Please wait {retry_after} seconds before retrying.', 'remaining_seconds': retry_after}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        return Response({'error': 'Maximum retry limit reached. Please try again later.', 'remaining_seconds': retry_after}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+class ImageUploadViewSet(CreateModelMixin, RetrieveModelMixin, GenericViewSet):
+    """
+    Resumable image uploads for applications and services. Create an upload
+    with the file's name and size, PUT its bytes in chunks to ``chunk`` with
+    an ``Upload-Offset`` header, then call ``complete``; the image is checked
+    and attached by a background task. Resume after a dropped connection by
+    reading ``received`` and sending from there.
+    """
+    serializer_class = ImageUploadSerializer
+    permission_classes = [IsAdminUser]
+    queryset = ImageUpload.objects.all()
 
-        last_sent_key = f'last_otp_sent_{user_id}'
-        last_sent = cache.get(last_sent_key)
-        if last_sent:
-            time_since_last = timezone.now() - last_sent
-            if time_since_last < timedelta(seconds=60):
-                remaining = 60 - time_since_last.seconds
-                return Response({'error': f'Please wait {remaining} seconds before retrying.', 'remaining_seconds': remaining}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    def perform_create(self, serializer):
+        serializer.save(uploaded_by=self.request.user)
 
-        retry_count_key = f'otp_retry_count_{user_id}'
-        retry_count = cache.get(retry_count_key, 0)
-        if retry_count >= 5:
-            return Response({'error': 'Maximum retry limit reached. Please try again later.'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    @action(detail=True, methods=['put'], url_path='chunk')
+    def chunk(self, request, pk=None):
+        upload = self.get_object()
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.headers.get('Content-Length') or 0)
+        except (KeyError, ValueError):
+            return Response({'error': 'An integer Upload-Offset header is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < length <= settings.IMAGE_UPLOAD_MAX_CHUNK_SIZE:
+            return Response({'error': f'Chunks must be 1 to {settings.IMAGE_UPLOAD_MAX_CHUNK_SIZE} bytes.'}, status=status.HTTP_400_BAD_REQUEST)
+        if offset + length > upload.size:
+            return Response({'error': 'The chunk goes past the declared size.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        code = str(secrets.randbelow(900000) + 100000)
+        try:
+            upload = append_chunk(upload.pk, offset, request.body)
+        except UploadOffsetMismatch as e:
+            upload = e.args[0]
+            return Response(self.get_serializer(upload).data, status=status.HTTP_409_CONFLICT)
+        return Response(self.get_serializer(upload).data, status=status.HTTP_200_OK)
 
-        cache.set(f'phone_verify_{user_id}', code, 300)
-        cache.set(last_sent_key, timezone.now(), 3600)
-        cache.set(retry_count_key, retry_count + 1, 3600)
+    @action(detail=True, methods=['post'], url_path='complete')
+    def complete(self, request, pk=None):
+        from .tasks import process_image_upload_task
 
-        send_sms_task.delay(pending_phone, f'Your new verification code is: {code}')
+        with transaction.atomic():
+            upload = ImageUpload.objects.select_for_update().get(pk=self.get_object().pk)
+            if upload.status != ImageUpload.STATUS_UPLOADING or upload.received != upload.size:
+                return Response(self.get_serializer(upload).data, status=status.HTTP_409_CONFLICT)
+            upload.status = ImageUpload.STATUS_PROCESSING
+            upload.save(update_fields=['status'])
+            transaction.on_commit(lambda: process_image_upload_task.delay(str(upload.pk)))
+        return Response(self.get_serializer(upload).data, status=status.HTTP_202_ACCEPTED)
+
+
+class BatchView(APIView):
+    """
+    Runs several store API calls in one round trip. The batch request is
+    authenticated once and every sub-request runs as that user.
+    """
+    permission_classes = [AllowAny]
+    serializer_class = BatchSerializer
 
-        return Response({'detail': 'Verification code resent successfully.'}, status=status.HTTP_200_OK)
\ No newline at end of file
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({'responses': run_batch(request, serializer.validated_data['requests'])})
@@ -0,0 +1,80 @@
+import logging
+import time
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import connections
+from django.urls import get_resolver
+
+from rest_framework.serializers import ModelSerializer
+
+
+logger = logging.getLogger(__name__)
+
+_cache_warmers = []
+
+
+def cache_warmer(func):
+    """Register ``func`` to prime a cache before a worker takes traffic."""
+    _cache_warmers.append(func)
+    return func
+
+
+def warm_up_code_paths():
+    """
+    Work that only depends on code: resolve every URL pattern and build the
+    field caches of every model's ``_meta``. Safe to run in the gunicorn
+    master with ``preload_app`` so forked workers inherit the result.
+    """
+    get_resolver().reverse_dict  # populates the resolver's lookup tables
+
+    for model in apps.get_models():
+        model._meta.get_fields()
+        model._meta._relation_tree
+
+
+def warm_up_serializers():
+    """
+    Serialize one stored instance per model serializer, so the imports,
+    field lookups and query compilation a first request would pay for have
+    happened. DRF builds ``fields`` per serializer instance, so only real
+    serialization warms anything.
+    """
+    from . import serializers
+
+    for value in vars(serializers).values():
+        if not (isinstance(value, type) and issubclass(value, ModelSerializer) and value.__module__ == serializers.__name__):
+            continue
+        try:
+            instance = value.Meta.model.objects.first()
+            if instance is not None:
+                value(instance, context={}).data
+        except Exception:
+            logger.debug("Could not warm up %s", value.__name__, exc_info=True)
+
+
+def warm_up_connections():
+    for alias in connections:
+        connections[alias].ensure_connection()
+    cache.get('warm-up')
+
+
+def warm_up_caches():
+    for warmer in _cache_warmers:
+        try:
+            warmer()
+        except Exception:
+            logger.exception("Cache warmer %s failed", warmer.__name__)
+
+
+def warm_up():
+    started = time.perf_counter()
+    warm_up_code_paths()
+    try:
+        warm_up_connections()
+        warm_up_serializers()
+        warm_up_caches()
+    finally:
+        # Hand the warm-up connections back to the pool for request threads.
+        connections.close_all()
+    logger.info("Worker warmed up in %.0fms", (time.perf_counter() - started) * 1000)